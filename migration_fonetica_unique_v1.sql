@@ -0,0 +1,28 @@
+-- ==========================================
+-- MIGRATION: ÍNDICE ÚNICO EM termo_errado (FONÉTICA)
+-- ==========================================
+-- Permite que a calibragem grave todas as regras fonéticas num único upsert
+-- (on_conflict=termo_errado, ignorando termos já cadastrados) em vez de um select + insert por regra.
+-- Execute no SQL Editor do Supabase.
+
+-- Remove duplicatas existentes, mantendo o cadastro mais antigo de cada termo
+DELETE FROM nw_treinamento_fonetica a
+USING nw_treinamento_fonetica b
+WHERE a.termo_errado = b.termo_errado
+  AND (a.criado_em > b.criado_em OR (a.criado_em = b.criado_em AND a.id > b.id));
+
+CREATE UNIQUE INDEX IF NOT EXISTS nw_treinamento_fonetica_termo_errado_key
+  ON nw_treinamento_fonetica (termo_errado);
+
+DO $$
+BEGIN
+  IF to_regclass('nw3d_treinamento_fonetica') IS NOT NULL THEN
+    DELETE FROM nw3d_treinamento_fonetica a
+    USING nw3d_treinamento_fonetica b
+    WHERE a.termo_errado = b.termo_errado
+      AND (a.criado_em > b.criado_em OR (a.criado_em = b.criado_em AND a.id > b.id));
+
+    CREATE UNIQUE INDEX IF NOT EXISTS nw3d_treinamento_fonetica_termo_errado_key
+      ON nw3d_treinamento_fonetica (termo_errado);
+  END IF;
+END $$;
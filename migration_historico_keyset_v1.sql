@@ -0,0 +1,21 @@
+-- ==========================================
+-- MIGRATION: ÍNDICE DE PAGINAÇÃO DO HISTÓRICO (KEYSET)
+-- ==========================================
+-- A página Histórico lê páginas ordenadas por (criado_em desc, id desc) a partir da última linha
+-- vista. Com este índice, cada página é uma leitura curta no índice, sem varrer nem ordenar a tabela.
+-- Execute no SQL Editor do Supabase.
+
+CREATE INDEX IF NOT EXISTS nw_historico_roteiros_criado_em_id_idx
+  ON nw_historico_roteiros (criado_em DESC, id DESC);
+
+DO $$
+DECLARE
+  p text;
+BEGIN
+  FOREACH p IN ARRAY ARRAY['nw3d_', 'social_', 'review_'] LOOP
+    IF to_regclass(p || 'historico_roteiros') IS NOT NULL THEN
+      EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON %I (criado_em DESC, id DESC)',
+                     p || 'historico_roteiros_criado_em_id_idx', p || 'historico_roteiros');
+    END IF;
+  END LOOP;
+END $$;
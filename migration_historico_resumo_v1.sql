@@ -0,0 +1,24 @@
+-- ==========================================
+-- MIGRATION: RESUMO DO HISTÓRICO NO BANCO (RPC)
+-- ==========================================
+-- As métricas da página Histórico (total, custo, modelo mais usado) e as opções dos filtros
+-- saem de um único GROUP BY no banco: o app recebe uma linha por (modo, modelo), e não
+-- uma linha por roteiro gerado.
+-- Execute no SQL Editor do Supabase.
+
+CREATE OR REPLACE FUNCTION resumo_historico(p_tabela text)
+RETURNS TABLE (modo_trabalho text, modelo_llm text, registros bigint, custo numeric)
+LANGUAGE plpgsql
+STABLE
+AS $$
+BEGIN
+  -- Só tabelas de histórico (<prefixo>historico_roteiros); o nome entra na consulta dinâmica
+  IF p_tabela !~ '^[a-z0-9]+_historico_roteiros$' OR to_regclass(p_tabela) IS NULL THEN
+    RAISE EXCEPTION 'Tabela de histórico inválida: %', p_tabela;
+  END IF;
+
+  RETURN QUERY EXECUTE format(
+    'SELECT modo_trabalho::text, modelo_llm::text, count(*)::bigint, coalesce(sum(custo_estimado_brl), 0)::numeric
+       FROM %I GROUP BY 1, 2', p_tabela);
+END;
+$$;
@@ -0,0 +1,71 @@
+-- ==========================================
+-- MIGRATION: NUMERAÇÃO GLOBAL DOS ROTEIROS (CONTADOR + RPC)
+-- ==========================================
+-- Substitui o count(*) exato em <prefixo>historico_roteiros (varredura da tabela a cada roteiro)
+-- por um contador por prefixo. O app reserva um bloco de N números por lote numa única chamada;
+-- o UPDATE trava só a linha do prefixo, então dois usuários gerando juntos nunca recebem o mesmo número.
+-- Execute no SQL Editor do Supabase.
+
+CREATE TABLE IF NOT EXISTS contador_roteiros (
+  prefixo text PRIMARY KEY,
+  ultimo bigint NOT NULL DEFAULT 0,
+  atualizado_em timestamp with time zone DEFAULT timezone('utc'::text, now()) NOT NULL
+);
+
+ALTER TABLE contador_roteiros ENABLE ROW LEVEL SECURITY;
+
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_policies WHERE policyname = 'Allow access' AND tablename = 'contador_roteiros') THEN
+    CREATE POLICY "Allow access" ON contador_roteiros FOR ALL USING (true);
+  END IF;
+END $$;
+
+-- Reserva p_quantidade números consecutivos para o prefixo e devolve o primeiro do bloco.
+-- Na primeira chamada de um prefixo o contador parte do total atual do histórico
+-- (mesma numeração de antes da migração); depois disso é O(1).
+CREATE OR REPLACE FUNCTION reservar_numeros_roteiro(p_prefixo text, p_quantidade int DEFAULT 1)
+RETURNS bigint
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_ultimo bigint;
+  v_inicial bigint := 0;
+BEGIN
+  IF p_quantidade IS NULL OR p_quantidade < 1 THEN
+    RAISE EXCEPTION 'p_quantidade deve ser >= 1';
+  END IF;
+
+  UPDATE contador_roteiros
+     SET ultimo = ultimo + p_quantidade, atualizado_em = timezone('utc'::text, now())
+   WHERE prefixo = p_prefixo
+  RETURNING ultimo INTO v_ultimo;
+
+  IF NOT FOUND THEN
+    IF to_regclass(p_prefixo || 'historico_roteiros') IS NOT NULL THEN
+      EXECUTE format('SELECT count(*) FROM %I', p_prefixo || 'historico_roteiros') INTO v_inicial;
+    END IF;
+    -- Duas primeiras chamadas simultâneas: a segunda cai no ON CONFLICT e soma ao que a primeira gravou
+    INSERT INTO contador_roteiros (prefixo, ultimo) VALUES (p_prefixo, v_inicial + p_quantidade)
+    ON CONFLICT (prefixo) DO UPDATE
+      SET ultimo = contador_roteiros.ultimo + p_quantidade, atualizado_em = timezone('utc'::text, now())
+    RETURNING ultimo INTO v_ultimo;
+  END IF;
+
+  RETURN v_ultimo - p_quantidade + 1;
+END;
+$$;
+
+-- Inicializa os prefixos existentes (opcional: a função também inicializa sob demanda)
+INSERT INTO contador_roteiros (prefixo, ultimo)
+SELECT 'nw_', count(*) FROM nw_historico_roteiros
+ON CONFLICT (prefixo) DO NOTHING;
+
+DO $$
+BEGIN
+  IF to_regclass('nw3d_historico_roteiros') IS NOT NULL THEN
+    INSERT INTO contador_roteiros (prefixo, ultimo)
+    SELECT 'nw3d_', count(*) FROM nw3d_historico_roteiros
+    ON CONFLICT (prefixo) DO NOTHING;
+  END IF;
+END $$;
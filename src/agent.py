@@ -1,10 +1,25 @@
 import os
 import json
 import glob
-from google import genai
+from concurrent.futures import ThreadPoolExecutor
 from google.genai import types
-from openai import OpenAI
 from dotenv import load_dotenv
+import time
+import hashlib
+from src.cache import contexto_cache, PersistentCache, VersionedTTLCache
+from src.clients import get_gemini_client, get_openai_client, get_async_openai_client, PUTER_BASE_URL, OPENROUTER_BASE_URL, ZAI_BASE_URL, KIMI_BASE_URL
+from src.budget import (
+    SecaoPrompt, ajustar_secoes, estimar_tokens, registrar_uso, prever_lote, chars_ficha_medio, tokens_saida_medio,
+    registrar_prompt, chars_prompt_medio, tokens_de_chars
+)
+from src.retrieval import ContextoConhecimento, ColecaoRecuperavel, SECOES_RECUPERADAS, RETRIEVAL_POOL, COLUNAS_RECUPERADAS
+from src.fonetica import DicionarioFonetico, aplicar_fonetica
+from src.roteiro import parse_roteiro
+from src.product_sheet import sheet_de
+from src.router import router, Rota, TodasRotasFalharam
+from src.hedging import latencias, HEDGE_ATIVO
+from src.prompt_cache import prefix_cache_padrao, hash_prefixo
+from src.streaming import GeracaoStream, UsoTokens
 
 load_dotenv()
 
@@ -56,73 +71,102 @@ PROVIDER_KEY_MAP = {
     "kimi": "KIMI_API_KEY",
 }
 
+# Resultados de calibragem/memória indexados pelo hash do conteúdo enviado (prompt + textos)
+CALIBRACAO_CACHE_TTL_S = int(os.environ.get("CALIBRACAO_CACHE_TTL_S", str(30 * 24 * 3600)))
+calibracao_cache = PersistentCache("calibracao", CALIBRACAO_CACHE_TTL_S)
+# Previsões de lote por (modelo, prefixo, modo, n): a tela de pré-geração pede a cada rerun
+previsao_cache = VersionedTTLCache(int(os.environ.get("PREVISAO_TTL_S", "300")))
+
+# Modelo disparado em paralelo quando a geração passa do p95 de latência do modelo escolhido.
+# Opt-in (vazio = sem hedge) e só vale para modelos do mesmo provedor: o hedge nunca leva o prompt
+# de um usuário de modelo gratuito para um provedor pago.
+HEDGE_MODELO_SECUNDARIO = os.environ.get("HEDGE_MODELO_SECUNDARIO", "")
+# Timeout da geração enquanto não há latências observadas para o modelo
+GERACAO_TIMEOUT_MS = 120000
+
+
+def _hash_conteudo(*partes) -> str:
+    """sha256 das partes (separadas por um byte nulo para não colidirem ao concatenar)."""
+    h = hashlib.sha256()
+    for parte in partes:
+        h.update(str(parte).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def _texto_ficha(scraped_data) -> str:
+    return scraped_data.get("text", "") if isinstance(scraped_data, dict) else str(scraped_data)
+
 def calcular_custo_brl(model_id, tokens_in, tokens_out):
     """Calcula o custo estimado em BRL com base nos tokens consumidos."""
     pricing = PRICING_USD_PER_1M.get(model_id, PRICING_USD_PER_1M["gemini-3-flash-preview"])
     custo_usd = (tokens_in / 1_000_000 * pricing["input"]) + (tokens_out / 1_000_000 * pricing["output"])
     return round(custo_usd * USD_TO_BRL, 6)
 
+def _get_key(key_name):
+    # Tenta Env -> Tenta Secrets (Streamlit)
+    val = os.environ.get(key_name)
+    if not val:
+        try:
+            import streamlit as st
+            val = st.secrets.get(key_name)
+        except: pass
+    return val
+
+
 class RoteiristaAgent:
     def __init__(self, supabase_client=None, model_id="gemini-3-flash-preview", table_prefix="nw_"):
         self.model_id = model_id
+        # ID como escolhido na interface (com prefixo do provedor), para recriar o agente depois
+        self.model_ref = model_id
         self.table_prefix = table_prefix
         self.supabase = supabase_client
+        # Dispara as consultas de conhecimento em paralelo quando o contexto não está em cache
+        self.contexto_paralelo = os.environ.get("CONTEXTO_FETCH_PARALELO", "1") != "0"
+        # Aplica o dicionário de fonética nas falas depois da geração (passada local, sem LLM)
+        self.fonetica_pos_processar = os.environ.get("FONETICA_POS_PROCESSAR", "1") != "0"
+        self._aio = None
+        self._hedge = None
         self.client_gemini = None
         self.client_openai = None
         self.provider = "gemini"
-
-        def _get_key(key_name):
-            # Tenta Env -> Tenta Secrets (Streamlit)
-            val = os.environ.get(key_name)
-            if not val:
-                try:
-                    import streamlit as st
-                    val = st.secrets.get(key_name)
-                except: pass
-            return val
+        # Cache do prefixo estático do prompt no provedor (Gemini explícito; None = sempre inline)
+        self.prefix_cache = prefix_cache_padrao()
+        self._conta_gemini = ""
 
         if self.model_id.startswith("gemini"):
             self.provider = "gemini"
             api_key = _get_key("GEMINI_API_KEY")
             if not api_key:
                 raise ValueError("GEMINI_API_KEY não encontrada!")
-            self.client_gemini = genai.Client(api_key=api_key)
+            self.client_gemini = get_gemini_client(api_key)
+            self._conta_gemini = hash_prefixo(api_key)[:12]
         elif self.model_id.startswith("puter/"):
             self.provider = "puter"
             puter_key = _get_key("PUTER_API_KEY")
             if not puter_key:
                 raise ValueError("PUTER_API_KEY não encontrada!")
-            self.client_openai = OpenAI(
-                api_key=puter_key,
-                base_url="https://api.puter.com/puterai/openai/v1/"
-            )
+            self.client_openai = get_openai_client(puter_key, PUTER_BASE_URL)
             self.model_id = self.model_id.replace("puter/", "")
         elif self.model_id.startswith("openai/"):
             self.provider = "openai"
             openai_key = _get_key("OPEN_AI_KEY") or _get_key("OPENAI_API_KEY")
             if not openai_key:
                 raise ValueError("OPENAI_API_KEY não encontrada!")
-            self.client_openai = OpenAI(api_key=openai_key)
+            self.client_openai = get_openai_client(openai_key)
             self.model_id = self.model_id.replace("openai/", "")
         elif self.model_id.startswith("openrouter/"):
             self.provider = "openrouter"
             openrouter_key = _get_key("OPENROUTER_API_KEY")
             if not openrouter_key:
                 raise ValueError("OPENROUTER_API_KEY não encontrada!")
-            self.client_openai = OpenAI(
-                api_key=openrouter_key,
-                base_url="https://openrouter.ai/api/v1"
-            )
+            self.client_openai = get_openai_client(openrouter_key, OPENROUTER_BASE_URL)
             self.model_id = self.model_id.replace("openrouter/", "")
         elif self.model_id.startswith("zai/"):
             self.provider = "zai"
             zai_key = _get_key("ZAI_API_KEY")
             if not zai_key:
                 raise ValueError("ZAI_API_KEY não encontrada!")
-            self.client_openai = OpenAI(
-                api_key=zai_key,
-                base_url="https://api.z.ai/api/paas/v4/"
-            )
+            self.client_openai = get_openai_client(zai_key, ZAI_BASE_URL)
             self.model_id = self.model_id.replace("zai/", "")
             self.model_id = self.model_id.replace("zai/", "")
         elif self.model_id.startswith("kimi/"):
@@ -130,10 +174,7 @@ class RoteiristaAgent:
             kimi_key = os.environ.get("KIMI_API_KEY")
             if not kimi_key:
                 raise ValueError("KIMI_API_KEY não encontrada!")
-            self.client_openai = OpenAI(
-                api_key=kimi_key,
-                base_url="https://api.moonshot.ai/v1"
-            )
+            self.client_openai = get_openai_client(kimi_key, KIMI_BASE_URL)
             self.model_id = self.model_id.replace("kimi/", "")
 
         # Carrega a base de conhecimento estática (Prompts modulares e fonética base)
@@ -148,6 +189,38 @@ class RoteiristaAgent:
         # Ouro e Calibragem agora são 100% dinâmicos via Supabase
         self.few_shot_examples = [] 
 
+    @property
+    def aio(self):
+        """API assíncrona deste agente (ver src/async_agent.py), no estilo `client.aio` do google-genai."""
+        if self._aio is None:
+            from src.async_agent import AsyncRoteiristaAgent
+            self._aio = AsyncRoteiristaAgent(self)
+        return self._aio
+
+    @property
+    def rota(self):
+        """Nome da rota deste modelo no roteador e nas estatísticas de latência (provedor/modelo)."""
+        return f"{self.provider}/{self.model_id}"
+
+    def _agente_hedge(self):
+        """
+        Agente do modelo secundário do hedge. None se não configurado, igual ao principal, sem chave
+        ou de outro provedor que não o do modelo escolhido.
+        """
+        if not HEDGE_ATIVO or not HEDGE_MODELO_SECUNDARIO or HEDGE_MODELO_SECUNDARIO in (self.model_ref, self.model_id):
+            return None
+        if self._hedge is None:
+            try:
+                self._hedge = RoteiristaAgent(self.supabase, model_id=HEDGE_MODELO_SECUNDARIO, table_prefix=self.table_prefix)
+            except ValueError as e:
+                print(f"[HEDGE] Modelo secundário {HEDGE_MODELO_SECUNDARIO} indisponível: {e}")
+                self._hedge = False
+            else:
+                if self._hedge.provider != self.provider:
+                    print(f"[HEDGE] {HEDGE_MODELO_SECUNDARIO} é de outro provedor que {self.model_ref}; hedge desligado.")
+                    self._hedge = False
+        return self._hedge or None
+
     def _load_file(self, filepath, fallback):
         try:
             with open(filepath, 'r', encoding='utf-8') as f:
@@ -163,11 +236,10 @@ class RoteiristaAgent:
             return fallback
 
 
-    def _fetch_supabase_context(self, modo_trabalho: str = ""):
-        """Busca aprendizado dinâmico no Supabase."""
-        sb_parts = []
+    def _conhecimento(self, modo_trabalho: str = "") -> ContextoConhecimento | None:
+        """Busca aprendizado dinâmico no Supabase (com cache de processo por prefixo do modo)."""
         if not self.supabase:
-            return ""
+            return None
             
         # Determina o prefixo da tabela baseado no modo selecionado
         modo_u = str(modo_trabalho).upper()
@@ -179,84 +251,206 @@ class RoteiristaAgent:
             prefix = "3d_"
         else:
             prefix = "nw_"
-        
+
+        cached = contexto_cache.get(prefix)
+        if cached is not None:
+            return cached
+
+        # Guarda a versão antes da busca: se houver calibragem no meio, o resultado não é cacheado
+        versao = contexto_cache.version
+        conhecimento, completo = self._carregar_contexto_supabase(prefix)
+        if completo:
+            contexto_cache.set(prefix, conhecimento, versao)
+        return conhecimento
+
+    def _fetch_supabase_context(self, modo_trabalho: str = ""):
+        """Parte estática do aprendizado (igual para todos os SKUs; vai no prefixo cacheável)."""
+        conhecimento = self._conhecimento(modo_trabalho)
+        return conhecimento.estatico if conhecimento else ""
+
+    def _contexto_recuperado(self, modo_trabalho: str = "", consulta: str = "", categoria_id=None) -> str:
+        """Roteiros Ouro, nuances e lições de imagem mais relevantes para a ficha/categoria do SKU."""
+        conhecimento = self._conhecimento(modo_trabalho)
+        if not conhecimento:
+            return ""
+        parts = []
+        for nome in SECOES_RECUPERADAS:
+            colecao = conhecimento.colecoes.get(nome)
+            if not colecao:
+                continue
+            try:
+                parts.extend(self._renderizar_secao(nome, colecao.selecionar(
+                    consulta, categoria_id=categoria_id, categoria_generica=conhecimento.categoria_generica
+                )))
+            except Exception as e:
+                print(f"Error ranking Supabase context ({nome}): {e}")
+        return "\n".join(parts)
+
+    def _regras_fonetica(self, modo_trabalho: str = "", *textos) -> str:
+        """Regras de fonética do Supabase cujo termo_errado aparece nos textos (ficha, roteiros gerados)."""
+        conhecimento = self._conhecimento(modo_trabalho)
+        if not conhecimento or not conhecimento.fonetica:
+            return ""
         try:
-            # 1. Roteiros Ouro (O "Norte" da Redação - Exemplos de Elite)
-            res_ouro = self.supabase.table(f"{prefix}roteiros_ouro").select("*").order('criado_em', desc=True).limit(10).execute()
-            if res_ouro.data:
-                sb_parts.append("\n**REFERÊNCIAS DE ELITE (ESTE É O PADRÃO OURO A SER SEGUIDO):**")
-                for r in res_ouro.data:
-                    sb_parts.append(f"- Produto: {r['titulo_produto']}\n  Roteiro Perfeito (Target): {r['roteiro_perfeito']}")
+            regras = conhecimento.fonetica.regras_para(*textos)
+        except Exception as e:
+            print(f"Error matching phonetic rules: {e}")
+            return ""
+        return "\n".join(self._renderizar_secao("fonetica", regras))
 
+    def _pos_processar_fonetica(self, roteiro: str, modo_trabalho: str = "") -> str:
+        """Anota localmente, nas falas, as pronúncias do dicionário que o modelo deixou de aplicar."""
+        if not self.fonetica_pos_processar or not roteiro or roteiro.startswith("ERRO NA GERAÇÃO"):
+            return roteiro
+        conhecimento = self._conhecimento(modo_trabalho)
+        if not conhecimento or not conhecimento.fonetica:
+            return roteiro
+        try:
+            roteiro, aplicados = aplicar_fonetica(roteiro, conhecimento.fonetica)
+        except Exception as e:
+            print(f"[WARN] Error applying phonetic rules: {e}")
+            return roteiro
+        if aplicados:
+            print(f"[FONETICA] Pronúncia anotada localmente: {', '.join(aplicados)}")
+        return roteiro
+
+    def _consultas_contexto(self, prefix: str):
+        """Lista ordenada (nome, consulta) das tabelas de conhecimento usadas no contexto."""
+        sb = self.supabase
+        return [
+            # 1. Roteiros Ouro (O "Norte" da Redação - Exemplos de Elite)
+            ("ouro", lambda: sb.table(f"{prefix}roteiros_ouro").select(COLUNAS_RECUPERADAS["ouro"]).order('criado_em', desc=True).limit(RETRIEVAL_POOL).execute()),
             # 2. Ajustes de Persona (SHARED)
-            res_pers = self.supabase.table("nw_treinamento_persona_lu").select("*").order('criado_em', desc=True).limit(15).execute()
-            if res_pers.data:
-                sb_parts.append("\n**AJUSTES DE PERSONA (LIÇÕES APRENDIDAS):**")
-                for p in res_pers.data:
-                    sb_parts.append(f"- Pilar: {p['pilar_persona']}\n  Erro Anterior: {p['erro_cometido']}\n  Correção Master: {p['texto_corrigido_humano']}")
-
-            # 3. Novas Regras Fonéticas (SHARED ACROSS MODES)
-            res_fon = self.supabase.table("nw_treinamento_fonetica").select("*").execute()
-            if res_fon.data:
-                sb_parts.append("\n**NOVAS REGRAS DE FONÉTICA (OBRIGATÓRIO):**")
-                for f in res_fon.data:
-                    sb_parts.append(f"- {f['termo_errado']} -> ({f['termo_corrigido']})")
-                    
+            ("persona", lambda: sb.table("nw_treinamento_persona_lu").select("*").order('criado_em', desc=True).limit(15).execute()),
+            # 3. Novas Regras Fonéticas (SHARED ACROSS MODES) - compiladas em dicionário, não vão inteiras no prompt
+            ("fonetica", lambda: sb.table("nw_treinamento_fonetica").select("termo_errado, termo_corrigido").execute()),
             # 4. Estruturas Aprovadas (Aberturas e Fechamentos/CTAs)
-            res_est = self.supabase.table(f"{prefix}treinamento_estruturas").select("*").order('criado_em', desc=True).limit(30).execute()
-            if res_est.data:
-                sb_parts.append("\n**ESTRUTURAS APROVADAS PARA INSPIRAÇÃO (HOOKS E CTAs):**")
-                for est in res_est.data:
-                    sb_parts.append(f"- [{est['tipo_estrutura']}] {est['texto_ouro']}")
-                    
+            ("estruturas", lambda: sb.table(f"{prefix}treinamento_estruturas").select("*").order('criado_em', desc=True).limit(30).execute()),
             # 5. Nuances de Linguagem (O que evitar e como melhorar)
-            res_nuan = self.supabase.table(f"{prefix}treinamento_nuances").select("*").limit(20).order('criado_em', desc=True).execute()
-            if res_nuan.data:
-                sb_parts.append("\n**NUANCES E REFINAMENTO DE ESTILO (LIÇÕES DE REDAÇÃO):**")
-                for n in res_nuan.data:
-                    refinamento = f"- EVITE: '{n['frase_ia']}'\n  POR QUE: {n['analise_critica']}"
-                    if n.get('exemplo_ouro'):
-                        refinamento += f"\n  FORMA IDEAL: '{n['exemplo_ouro']}'"
-                    sb_parts.append(refinamento)
-
+            ("nuances", lambda: sb.table(f"{prefix}treinamento_nuances").select(COLUNAS_RECUPERADAS["nuances"]).limit(RETRIEVAL_POOL).order('criado_em', desc=True).execute()),
             # 6. Memória de Calibragem (Lições Recentes da Calibragem)
-            res_fb = self.supabase.table(f"{prefix}roteiros_ouro").select("aprendizado").neq("aprendizado", "null").order('criado_em', desc=True).limit(15).execute()
-            if res_fb.data:
-                valid_mems = [f for f in res_fb.data if f.get('aprendizado') and f['aprendizado'].strip()]
-                if valid_mems:
-                    sb_parts.append("\n**LIÇÕES RECENTES DA CALIBRAGEM (NÃO REPITA ESTES ERROS):**")
-                    for fb in valid_mems:
-                        sb_parts.append(f"- {fb['aprendizado']}")
-
+            ("memoria", lambda: sb.table(f"{prefix}roteiros_ouro").select("aprendizado").neq("aprendizado", "null").order('criado_em', desc=True).limit(15).execute()),
             # 7. Calibragem Visual (Descrição de Imagens)
-            res_img = self.supabase.table(f"{prefix}treinamento_imagens").select("*").limit(15).order('criado_em', desc=True).execute()
-            if res_img.data:
-                sb_parts.append("\n**DIRETRIZES VISUAIS (COMO DESCREVER IMAGENS):**")
-                for img in res_img.data:
-                    sb_parts.append(f"- EVITE: '{img['descricao_ia']}'\n  USE PREFERENCIALMENTE: '{img['descricao_humano']}'\n  MOTIVO: {img['aprendizado']}")
-        except Exception as e:
-            print(f"Error fetching Supabase context: {e}")
-            
-        return "\n".join(sb_parts)
+            ("imagens", lambda: sb.table(f"{prefix}treinamento_imagens").select(COLUNAS_RECUPERADAS["imagens"]).limit(RETRIEVAL_POOL).order('criado_em', desc=True).execute()),
+            # 8. Categorias (só para achar a "Genérico", que não recebe bônus na recuperação dos Ouro)
+            ("categorias", lambda: sb.table("nw_categorias").select("id, nome").execute()),
+        ]
 
-    def _build_context(self, modo_trabalho: str = ""):
-        """Monta o contexto completo: Prompt + KB Estratégica + Fonética + Few-Shot + Supabase."""
+    def _renderizar_secao(self, nome: str, rows: list) -> list:
+        """Converte as linhas de uma tabela de conhecimento no trecho de prompt correspondente."""
         parts = []
+        if not rows:
+            return parts
+        if nome == "ouro":
+            parts.append("\n**REFERÊNCIAS DE ELITE (ESTE É O PADRÃO OURO A SER SEGUIDO):**")
+            for r in rows:
+                parts.append(f"- Produto: {r['titulo_produto']}\n  Roteiro Perfeito (Target): {r['roteiro_perfeito']}")
+        elif nome == "persona":
+            parts.append("\n**AJUSTES DE PERSONA (LIÇÕES APRENDIDAS):**")
+            for p in rows:
+                parts.append(f"- Pilar: {p['pilar_persona']}\n  Erro Anterior: {p['erro_cometido']}\n  Correção Master: {p['texto_corrigido_humano']}")
+        elif nome == "fonetica":
+            parts.append("\n**NOVAS REGRAS DE FONÉTICA (OBRIGATÓRIO):**")
+            for f in rows:
+                parts.append(f"- {f['termo_errado']} -> ({f['termo_corrigido']})")
+        elif nome == "estruturas":
+            parts.append("\n**ESTRUTURAS APROVADAS PARA INSPIRAÇÃO (HOOKS E CTAs):**")
+            for est in rows:
+                parts.append(f"- [{est['tipo_estrutura']}] {est['texto_ouro']}")
+        elif nome == "nuances":
+            parts.append("\n**NUANCES E REFINAMENTO DE ESTILO (LIÇÕES DE REDAÇÃO):**")
+            for n in rows:
+                refinamento = f"- EVITE: '{n['frase_ia']}'\n  POR QUE: {n['analise_critica']}"
+                if n.get('exemplo_ouro'):
+                    refinamento += f"\n  FORMA IDEAL: '{n['exemplo_ouro']}'"
+                parts.append(refinamento)
+        elif nome == "memoria":
+            valid_mems = [f for f in rows if f.get('aprendizado') and f['aprendizado'].strip()]
+            if valid_mems:
+                parts.append("\n**LIÇÕES RECENTES DA CALIBRAGEM (NÃO REPITA ESTES ERROS):**")
+                for fb in valid_mems:
+                    parts.append(f"- {fb['aprendizado']}")
+        elif nome == "imagens":
+            parts.append("\n**DIRETRIZES VISUAIS (COMO DESCREVER IMAGENS):**")
+            for img in rows:
+                parts.append(f"- EVITE: '{img['descricao_ia']}'\n  USE PREFERENCIALMENTE: '{img['descricao_humano']}'\n  MOTIVO: {img['aprendizado']}")
+        return parts
+
+    def _carregar_contexto_supabase(self, prefix: str):
+        """
+        Executa as consultas de conhecimento no Supabase. Retorna (ContextoConhecimento, completo).
+        Ouro, nuances e imagens viram coleções ranqueáveis (um pool recente maior, filtrado por
+        relevância a cada SKU); a fonética vira um dicionário compilado (só as regras presentes no
+        texto entram no prompt); as demais seções são renderizadas no texto estático.
+        Em modo paralelo as oito consultas saem juntas (latência ~ a da consulta mais lenta);
+        uma tabela com erro degrada apenas a própria seção.
+        """
+        consultas = self._consultas_contexto(prefix)
+        resultados = {}
+        completo = True
+
+        def _executar(nome, consulta):
+            try:
+                res = consulta()
+                return nome, (res.data or []), None
+            except Exception as e:
+                return nome, [], e
+
+        if self.contexto_paralelo:
+            with ThreadPoolExecutor(max_workers=len(consultas), thread_name_prefix="ctx") as pool:
+                execucoes = [pool.submit(_executar, nome, consulta) for nome, consulta in consultas]
+                saidas = [f.result() for f in execucoes]
+        else:
+            saidas = [_executar(nome, consulta) for nome, consulta in consultas]
+
+        for nome, rows, erro in saidas:
+            if erro is not None:
+                print(f"Error fetching Supabase context ({nome}): {erro}")
+                completo = False
+            resultados[nome] = rows
+
+        # Monta as seções sempre na ordem original, independente da ordem de chegada
+        sb_parts = []
+        colecoes = {}
+        fonetica = None
+        categoria_generica = None
+        for nome, _ in consultas:
+            if nome == "categorias":
+                categoria_generica = next((c['id'] for c in resultados.get(nome, []) if 'Genérico' in (c.get('nome') or '')), None)
+                continue
+            if nome in SECOES_RECUPERADAS:
+                colecoes[nome] = ColecaoRecuperavel(nome, resultados.get(nome, []))
+                continue
+            if nome == "fonetica":
+                fonetica = DicionarioFonetico(resultados.get(nome, []))
+                continue
+            try:
+                sb_parts.extend(self._renderizar_secao(nome, resultados.get(nome, [])))
+            except Exception as e:
+                print(f"Error rendering Supabase context ({nome}): {e}")
+                completo = False
+
+        return ContextoConhecimento("\n".join(sb_parts), colecoes, fonetica, categoria_generica), completo
+
+    def _secoes_contexto(self, modo_trabalho: str = ""):
+        """Seções do contexto em ordem, como (nome, texto): base, modo, local (fonética/few-shot) e conhecimento."""
+        secoes = []
 
         # 1. System Prompt Base
-        parts.append(self.prompts.get("base", ""))
+        secoes.append(("base", self.prompts.get("base", "")))
         
         # 2. System Prompt Específico do Modo
         modo_u = str(modo_trabalho).upper()
         if "SOCIAL" in modo_u:
-            parts.append(self.prompts.get("social", ""))
+            secoes.append(("modo", self.prompts.get("social", "")))
         elif "3D" in modo_u:
-            parts.append(self.prompts.get("3d", ""))
+            secoes.append(("modo", self.prompts.get("3d", "")))
         elif "REVIEW" in modo_u:
-            parts.append(self.prompts.get("review", ""))
+            secoes.append(("modo", self.prompts.get("review", "")))
         else:
-            parts.append(self.prompts.get("nw", ""))
+            secoes.append(("modo", self.prompts.get("nw", "")))
 
+        parts = []
         # 2. Dicionário de fonética (Estático)
         if self.phonetics:
             parts.append("\n**DICIONÁRIO DE FONÉTICA BASE (PADRÃO):**")
@@ -270,13 +464,19 @@ class RoteiristaAgent:
                 parts.append(f"\n--- EXEMPLO: {ex.get('produto', '')} ---")
                 parts.append(f"❌ TEXTO IA: {ex.get('output_antes_ia_ruim', '')}")
                 parts.append(f"✅ COMO O BRENO QUER: {ex.get('output_depois_breno_aprovado', '')}")
+        if parts:
+            secoes.append(("local", "\n".join(parts)))
 
         # 3. Aprendizado em Tempo Real (Supabase)
         supabase_context = self._fetch_supabase_context(modo_trabalho)
         if supabase_context:
-            parts.append(supabase_context)
+            secoes.append(("conhecimento", supabase_context))
 
-        return "\n".join(parts)
+        return secoes
+
+    def _build_context(self, modo_trabalho: str = ""):
+        """Monta o contexto completo: Prompt + KB Estratégica + Fonética + Few-Shot + Supabase."""
+        return "\n".join(texto for _, texto in self._secoes_contexto(modo_trabalho))
 
     def gerar_memoria_calibracao(self, ia_text, breno_text):
         """Analisa a diferença entre o texto da IA e o aprovado, e extrai a 'lição'. Usa fallback multi-provedor."""
@@ -293,58 +493,64 @@ class RoteiristaAgent:
             "NÃO use metáforas. Seja puramente técnico e direto."
         )
 
-        # 🟢 OPÇÃO 1: PUTER (Grok 4.1 Fast — Grátis)
-        api_key_puter = os.environ.get("PUTER_API_KEY")
-        if api_key_puter:
-            try:
-                from openai import OpenAI as OpenAIClient
-                client = OpenAIClient(api_key=api_key_puter, base_url="https://api.puter.com/puterai/openai/v1/")
+        chave_cache = "memoria:" + _hash_conteudo(prompt)
+        cached = calibracao_cache.get(chave_cache)
+        if cached is not None:
+            print("[OK] Memoria de calibragem reaproveitada do cache")
+            return cached
+
+        def _memoria_openai(api_key, base_url, modelo):
+            def _executar():
+                client = get_openai_client(api_key, base_url)
                 response = client.chat.completions.create(
-                    model="x-ai/grok-4-1-fast",
+                    model=modelo,
                     messages=[{"role": "user", "content": prompt}],
                     temperature=0.3
                 )
-                print("[OK] Memoria de calibragem gerada via Puter (grok-4-1-fast)")
                 return response.choices[0].message.content.replace('\n', ' ').strip()
-            except Exception as e:
-                print(f"[ERROR] Erro Puter Memoria: {e}")
+            return _executar
 
-        # 🔵 OPÇÃO 2: OPENROUTER (DeepSeek R1 — Grátis)
+        rotas = []
+        # 🟢 PUTER (Grok 4.1 Fast — Grátis)
+        api_key_puter = os.environ.get("PUTER_API_KEY")
+        if api_key_puter:
+            rotas.append(Rota("puter/x-ai/grok-4-1-fast", _memoria_openai(api_key_puter, PUTER_BASE_URL, "x-ai/grok-4-1-fast"), "Puter (grok-4-1-fast)"))
+
+        # 🔵 OPENROUTER (DeepSeek R1 — Grátis)
         api_key_or = os.environ.get("OPENROUTER_API_KEY")
         if api_key_or:
-            try:
-                from openai import OpenAI as OpenAIClient
-                client = OpenAIClient(api_key=api_key_or, base_url="https://openrouter.ai/api/v1")
-                response = client.chat.completions.create(
-                    model="deepseek/deepseek-r1-0528:free",
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.3
-                )
-                print("[OK] Memoria de calibragem gerada via OpenRouter (deepseek-r1)")
-                return response.choices[0].message.content.replace('\n', ' ').strip()
-            except Exception as e:
-                print(f"[ERROR] Erro OpenRouter Memoria: {e}")
+            rotas.append(Rota("openrouter/deepseek/deepseek-r1-0528:free", _memoria_openai(api_key_or, OPENROUTER_BASE_URL, "deepseek/deepseek-r1-0528:free"), "OpenRouter (deepseek-r1)"))
 
-        # 🟡 OPÇÃO 3: GEMINI (se a key funcionar)
+        # 🟡 GEMINI (se a key funcionar)
         api_key_gemini = os.environ.get("GEMINI_API_KEY")
         if api_key_gemini:
-            try:
-                client = genai.Client(api_key=api_key_gemini)
+            def _memoria_gemini():
+                client = get_gemini_client(api_key_gemini)
                 response = client.models.generate_content(
                     model='gemini-2.0-flash', # Mais estável
                     contents=prompt,
                     config=types.GenerateContentConfig(temperature=0.3)
                 )
-                print("[OK] Memoria de calibragem gerada via Gemini (3-flash-preview)")
                 return response.text.replace('\n', ' ').strip()
-            except Exception as e:
-                print(f"[ERROR] Erro Gemini Memoria: {e}")
+            rotas.append(Rota("gemini/gemini-2.0-flash", _memoria_gemini, "Gemini (2.0-flash)"))
+
+        try:
+            memoria, rota = router.executar("memoria_calibracao", rotas)
+            print(f"[OK] Memoria de calibragem gerada via {rota.rotulo}")
+            calibracao_cache.set(chave_cache, memoria)
+            return memoria
+        except TodasRotasFalharam as e:
+            print(f"[ERROR] Memoria de calibragem: {e}")
 
         return "Erro: Nenhum provedor disponível para gerar memória de calibragem."
 
-    def gerar_roteiro(self, scraped_data, modo_trabalho="NW (NewWeb)", mes="MAR", data_roteiro=None, codigo=None, nome_produto=None, sub_skus=None, video_url=None, com_lu=True, **kwargs):
-        """Envia a requisição para o Gemini gerar o roteiro. Suporta Multimodal e Modos de Trabalho."""
-        context = self._build_context(modo_trabalho)
+    def _montar_prompt(self, scraped_data, modo_trabalho, mes, data_roteiro, codigo, sub_skus, video_url, com_lu, **kwargs):
+        """
+        Separa o prompt em (prefixo, sufixo). O prefixo (System Prompt + modo + conhecimento Supabase)
+        é idêntico para todos os SKUs de um lote e pode ser cacheado no provedor; o sufixo traz o SKU.
+        Retorna também a lista de imagens do scraper.
+        """
+        secoes_ctx = self._secoes_contexto(modo_trabalho)
 
         # Verifica se o input tem imagem (novo fluxo do scraper)
         if isinstance(scraped_data, dict):
@@ -389,9 +595,34 @@ class RoteiristaAgent:
             if comentarios:
                 diretriz_modo += f"ESTES SÃO OS COMENTÁRIOS REAIS PARA SINTETIZAR NO ROTEIRO:\n{comentarios}\n\n"
 
-        final_prompt = (
+        # Nome do produto: o informado ou o título da ficha (ProductSheet do scraper)
+        nome_produto = kwargs.get('nome_produto') or sheet_de(scraped_data, codigo).titulo
+        # Referências ranqueadas pela ficha/categoria deste SKU (fora do prefixo cacheável)
+        recuperado = self._contexto_recuperado(modo_trabalho, f"{nome_produto} {text_data}", kwargs.get('categoria_id'))
+        # Só as regras de fonética cujos termos aparecem no produto
+        fonetica = self._regras_fonetica(modo_trabalho, nome_produto, text_data)
+
+        # Orçamento de tokens: acima do teto, poda referências → conhecimento → ficha (nessa ordem)
+        textos, _ = ajustar_secoes(
+            [SecaoPrompt(nome, texto, 2 if nome == "conhecimento" else None) for nome, texto in secoes_ctx] + [
+                SecaoPrompt("diretriz", diretriz_modo),
+                SecaoPrompt("fonetica", fonetica),
+                SecaoPrompt("referencias", recuperado, 1),
+                SecaoPrompt("ficha", text_data, 3),
+            ],
+            model_id=self.model_id
+        )
+        context = "\n".join(textos[nome] for nome, _ in secoes_ctx)
+        recuperado = textos["referencias"]
+        text_data = textos["ficha"]
+
+        prefixo = (
             f"**CONTEXTO ESTRATÉGICO E APRENDIZADOS DINÂMICOS (SUPABASE):**\n"
             f"{context}\n\n"
+        )
+        referencias = f"**REFERÊNCIAS SELECIONADAS PARA ESTE PRODUTO (SUPABASE):**{recuperado}{textos['fonetica']}\n\n" if (recuperado or textos['fonetica']) else ""
+        sufixo = (
+            f"{referencias}"
             f"**MODO DE TRABALHO:** {modo_trabalho}\n"
             f"{diretriz_modo}\n\n"
             f"**FONTE ÚNICA DE VERDADE (FICHA TÉCNICA):**\n"
@@ -403,109 +634,350 @@ class RoteiristaAgent:
             f"4. **ZERO REDUNDÂNCIA VISUAL:** Não descreva cores se já estiverem no nome.\n"
             f"5. **DATA ATUAL:** Use EXATAMENTE a data fornecida no cabeçalho ({data_str}). O ano correto é 2026.\n"
         )
+        return prefixo, sufixo, images_list
 
+    def _prefixo_cacheado(self, prefixo):
+        """Nome do cached_content do prefixo no Gemini (None = enviar inline)."""
+        if not self.prefix_cache:
+            return None
+        return self.prefix_cache.obter(self.client_gemini, self._conta_gemini, self.model_id, prefixo)
 
-        if self.client_gemini:
-            contents = [final_prompt]
-            if images_list:
-                for img_dict in images_list:
-                    img_bytes = img_dict.get("bytes")
-                    img_mime = img_dict.get("mime")
-                    if img_bytes and img_mime:
-                        contents.append({
-                            "mime_type": img_mime,
-                            "data": img_bytes
-                        })
-
-            # Chamada via SDK v2 com timeout estendido através do GenerateConfig
+    def _imagens_gemini(self, images_list):
+        imagens = []
+        for img_dict in images_list or []:
+            img_bytes = img_dict.get("bytes")
+            img_mime = img_dict.get("mime")
+            if img_bytes and img_mime:
+                imagens.append({
+                    "mime_type": img_mime,
+                    "data": img_bytes
+                })
+        return imagens
+
+    def _config_geracao(self, nome_cache=None):
+        return types.GenerateContentConfig(
+            temperature=0.7,
+            cached_content=nome_cache,
+            # Timeout adaptativo: múltiplo do p95 observado para o modelo (120 s sem histórico)
+            http_options={'timeout': latencias.timeout_ms("geracao", self.rota, GERACAO_TIMEOUT_MS)}
+        )
+
+    def _kwargs_timeout_openai(self):
+        """timeout adaptativo para chat.completions (sem histórico, mantém o padrão do SDK)."""
+        timeout = latencias.timeout_s("geracao", self.rota, None)
+        return {"timeout": timeout} if timeout else {}
+
+    def _gerar_gemini(self, prefixo, sufixo, images_list, codigo=None, stream=False):
+        """
+        Chama o Gemini reaproveitando o prefixo cacheado quando possível. Retorna a resposta crua
+        ou, com stream=True, um gerador de pedaços de texto seguido de UsoTokens.
+        """
+        cached_name = self._prefixo_cacheado(prefixo)
+        imagens = self._imagens_gemini(images_list)
+
+        metodo = self.client_gemini.models.generate_content_stream if stream else self.client_gemini.models.generate_content
+
+        def _chamar(nome_cache):
+            contents = [sufixo if nome_cache else prefixo + sufixo] + imagens
+            # Chamada via SDK v2 com timeout adaptativo através do GenerateConfig
             try:
-                print(f"[DEBUG] Chamando Models.generate_content para SKU {codigo} com modelo {self.model_id}")
-                response = self.client_gemini.models.generate_content(
+                print(f"[DEBUG] Chamando Models.generate_content para SKU {codigo} com modelo {self.model_id}{' (prefixo cacheado)' if nome_cache else ''}")
+                return metodo(
                     model=self.model_id,
                     contents=contents,
-                    config=types.GenerateContentConfig(
-                        temperature=0.7,
-                        http_options={'timeout': 120000} # 120 segundos em ms
-                    )
+                    config=self._config_geracao(nome_cache)
                 )
             except TypeError as te:
                 if 'request_options' in str(te):
                     print(f"[CRITICAL ERR] Erro detectado no SDK v2 (request_options): {te}. Tentando fallback sem config.")
-                    response = self.client_gemini.models.generate_content(
+                    return metodo(
                         model=self.model_id,
-                        contents=contents
+                        contents=[prefixo + sufixo] + imagens
                     )
                 else: raise te
-            
-            # Resiliência na obtenção do texto (evita exceções se a resposta for bloqueada ou vazia)
-            try:
-                roteiro = response.text
-                if not roteiro:
-                    # Tenta extrair manualmente se .text estiver vazio mas houver parte
-                    if response.candidates and response.candidates[0].content.parts:
-                        roteiro = "".join([p.text for p in response.candidates[0].content.parts])
-            except Exception as e:
-                # Se der erro (ex: blocked by safety), tenta pegar o feedback de segurança
-                block_reason = getattr(response, 'blocked', 'Filtro de segurança do Gemini bloqueou a resposta.')
-                roteiro = f"ERRO NA GERAÇÃO: {block_reason}. Tente outro modelo ou ajuste o texto de entrada."
-                print(f"[RECOVERED ERROR] Gemini Blocked: {e}")
-            
-            # Métricas via v2 metadata
-            if hasattr(response, 'usage_metadata'):
-                tokens_in = response.usage_metadata.prompt_token_count
-                tokens_out = response.usage_metadata.candidates_token_count
-            else:
-                tokens_in = len(final_prompt) // 4
-                tokens_out = len(roteiro) // 4
-        
-        elif self.client_openai:
-            messages = [{"role": "user", "content": final_prompt}]
+
+        if stream:
+            return self._iterar_stream_gemini(_chamar, cached_name, prefixo)
+        if not cached_name:
+            return _chamar(None)
+        try:
+            return _chamar(cached_name)
+        except Exception as e:
+            # Cache expirado/removido no provedor: esquece e reenvia o prompt completo
+            print(f"[PROMPT CACHE] Falha usando {cached_name}: {e}. Reenviando inline.")
+            self.prefix_cache.descartar(self._conta_gemini, self.model_id, prefixo)
+            return _chamar(None)
+
+    def gerar_roteiro(self, scraped_data, modo_trabalho="NW (NewWeb)", mes="MAR", data_roteiro=None, codigo=None, nome_produto=None, sub_skus=None, video_url=None, com_lu=True, **kwargs):
+        """Envia a requisição para o Gemini gerar o roteiro. Suporta Multimodal e Modos de Trabalho."""
+        prefixo, sufixo, images_list = self._montar_prompt(
+            scraped_data, modo_trabalho, mes, data_roteiro, codigo, sub_skus, video_url, com_lu, nome_produto=nome_produto, **kwargs
+        )
+        final_prompt = prefixo + sufixo
+        inicio = time.monotonic()
+
+        secundario = self._agente_hedge()
+        if secundario is None:
+            roteiro, uso = self._chamar_modelo(prefixo, sufixo, images_list, codigo)
+            latencias.registrar("geracao", self.rota, time.monotonic() - inicio)
+            return self._concluir_roteiro(
+                roteiro, uso, final_prompt, inicio, scraped_data,
+                modo_trabalho, mes, data_roteiro, codigo, sub_skus, video_url, com_lu
+            )
+
+        # Hedge: passou do p95 do modelo escolhido, o secundário recebe o mesmo prompt e a primeira resposta vence.
+        # Nunca é fallback: se o modelo escolhido falhar antes do p95, o erro sobe como sem hedge.
+        agentes = {self.rota: self, secundario.rota: secundario}
+        descartadas, usos = [], {}
+
+        def _chamada(a):
+            def _executar():
+                roteiro_a, uso_a = a._chamar_modelo(prefixo, sufixo, images_list, codigo)
+                usos[a.rota] = uso_a or UsoTokens(estimar_tokens(final_prompt, a.model_id), estimar_tokens(roteiro_a, a.model_id))
+                if any(r.nome == a.rota for r in descartadas):
+                    # A perdedora roda até o fim numa thread própria: registra o custo real quando termina
+                    u = usos[a.rota]
+                    registrar_uso(a.model_id, len(final_prompt), u.tokens_in, u.tokens_out)
+                    print(f"[HEDGE] Chamada descartada de {a.model_id} concluída: R$ {calcular_custo_brl(a.model_id, u.tokens_in, u.tokens_out):.4f}")
+                return roteiro_a, uso_a
+            return _executar
+
+        (roteiro, uso), rota = router.executar(
+            "geracao",
+            [Rota(a.rota, _chamada(a), a.model_id) for a in agentes.values()],
+            hedge=True, ordenar=False, ao_descartar=descartadas.append, fallback=False
+        )
+        resultado = agentes[rota.nome]._concluir_roteiro(
+            roteiro, uso, final_prompt, inicio, scraped_data,
+            modo_trabalho, mes, data_roteiro, codigo, sub_skus, video_url, com_lu
+        )
+        return self._somar_hedge(resultado, [agentes[r.nome] for r in descartadas], final_prompt, usos=usos, completas=True)
+
+    def _chamar_modelo(self, prefixo, sufixo, images_list, codigo=None):
+        """Uma chamada de geração neste modelo: (texto do roteiro, UsoTokens ou None)."""
+        if self.client_gemini:
+            response = self._gerar_gemini(prefixo, sufixo, images_list, codigo=codigo)
+            return self._texto_resposta_gemini(response), self._uso_resposta_gemini(response)
+
+        if self.client_openai:
+            # Prefixo estável como mensagem de sistema: provedores compatíveis com OpenAI
+            # reaproveitam automaticamente o cache de prefixos idênticos entre chamadas.
             # Para modelos OpenAI/Puter, o envio de imagens (vision) tem uma estrutura diferente.
             # Como a documentação primária do Puter para Grok Fast não deixa claro o suporte a imagens,
             # passaremos apenas texto por enquanto, a não ser que o modelo suporte e tenhamos url.
-            
             response = self.client_openai.chat.completions.create(
                 model=self.model_id,
-                messages=messages
+                messages=self._mensagens(prefixo, sufixo),
+                **self._kwargs_timeout_openai()
             )
-            roteiro = response.choices[0].message.content
-            
-            tokens_in = response.usage.prompt_tokens if hasattr(response, 'usage') else 0
-            tokens_out = response.usage.completion_tokens if hasattr(response, 'usage') else 0
-        
+            return response.choices[0].message.content, self._uso_resposta_openai(response)
+
+        raise Exception("Nenhum cliente LLM configurado válido.")
+
+    def _somar_hedge(self, resultado, perdedores, final_prompt, usos=None, completas=False):
+        """
+        Soma ao custo do roteiro o das chamadas de hedge descartadas.
+        - completas=True (síncrono): a perdedora não pode ser interrompida e o provedor cobra também a
+          saída. Usa o uso real se ela já terminou; senão estima a saída pela média observada do modelo;
+        - completas=False (async): a perdedora foi cancelada, então conta só a entrada (cobrada de qualquer forma).
+        """
+        if not perdedores:
+            return resultado
+        usos = usos or {}
+
+        def _custo(a):
+            uso = usos.get(a.rota)
+            if uso is not None:
+                return calcular_custo_brl(a.model_id, uso.tokens_in, uso.tokens_out)
+            tokens_out = tokens_saida_medio(a.model_id) if completas else 0
+            return calcular_custo_brl(a.model_id, estimar_tokens(final_prompt, a.model_id), tokens_out)
+
+        custo_hedge = sum(_custo(a) for a in perdedores)
+        resultado["custo_hedge_brl"] = round(custo_hedge, 6)
+        resultado["custo_brl"] = round(resultado["custo_brl"] + custo_hedge, 6)
+        resultado["hedge_descartados"] = [a.model_id for a in perdedores]
+        return resultado
+
+    def _mensagens(self, sistema, usuario):
+        return [
+            {"role": "system", "content": sistema},
+            {"role": "user", "content": usuario}
+        ]
+
+    def _texto_resposta_gemini(self, response):
+        # Resiliência na obtenção do texto (evita exceções se a resposta for bloqueada ou vazia)
+        try:
+            roteiro = response.text
+            if not roteiro:
+                # Tenta extrair manualmente se .text estiver vazio mas houver parte
+                if response.candidates and response.candidates[0].content.parts:
+                    roteiro = "".join([p.text for p in response.candidates[0].content.parts])
+        except Exception as e:
+            # Se der erro (ex: blocked by safety), tenta pegar o feedback de segurança
+            block_reason = getattr(response, 'blocked', 'Filtro de segurança do Gemini bloqueou a resposta.')
+            roteiro = f"ERRO NA GERAÇÃO: {block_reason}. Tente outro modelo ou ajuste o texto de entrada."
+            print(f"[RECOVERED ERROR] Gemini Blocked: {e}")
+        return roteiro
+
+    def _uso_resposta_gemini(self, response):
+        """UsoTokens do usage_metadata (v2), ou None quando a resposta não traz uso."""
+        if hasattr(response, 'usage_metadata'):
+            return UsoTokens(
+                response.usage_metadata.prompt_token_count,
+                response.usage_metadata.candidates_token_count,
+                getattr(response.usage_metadata, 'cached_content_token_count', None) or 0
+            )
+        return None
+
+    def _uso_resposta_openai(self, response):
+        tokens_in = response.usage.prompt_tokens if hasattr(response, 'usage') else 0
+        tokens_out = response.usage.completion_tokens if hasattr(response, 'usage') else 0
+        if not tokens_in:
+            return UsoTokens(tokens_in, tokens_out)
+        detalhes = getattr(getattr(response, 'usage', None), 'prompt_tokens_details', None)
+        return UsoTokens(tokens_in, tokens_out, (getattr(detalhes, 'cached_tokens', None) or 0) if detalhes else 0)
+
+    def _concluir_roteiro(self, roteiro, uso, final_prompt, inicio, scraped_data, modo_trabalho, mes, data_roteiro, codigo, sub_skus, video_url, com_lu):
+        """Registra o uso, aplica cabeçalho e fonética e monta o dicionário de resultado (sync e async)."""
+        if uso is None:
+            uso = UsoTokens(estimar_tokens(final_prompt, self.model_id), estimar_tokens(roteiro, self.model_id))
+        elif uso.tokens_in:
+            registrar_uso(self.model_id, len(final_prompt), uso.tokens_in, uso.tokens_out, time.monotonic() - inicio, len(_texto_ficha(scraped_data)))
+        registrar_prompt(modo_trabalho, len(final_prompt))
+
+        roteiro = self._aplicar_cabecalho(roteiro, modo_trabalho, mes, data_roteiro, codigo, sub_skus, video_url, com_lu)
+        roteiro = self._pos_processar_fonetica(roteiro, modo_trabalho)
+        return self._resultado_roteiro(roteiro, uso.tokens_in, uso.tokens_out, uso.tokens_cached)
+
+    def gerar_roteiro_stream(self, scraped_data, modo_trabalho="NW (NewWeb)", mes="MAR", data_roteiro=None, codigo=None, nome_produto=None, sub_skus=None, video_url=None, com_lu=True, **kwargs) -> GeracaoStream:
+        """
+        Versão em streaming de gerar_roteiro: itera os pedaços do roteiro conforme chegam.
+        Ao fim do consumo, `.resultado` traz o mesmo dicionário de gerar_roteiro (com o cabeçalho já corrigido).
+        """
+        prefixo, sufixo, images_list = self._montar_prompt(
+            scraped_data, modo_trabalho, mes, data_roteiro, codigo, sub_skus, video_url, com_lu, nome_produto=nome_produto, **kwargs
+        )
+
+        if self.client_gemini:
+            origem = self._gerar_gemini(prefixo, sufixo, images_list, codigo=codigo, stream=True)
+        elif self.client_openai:
+            origem = self._stream_openai(self._mensagens(prefixo, sufixo))
         else:
             raise Exception("Nenhum cliente LLM configurado válido.")
 
-        # --- POST-PROCESSING ENFORCEMENT ---
-        # Força o cabeçalho correto ignorando as alucinações de cópia de exemplos do LLM
+        inicio = time.monotonic()
+
+        def _finalizar(roteiro, uso):
+            if not roteiro:
+                roteiro = "ERRO NA GERAÇÃO: O modelo não retornou texto (possível bloqueio do filtro de segurança). Tente outro modelo ou ajuste o texto de entrada."
+            return self._concluir_roteiro(
+                roteiro, uso, prefixo + sufixo, inicio, scraped_data,
+                modo_trabalho, mes, data_roteiro, codigo, sub_skus, video_url, com_lu
+            )
+
+        return GeracaoStream(origem, _finalizar)
+
+    def _stream_openai(self, messages):
+        """Gerador de pedaços via chat.completions em streaming, terminando com UsoTokens quando o provedor informa."""
+        try:
+            resposta = self.client_openai.chat.completions.create(
+                model=self.model_id,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+        except Exception as e:
+            # Alguns provedores compatíveis não aceitam stream_options
+            print(f"[STREAM] stream_options recusado por {self.provider}: {e}. Tentando sem uso de tokens.")
+            resposta = self.client_openai.chat.completions.create(
+                model=self.model_id,
+                messages=messages,
+                stream=True
+            )
+
+        uso = None
+        for chunk in resposta:
+            if chunk.choices:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+            usage = getattr(chunk, 'usage', None)
+            if usage:
+                detalhes = getattr(usage, 'prompt_tokens_details', None)
+                uso = UsoTokens(
+                    usage.prompt_tokens or 0,
+                    usage.completion_tokens or 0,
+                    (getattr(detalhes, 'cached_tokens', None) or 0) if detalhes else 0
+                )
+        if uso:
+            yield uso
+
+    def _iterar_stream_gemini(self, chamar, cached_name, prefixo):
+        """Consome generate_content_stream; se o prefixo cacheado falhar antes do primeiro pedaço, refaz inline."""
+        tentativas = [cached_name, None] if cached_name else [None]
+        for nome_cache in tentativas:
+            emitiu = False
+            ultimo = None
+            try:
+                for chunk in chamar(nome_cache):
+                    ultimo = chunk
+                    try:
+                        texto = chunk.text
+                    except Exception:
+                        texto = None
+                    if texto:
+                        emitiu = True
+                        yield texto
+            except Exception as e:
+                if nome_cache and not emitiu:
+                    print(f"[PROMPT CACHE] Falha usando {nome_cache}: {e}. Reenviando inline.")
+                    self.prefix_cache.descartar(self._conta_gemini, self.model_id, prefixo)
+                    continue
+                raise
+            meta = getattr(ultimo, 'usage_metadata', None)
+            if meta:
+                yield UsoTokens(
+                    meta.prompt_token_count or 0,
+                    meta.candidates_token_count or 0,
+                    getattr(meta, 'cached_content_token_count', None) or 0
+                )
+            return
+
+    def _aplicar_cabecalho(self, roteiro, modo_trabalho, mes, data_roteiro, codigo, sub_skus, video_url, com_lu):
+        """Força o cabeçalho NW correto no texto final (o LLM costuma copiar o cabeçalho dos exemplos)."""
         if "NW" in modo_trabalho:
             try:
-                import re
-                linhas = roteiro.split('\n')
-                for i, linha in enumerate(linhas):
-                    if "Cliente: Magalu" in linha.replace('*', ''):
-                        data_s = data_roteiro if data_roteiro else "[DATA_ATUAL]"
-                        cod_s = str(codigo).strip() if codigo else "[CÓDIGO_AQUI]"
-                        if cod_s.isdigit() and len(cod_s) < 9: cod_s = cod_s.ljust(9, '0')
-                        sub_s = f" {sub_skus}" if (sub_skus and str(sub_skus).lower() != 'nan') else ""
-                        vid_s = f"\n   {video_url}" if (video_url and str(video_url).lower() != 'nan') else ""
-                        
-                        linhas[i] = "Cliente: Magalu"
-                        if i + 1 < len(linhas):
-                            linhas[i+1] = f"Roteirista: Tiago Fernandes - Data: {data_s}"
-                        if i + 2 < len(linhas):
-                            # Remove prefixos antigos para evitar duplicação em edições sucessivas
-                            prod_str = linhas[i+2].replace('**', '').replace('Produto:', '').strip()
-                            # Tenta detectar e remover qualquer prefixo NW / NW LU / NW 3D etc até chegar no nome real
-                            nome_purificado = re.sub(r'^(NW\s*(3D)?\s*(LU)?\s*[A-Z]{3}\s*\d+\s+)', '', prod_str)
-                            
-                            prefixo_taxonomia = "NW LU" if com_lu else "NW"
-                            linhas[i+2] = f"Produto: {prefixo_taxonomia} {mes} {cod_s}{sub_s} {nome_purificado}{vid_s}"
-                        roteiro = "\n".join(linhas)
-                        break
+                estrutura = parse_roteiro(roteiro)
+                cab = estrutura.cabecalho
+                if cab.indice is not None and cab.cliente.startswith("Magalu"):
+                    i = cab.indice
+                    linhas = [l.bruto for l in estrutura.linhas]
+                    data_s = data_roteiro if data_roteiro else "[DATA_ATUAL]"
+                    cod_s = str(codigo).strip() if codigo else "[CÓDIGO_AQUI]"
+                    if cod_s.isdigit() and len(cod_s) < 9: cod_s = cod_s.ljust(9, '0')
+                    sub_s = f" {sub_skus}" if (sub_skus and str(sub_skus).lower() != 'nan') else ""
+                    vid_s = f"\n   {video_url}" if (video_url and str(video_url).lower() != 'nan') else ""
+
+                    linhas[i] = "Cliente: Magalu"
+                    if i + 1 < len(linhas):
+                        linhas[i+1] = f"Roteirista: Tiago Fernandes - Data: {data_s}"
+                    if i + 2 < len(linhas):
+                        # Remove prefixos antigos (taxonomia + mês + SKU) para evitar duplicação em edições sucessivas
+                        linha_produto = estrutura.linhas[i+2]
+                        if linha_produto.tipo == "header" and linha_produto.texto.startswith("Produto:"):
+                            nome_purificado = cab.nome_produto
+                        else:
+                            nome_purificado = linha_produto.bruto.replace('*', '').strip()
+
+                        prefixo_taxonomia = "NW LU" if com_lu else "NW"
+                        linhas[i+2] = f"Produto: {prefixo_taxonomia} {mes} {cod_s}{sub_s} {nome_purificado}{vid_s}"
+                    roteiro = "\n".join(linhas)
             except Exception as e:
                 print(f"[WARN] Error enforcing header: {e}")
 
+        return roteiro
+
+    def _resultado_roteiro(self, roteiro, tokens_in, tokens_out, tokens_cached=0):
         custo_brl = calcular_custo_brl(self.model_id, tokens_in, tokens_out)
 
         return {
@@ -513,9 +985,36 @@ class RoteiristaAgent:
             "model_id": self.model_id,
             "tokens_in": tokens_in,
             "tokens_out": tokens_out,
+            "tokens_cached": tokens_cached,
             "custo_brl": custo_brl
         }
 
+    def prever_lote(self, n_skus: int, modo_trabalho: str = "NW (NewWeb)", paralelismo: int = 1):
+        """
+        Previsão de custo (BRL) e duração de um lote de n SKUs com este modelo, antes de executar.
+        A entrada por SKU é a média dos prompts reais do modo (ficha, referências e fonética inclusas).
+        Sem observações, monta o prompt com uma ficha do tamanho médio: as referências entram por
+        recência, mas a fonética da ficha fica de fora (previsão mais baixa até a primeira geração).
+        """
+        chars_prompt = chars_prompt_medio(modo_trabalho)
+        if chars_prompt:
+            tokens_in_sku = tokens_de_chars(chars_prompt, self.model_id)
+        else:
+            ficha_tipica = {"text": " " * chars_ficha_medio(self.model_id), "images": []}
+            prefixo, sufixo, _ = self._montar_prompt(ficha_tipica, modo_trabalho, "MAR", None, None, None, None, True)
+            tokens_in_sku = estimar_tokens(prefixo + sufixo, self.model_id)
+        return prever_lote(self.model_id, n_skus, tokens_in_sku, paralelismo, calcular_custo_brl)
+
+    def submeter_lote_job(self, itens: list, fichas: list, provedor=None, **gen_kwargs):
+        """Modo lote offline: envia todos os SKUs como um job assíncrono (ver src/batch_jobs.py)."""
+        from src.batch_jobs import submeter_trabalho
+        return submeter_trabalho(self, itens, fichas, provedor=provedor, **gen_kwargs)
+
+    def coletar_lote_job(self, trabalho, provedor=None):
+        """Consulta um job do modo lote; None enquanto processa, lista de resultados por SKU ao concluir."""
+        from src.batch_jobs import coletar_trabalho
+        return coletar_trabalho(self, trabalho, provedor=provedor)
+
     def _extract_json(self, text):
         """Extrai JSON de uma resposta que pode conter markdown wrappers (```json ... ```)."""
         import re
@@ -543,8 +1042,93 @@ class RoteiristaAgent:
     def analisar_calibracao(self, original, final, categories_list=[], codigo_original=""):
         """
         Realiza a análise de calibragem de qualidade usando LLMs gratuitos.
-        Cadeia de fallback: Puter (Grok 4.1 Fast) → OpenRouter (DeepSeek V3) → Gemini (2.5 Flash).
+        Cadeia de fallback (_rotas_calibracao): Gemini 2.0 Flash → Gemini 1.5 Flash → Puter (Grok 4.1 Fast).
+        """
+        sys_prompt, user_prompt, fallback_id = self._prompts_calibracao(original, final, categories_list, codigo_original)
+
+        # Mesmo par IA/Humano + mesmas categorias (e mesmo prompt) = mesma análise: devolve a salva
+        chave_cache = "analise:" + _hash_conteudo(sys_prompt, user_prompt)
+        cached = calibracao_cache.get(chave_cache)
+        if cached is not None:
+            print(f"[OK] Calibragem reaproveitada do cache ({cached.get('modelo_calibragem')})")
+            return cached
+
+        rotas = self._rotas_calibracao(sys_prompt, user_prompt)
+
+        try:
+            res, rota = router.executar("calibragem", rotas)
+            print(f"[OK] Calibragem realizada via {rota.rotulo}")
+            resultado = self._process_calib_res(res, fallback_id, categories_list, codigo_original, rota.rotulo)
+            calibracao_cache.set(chave_cache, resultado)
+            return resultado
+        except TodasRotasFalharam as e:
+            print(f"[ERROR] Calibragem: {e}")
+
+        return self._falha_calibracao(fallback_id, codigo_original)
+
+    def _rotas_calibracao(self, sys_prompt, user_prompt, assincrono=False):
         """
+        Rotas multi-provedor da calibragem (ordem de preferência; o roteador pula circuitos abertos).
+        Compartilhadas pelo caminho síncrono e pelo AsyncRoteiristaAgent (assincrono=True: corrotinas).
+        """
+        rotas = []
+
+        # 🟡 GEMINI (Mestre Original, Melhor para JSON)
+        api_key_gemini = _get_key("GEMINI_API_KEY")
+        if api_key_gemini:
+            client_v2 = get_gemini_client(api_key_gemini)
+
+            def _calib_gemini(modelo):
+                def _executar():
+                    print(f"[TRY] Tentando calibragem via Gemini ({modelo})...")
+                    response_gem = client_v2.models.generate_content(
+                        model=modelo, 
+                        contents=user_prompt,
+                        config=self._config_calibracao(sys_prompt)
+                    )
+                    return self._json_calibracao_gemini(response_gem)
+
+                async def _executar_async():
+                    print(f"[TRY] Tentando calibragem via Gemini ({modelo}, async)...")
+                    response_gem = await client_v2.aio.models.generate_content(
+                        model=modelo,
+                        contents=user_prompt,
+                        config=self._config_calibracao(sys_prompt)
+                    )
+                    return self._json_calibracao_gemini(response_gem)
+                return _executar_async if assincrono else _executar
+
+            rotas.append(Rota("gemini/gemini-2.0-flash", _calib_gemini("gemini-2.0-flash"), "Gemini 2.0 Flash"))
+            rotas.append(Rota("gemini/gemini-1.5-flash", _calib_gemini("gemini-1.5-flash"), "Gemini 1.5 Flash"))
+
+        # 🟢 PUTER (Grok 4.1 Fast — Grátis)
+        api_key_puter = _get_key("PUTER_API_KEY")
+        if api_key_puter:
+            def _calib_puter():
+                print("[TRY] Tentando calibragem via Puter (grok-4-1-fast)...")
+                client = get_openai_client(api_key_puter, PUTER_BASE_URL)
+                response = client.chat.completions.create(
+                    model="x-ai/grok-4-1-fast",
+                    messages=self._mensagens(sys_prompt, user_prompt),
+                    temperature=0.1
+                )
+                return self._json_calibracao_openai(response)
+
+            async def _calib_puter_async():
+                print("[TRY] Tentando calibragem via Puter (grok-4-1-fast, async)...")
+                response = await get_async_openai_client(api_key_puter, PUTER_BASE_URL).chat.completions.create(
+                    model="x-ai/grok-4-1-fast",
+                    messages=self._mensagens(sys_prompt, user_prompt),
+                    temperature=0.1
+                )
+                return self._json_calibracao_openai(response)
+
+            rotas.append(Rota("puter/x-ai/grok-4-1-fast", _calib_puter_async if assincrono else _calib_puter, "Grok 4.1 Fast (Puter)"))
+
+        return rotas
+
+    def _prompts_calibracao(self, original, final, categories_list, codigo_original):
+        """Retorna (sys_prompt, user_prompt, fallback_id) da análise de calibragem."""
         # Define um ID de fallback seguro (o primeiro da lista ou 0)
         fallback_id = categories_list[0]['id'] if categories_list else 1
         # Formata a lista de categorias para o prompt
@@ -598,83 +1182,37 @@ class RoteiristaAgent:
         )
 
         user_prompt = f"--- CÓDIGO SUGERIDO ---\n{codigo_original}\n\n--- ROTEIRO ORIGINAL (IA) ---\n{original}\n\n--- ROTEIRO FINAL (HUMANO) ---\n{final}"
+        return sys_prompt, user_prompt, fallback_id
 
-        # --- CADEIA DE FALLBACK MULTI-PROVEDOR PARA CALIBRAGEM ---
-        
-        # 🟡 OPÇÃO 1: GEMINI (Mestre Original, Melhor para JSON)
-        api_key_gemini = os.environ.get("GEMINI_API_KEY") or (st.secrets.get("GEMINI_API_KEY") if 'st' in globals() else None)
-        if api_key_gemini:
-            try:
-                print("[TRY] Tentando calibragem via Gemini (3-flash-preview)...")
-                client_v2 = genai.Client(api_key=api_key_gemini)
-                
-                try:
-                    print("[TRY] Tentando calibragem via Gemini (2.0-flash)...")
-                    response_gem = client_v2.models.generate_content(
-                        model="gemini-2.0-flash", 
-                        contents=user_prompt,
-                        config=types.GenerateContentConfig(
-                            system_instruction=sys_prompt,
-                            temperature=0.1,
-                            response_mime_type="application/json"
-                        )
-                    )
-                    model_str = "Gemini 2.0 Flash"
-                except Exception as e_gem:
-                    print(f"[WARN] Gemini 2.0 falhou ({e_gem}), tentando 1.5 Flash...")
-                    response_gem = client_v2.models.generate_content(
-                        model="gemini-1.5-flash", 
-                        contents=user_prompt,
-                        config=types.GenerateContentConfig(
-                            system_instruction=sys_prompt,
-                            temperature=0.1,
-                            response_mime_type="application/json"
-                        )
-                    )
-                    model_str = "Gemini 1.5 Flash"
-                
-                try:
-                    res_text = response_gem.text
-                except Exception as e:
-                    print(f"[RECOVERED ERROR] Gemini Calibracao Blocked or Failed: {e}")
-                    # Tenta fallback via parts
-                    res_text = "".join([p.text for p in response_gem.candidates[0].content.parts])
-
-                res = self._extract_json(res_text)
-                if not res:
-                    print("[WARNING] Gemini falhou na extração de JSON. Indo para fallback...")
-                    raise Exception("Falha na extração JSON")
-                    
-                print(f"[OK] Calibragem realizada via {model_str}")
-                return self._process_calib_res(res, fallback_id, categories_list, codigo_original, model_str)
-            except Exception as e:
-                print(f"[ERROR] Erro Gemini Calibragem: {e}")
+    def _config_calibracao(self, sys_prompt):
+        return types.GenerateContentConfig(
+            system_instruction=sys_prompt,
+            temperature=0.1,
+            response_mime_type="application/json"
+        )
 
-        # 🟢 OPÇÃO 2: PUTER (Grok 4.1 Fast — Grátis)
-        api_key_puter = os.environ.get("PUTER_API_KEY") or (st.secrets.get("PUTER_API_KEY") if 'st' in globals() else None)
-        if api_key_puter:
-            try:
-                print("[TRY] Tentando calibragem via Puter (grok-4-1-fast)...")
-                from openai import OpenAI as OpenAIClient
-                client = OpenAIClient(api_key=api_key_puter, base_url="https://api.puter.com/puterai/openai/v1/")
-                response = client.chat.completions.create(
-                    model="x-ai/grok-4-1-fast",
-                    messages=[
-                        {"role": "system", "content": sys_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=0.1
-                )
-                res = self._extract_json(response.choices[0].message.content)
-                if not res or ("percentual" not in res and "aprendizado" not in res):
-                     print("[WARNING] Puter retornou JSON insuficiente. Fim da linha.")
-                     raise Exception("JSON Insuficiente")
+    def _json_calibracao_gemini(self, response_gem):
+        try:
+            res_text = response_gem.text
+        except Exception as e:
+            print(f"[RECOVERED ERROR] Gemini Calibracao Blocked or Failed: {e}")
+            # Tenta fallback via parts
+            res_text = "".join([p.text for p in response_gem.candidates[0].content.parts])
 
-                print("[OK] Calibragem realizada via Puter (grok-4-1-fast)")
-                return self._process_calib_res(res, fallback_id, categories_list, codigo_original, "Grok 4.1 Fast (Puter)")
-            except Exception as e:
-                print(f"[ERROR] Erro Puter Calibragem: {e}")
+        res = self._extract_json(res_text)
+        if not res:
+            print("[WARNING] Gemini falhou na extração de JSON. Indo para fallback...")
+            raise Exception("Falha na extração JSON")
+        return res
+
+    def _json_calibracao_openai(self, response):
+        res = self._extract_json(response.choices[0].message.content)
+        if not res or ("percentual" not in res and "aprendizado" not in res):
+             print("[WARNING] Puter retornou JSON insuficiente.")
+             raise Exception("JSON Insuficiente")
+        return res
 
+    def _falha_calibracao(self, fallback_id, codigo_original):
         print("[CRITICAL ERROR] FALHA TOTAL: Nenhum provedor de IA conseguiu realizar a calibragem.")
         return {
             "percentual": 50, 
@@ -730,45 +1268,19 @@ class RoteiristaAgent:
         Gera uma resposta conversacional baseada no histórico de chat e,
         opcionalmente, injeta dados recentes do Supabase (RAG-lite) no prompt.
         """
-        system_base = (
-            "Você é a Lu, a assistente virtual inteligente e especialista em IA da Magalu. "
-            "Sua missão é ajudar a equipe interna exclusivamente com: criação de roteiros de vídeo, redação publicitária, análise de qualidade (calibragem) e dúvidas sobre esta suíte de IA. "
-            "REGRA DE OURO MÁXIMA: É PROIBIDO responder perguntas fora do contexto da Magalu, tecnologia em varejo, redação ou sobre o sistema de roteiros. Se o assunto sair disso, responda educadamente que você só pode ajudar com demandas de conteúdo da Magalu. "
-            "Tenha um tom acolhedor ('estilo magalu'), direto ao ponto, e use emojis ocasionalmente.\n\n"
-        )
-        
-        if supabase_context:
-            system_base += f"--- CONTEXTO ATUAL DO BANCO DE DADOS ---\n{supabase_context}\n---------------------------------------\n"
-
         try:
             if self.provider == "gemini":
-                # Para o Gemini (SDK v1), montaremos a interface como um string prompt 
-                # contendo o system prompt + histórico + pergunta
-                full_prompt = system_base + "\n\n--- HISTÓRICO RECENTE ---\n"
-                for msg in chat_history[-6:]: 
-                    r = msg.get('role', 'user').upper()
-                    c = msg.get('content', '')
-                    full_prompt += f"{r}: {c}\n"
-                full_prompt += f"\nUSUÁRIO: {user_query}\nLU:"
-                
                 response = self.client_gemini.models.generate_content(
                     model=self.model_id,
-                    contents=full_prompt,
+                    contents=self._prompt_chat_gemini(user_query, chat_history, supabase_context),
                     config=types.GenerateContentConfig(temperature=0.5)
                 )
                 return response.text
                 
             elif self.provider in ["openai", "puter", "openrouter", "zai", "kimi"]:
-                messages = [{"role": "system", "content": system_base}]
-                for msg in chat_history[-6:]:
-                    r = "assistant" if msg.get("role") == "Lu" else "user"
-                    messages.append({"role": r, "content": msg["content"]})
-                    
-                messages.append({"role": "user", "content": user_query})
-                
                 response = self.client_openai.chat.completions.create(
                     model=self.model_id,
-                    messages=messages,
+                    messages=self._mensagens_chat(user_query, chat_history, supabase_context),
                     temperature=0.7
                 )
                 return response.choices[0].message.content
@@ -779,11 +1291,41 @@ class RoteiristaAgent:
         except Exception as e:
             return f"Desculpe, tive um problema técnico ao conectar com a IA ({self.model_id}): {e}"
 
-    def otimizar_roteiros(self, roteiros_textos: list, codigo: str, nome_produto: str, ficha_tecnica: str = None) -> dict:
-        """
-        Sintetiza de 2 a 5 roteiros selecionados escolhendo os melhores ganchos, argumentos e fechamentos,
-        mantendo o tom de voz da marca e o formato estrito NW LU.
-        """
+    def _sistema_chat(self, supabase_context=None):
+        system_base = (
+            "Você é a Lu, a assistente virtual inteligente e especialista em IA da Magalu. "
+            "Sua missão é ajudar a equipe interna exclusivamente com: criação de roteiros de vídeo, redação publicitária, análise de qualidade (calibragem) e dúvidas sobre esta suíte de IA. "
+            "REGRA DE OURO MÁXIMA: É PROIBIDO responder perguntas fora do contexto da Magalu, tecnologia em varejo, redação ou sobre o sistema de roteiros. Se o assunto sair disso, responda educadamente que você só pode ajudar com demandas de conteúdo da Magalu. "
+            "Tenha um tom acolhedor ('estilo magalu'), direto ao ponto, e use emojis ocasionalmente.\n\n"
+        )
+        
+        if supabase_context:
+            system_base += f"--- CONTEXTO ATUAL DO BANCO DE DADOS ---\n{supabase_context}\n---------------------------------------\n"
+
+        return system_base
+
+    def _prompt_chat_gemini(self, user_query, chat_history, supabase_context=None):
+        # Para o Gemini (SDK v1), montaremos a interface como um string prompt 
+        # contendo o system prompt + histórico + pergunta
+        full_prompt = self._sistema_chat(supabase_context) + "\n\n--- HISTÓRICO RECENTE ---\n"
+        for msg in chat_history[-6:]: 
+            r = msg.get('role', 'user').upper()
+            c = msg.get('content', '')
+            full_prompt += f"{r}: {c}\n"
+        full_prompt += f"\nUSUÁRIO: {user_query}\nLU:"
+        return full_prompt
+
+    def _mensagens_chat(self, user_query, chat_history, supabase_context=None):
+        messages = [{"role": "system", "content": self._sistema_chat(supabase_context)}]
+        for msg in chat_history[-6:]:
+            r = "assistant" if msg.get("role") == "Lu" else "user"
+            messages.append({"role": r, "content": msg["content"]})
+            
+        messages.append({"role": "user", "content": user_query})
+        return messages
+
+    def _montar_prompt_otimizacao(self, roteiros_textos: list, codigo: str, nome_produto: str, ficha_tecnica: str = None):
+        """Retorna (sys_prompt, user_prompt) da síntese da Melhor Versão."""
         # Formata os roteiros para o prompt
         roteiros_formatados = ""
         for i, roteiro in enumerate(roteiros_textos):
@@ -803,9 +1345,23 @@ class RoteiristaAgent:
             "Se você não encontrar a ficha técnica, confie apenas nas informações dadas pelas versões."
         )
 
+        # Regras de fonética dos termos presentes nas versões geradas ou na ficha
+        fonetica = self._regras_fonetica("", nome_produto or "", ficha_tecnica or "", *roteiros_textos)
+        if fonetica:
+            sys_prompt += f"\n{fonetica}"
+
         ficha_prompt = f"--- FICHA TÉCNICA ORIGINAL ---\n{ficha_tecnica}\n\n" if ficha_tecnica else ""
         user_prompt = f"Código: {codigo}\nProduto: {nome_produto}\n\n{ficha_prompt}{roteiros_formatados}\n\nPor favor, retorne O ROTEIRO DEFINITIVO (MELHOR VERSÃO) seguindo a formatação padrão NW LU. Sem preâmbulos, texto direto."
 
+        return sys_prompt, user_prompt
+
+    def otimizar_roteiros(self, roteiros_textos: list, codigo: str, nome_produto: str, ficha_tecnica: str = None) -> dict:
+        """
+        Sintetiza de 2 a 5 roteiros selecionados escolhendo os melhores ganchos, argumentos e fechamentos,
+        mantendo o tom de voz da marca e o formato estrito NW LU.
+        """
+        sys_prompt, user_prompt = self._montar_prompt_otimizacao(roteiros_textos, codigo, nome_produto, ficha_tecnica)
+
         contents = [
             sys_prompt,
             user_prompt
@@ -822,16 +1378,12 @@ class RoteiristaAgent:
                 tokens_in = response.usage_metadata.prompt_token_count
                 tokens_out = response.usage_metadata.candidates_token_count
             else:
-                tokens_in = len(str(contents)) // 4
-                tokens_out = len(roteiro) // 4
+                tokens_in = estimar_tokens(str(contents), self.model_id)
+                tokens_out = estimar_tokens(roteiro, self.model_id)
         elif self.client_openai:
-            messages = [
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
             response = self.client_openai.chat.completions.create(
                 model=self.model_id,
-                messages=messages
+                messages=self._mensagens(sys_prompt, user_prompt)
             )
             roteiro = response.choices[0].message.content
             tokens_in = response.usage.prompt_tokens if hasattr(response, 'usage') else 0
@@ -839,12 +1391,57 @@ class RoteiristaAgent:
         else:
             raise Exception("Nenhum cliente LLM configurado válido.")
 
-        custo_brl = calcular_custo_brl(self.model_id, tokens_in, tokens_out)
+        return self._resultado_otimizacao(roteiro, tokens_in, tokens_out)
 
+    def _resultado_otimizacao(self, roteiro, tokens_in, tokens_out):
         return {
             "roteiro": roteiro,
             "model_id": f"{self.model_id} (Otimizado)",
             "tokens_in": tokens_in,
             "tokens_out": tokens_out,
-            "custo_brl": custo_brl
+            "custo_brl": calcular_custo_brl(self.model_id, tokens_in, tokens_out)
         }
+
+    def otimizar_roteiros_stream(self, roteiros_textos: list, codigo: str, nome_produto: str, ficha_tecnica: str = None) -> GeracaoStream:
+        """Versão em streaming de otimizar_roteiros; `.resultado` fica disponível após o consumo."""
+        sys_prompt, user_prompt = self._montar_prompt_otimizacao(roteiros_textos, codigo, nome_produto, ficha_tecnica)
+
+        if self.provider == "gemini":
+            def _chamar(nome_cache):
+                return self.client_gemini.models.generate_content_stream(
+                    model=self.model_id,
+                    contents=[sys_prompt, user_prompt],
+                    config=types.GenerateContentConfig(temperature=0.7)
+                )
+            origem = self._iterar_stream_gemini(_chamar, None, sys_prompt)
+        elif self.client_openai:
+            origem = self._stream_openai([
+                {"role": "system", "content": sys_prompt},
+                {"role": "user", "content": user_prompt}
+            ])
+        else:
+            raise Exception("Nenhum cliente LLM configurado válido.")
+
+        def _finalizar(roteiro, uso):
+            if uso is None:
+                uso = UsoTokens(estimar_tokens(sys_prompt + user_prompt, self.model_id), estimar_tokens(roteiro, self.model_id))
+            return self._resultado_otimizacao(roteiro, uso.tokens_in, uso.tokens_out)
+
+        return GeracaoStream(origem, _finalizar)
+
+
+def prever_lote_cacheado(supabase_client, model_id: str, table_prefix: str, n_skus: int, modo_trabalho: str, paralelismo=None) -> tuple:
+    """
+    (PrevisaoLote, model_id no provedor) de RoteiristaAgent.prever_lote, cacheada por PREVISAO_TTL_S.
+    O agente só é criado quando a previsão não está em cache. `paralelismo(provedor)` dá as chamadas simultâneas.
+    """
+    chave = (model_id, table_prefix, modo_trabalho, n_skus)
+    cached = previsao_cache.get(chave)
+    if cached is not None:
+        return cached
+    versao = previsao_cache.version
+    agent = RoteiristaAgent(supabase_client=supabase_client, model_id=model_id, table_prefix=table_prefix)
+    previsao = agent.prever_lote(n_skus, modo_trabalho, paralelismo=paralelismo(agent.provider) if paralelismo else 1)
+    resultado = (previsao, agent.model_id)
+    previsao_cache.set(chave, resultado, version=versao)
+    return resultado
@@ -12,10 +12,19 @@ from supabase import create_client, Client
 import difflib
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
-from src.agent import RoteiristaAgent, MODELOS_DISPONIVEIS, MODELOS_DESCRICAO, PROVIDER_KEY_MAP
-from src.scraper import scrape_with_gemini, parse_codes
+from src.agent import RoteiristaAgent, MODELOS_DISPONIVEIS, MODELOS_DESCRICAO, PROVIDER_KEY_MAP, prever_lote_cacheado
+from src.scraper import parse_codes, ficha_cacheada
 from src.exporter import export_roteiro_docx, format_for_display, export_all_roteiros_zip
+from src.roteiro import parse_roteiro
+from src.product_sheet import sheet_de, parse_ficha
 from src.jsonld_generator import export_jsonld_string, wrap_in_script_tag
+from src.cache import invalidar_contexto
+from src.batch import MotorLote, ItemLote, MAX_CODIGOS_LOTE, paralelismo_efetivo
+from src.batch_jobs import listar_trabalhos, hidratar_trabalho, sucessos, BATCH_DESCONTO
+from src.history_logger import historico, registrar_historico
+from src.numeracao import reservar_numeros
+from src.licoes import agendar_licoes, falhas
+from src.historico import HISTORICO_PAGINA, HISTORICO_RESUMO_JANELA, buscar_pagina as buscar_pagina_historico, buscar_detalhe as buscar_detalhe_historico, resumo as resumo_historico
 
 load_dotenv()
 
@@ -26,18 +35,6 @@ def get_now_sp():
     """Retorna o datetime atual em São Paulo."""
     return datetime.now(BR_TIMEZONE)
 
-# --- HELPERS PARA NUMERAÇÃO ---
-def get_total_script_count(sp_client):
-    """Retorna o total de registros na tabela historico_roteiros para numeração sequencial."""
-    if not sp_client:
-        return 0
-    try:
-        # Busca o total de registros no banco
-        res = sp_client.table(f"{st.session_state.get('table_prefix', 'nw_')}historico_roteiros").select("id", count="exact").limit(1).execute()
-        return res.count if hasattr(res, 'count') and res.count is not None else 0
-    except Exception:
-        return 0
-
 # --- CONFIGURAÇÃO GERAL ---
 st.set_page_config(page_title="Magalu AI Suite", page_icon="🛍️", layout="wide", initial_sidebar_state="expanded")
 
@@ -326,34 +323,6 @@ def convert_to_sp_time(utc_datetime_str):
     except Exception:
         return utc_datetime_str
 
-def salvar_calibracao_ouro(sp_client, cat_id, roteiro_ia, roteiro_final, percentual, aprendizado, codigo_produto="", titulo_produto="", modelo_calibragem="N/A"):
-    if not sp_client:
-        st.error("Supabase não conectado.")
-        return False
-    try:
-        data = {
-            "categoria_id": cat_id,
-            "codigo_produto": codigo_produto,
-            "titulo_produto": titulo_produto if titulo_produto else codigo_produto,
-            "roteiro_original_ia": roteiro_ia,
-            "roteiro_perfeito": roteiro_final,
-            "nota_percentual": percentual,
-            "aprendizado": aprendizado,
-            "modelo_calibragem": modelo_calibragem,
-            "criado_em": get_now_sp().isoformat()
-        }
-        res = sp_client.table(f"{st.session_state.get('table_prefix', 'nw_')}roteiros_ouro").insert(data).execute()
-        if hasattr(res, 'data') and len(res.data) > 0:
-            msg = f"🏆 Calibragem salva como Roteiro Ouro! (Aproveitamento: {percentual}% | Cat ID: {cat_id} | IA: {modelo_calibragem})"
-            st.success(msg)
-            return True
-        else:
-            st.error("⚠️ Falha ao salvar no Supabase (verifique RLS).")
-            return False
-    except Exception as e:
-        st.error(f"❌ Erro: {e}")
-        return False
-
 def salvar_ouro(sp_client, cat_id, titulo, roteiro_perfeito):
     if not sp_client:
         st.error("Supabase não conectado.")
@@ -367,6 +336,7 @@ def salvar_ouro(sp_client, cat_id, titulo, roteiro_perfeito):
         }
         res = sp_client.table(f"{st.session_state.get('table_prefix', 'nw_')}roteiros_ouro").insert(data).execute()
         if hasattr(res, 'data') and len(res.data) > 0:
+            invalidar_contexto()
             st.success("🏆 Salvo como Roteiro Ouro (Referência Premium)!")
             return True
         else:
@@ -390,6 +360,7 @@ def salvar_persona(sp_client, pilar, texto_ia, texto_humano, lexico, erro):
         }
         res = sp_client.table("nw_treinamento_persona_lu").insert(data).execute()
         if hasattr(res, 'data') and len(res.data) > 0:
+            invalidar_contexto()
             st.success("💃 Feedback de Persona enviado para a base!")
             return True
         else:
@@ -412,6 +383,7 @@ def salvar_fonetica(sp_client, termo_err, termo_cor, exemplo_rot):
         }
         res = sp_client.table("nw_treinamento_fonetica").insert(data).execute()
         if hasattr(res, 'data') and len(res.data) > 0:
+            invalidar_contexto()
             st.success("🗣️ Nova regra de Fonética cadastrada!")
             return True
         else:
@@ -421,143 +393,45 @@ def salvar_fonetica(sp_client, termo_err, termo_cor, exemplo_rot):
         st.error(f"❌ Erro: {e}")
         return False
 
-def _auto_salvar_fonetica(sp_client, fonetica_regras):
-    """Salva regras fonéticas automaticamente a partir da calibragem, evitando duplicatas."""
-    if not sp_client or not fonetica_regras:
-        return 0
-    
-    count = 0
-    for regra in fonetica_regras:
-        if not isinstance(regra, dict):
-            continue
-        termo_err = str(regra.get('termo_errado', '')).strip()
-        termo_cor = str(regra.get('termo_corrigido', '')).strip()
-        exemplo = str(regra.get('exemplo', '')).strip()
-        if not termo_err or not termo_cor:
-            continue
-        
-        try:
-            existing = sp_client.table("nw_treinamento_fonetica").select("id").eq("termo_errado", termo_err).execute()
-            if not existing.data:
-                sp_client.table("nw_treinamento_fonetica").insert({
-                    "termo_errado": termo_err,
-                    "termo_corrigido": termo_cor,
-                    "exemplo_no_roteiro": exemplo,
-                    "criado_em": get_now_sp().isoformat()
-                }).execute()
-                count += 1
-        except Exception as e:
-            st.error(f"Erro ao salvar fonética: {e}")
-    
-    if count > 0:
-        st.toast(f"📖 {count} regra(s) fonética(s) aprendida(s) automaticamente!", icon="🎓")
-    return count
-
-def _auto_salvar_estrutura(sp_client, estrutura_regras):
-    """Salva regras de abertura/fechamento automaticamente a partir da calibragem."""
-    if not sp_client or not estrutura_regras:
-        return 0
-    
-    count = 0
-    for regra in estrutura_regras:
-        if not isinstance(regra, dict):
-            continue
-        tipo = str(regra.get('tipo', '')).strip()
-        texto_ouro = str(regra.get('texto_ouro', '')).strip()
-        # Tenta pegar prioritariamente 'texto_ia' (novo padrão) ou 'antes' (fallback)
-        raw_ia = regra.get('texto_ia', regra.get('antes', ''))
-        texto_ia_rej = str(raw_ia).strip() if raw_ia and str(raw_ia).lower() != 'none' else ""
-        
-        # Normalização para o padrão do banco
-        if "Abertura" in tipo: tipo = "Abertura (Gancho)"
-        elif "Fechamento" in tipo or "CTA" in tipo: tipo = "Fechamento (CTA)"
-        else: tipo = "Desenvolvimento (Venda)"
-        
-        if not texto_ouro or tipo not in ('Abertura (Gancho)', 'Fechamento (CTA)', 'Desenvolvimento (Venda)'):
-            continue
-        
-        try:
-            sp_client.table(f"{st.session_state.get('table_prefix', 'nw_')}treinamento_estruturas").insert({
-                "tipo_estrutura": tipo,
-                "texto_ouro": texto_ouro,
-                "texto_ia_rejeitado": texto_ia_rej,
-                "aprendizado": str(regra.get('motivo', '')).strip(),
-                "criado_em": get_now_sp().isoformat()
-            }).execute()
-            count += 1
-        except Exception as e:
-            st.error(f"Erro ao salvar estrutura: {e}")
-    
-    if count > 0:
-        st.toast(f"📝 {count} estrutura(s) (abertura/fechamento) aprendida(s)!", icon="✨")
-    return count
-
-def _auto_salvar_persona(sp_client, persona_regras):
-    """Salva regras de persona da Lu automaticamente a partir da calibragem."""
-    if not sp_client or not persona_regras:
-        return 0
-    
-    count = 0
-    for regra in persona_regras:
-        if not isinstance(regra, dict):
-            continue
-        pilar = str(regra.get('pilar', '')).strip()
-        erro = str(regra.get('erro', '')).strip()
-        correcao = str(regra.get('correcao', '')).strip()
-        lexico = str(regra.get('lexico', '')).strip()
-        if not pilar or not erro:
-            continue
-        
+def _agendar_licoes_calibragem(sp_client, ouro, f_regras, e_regras, p_regras, i_regras, codigo_p=""):
+    """Entrega a gravação do Roteiro Ouro e das regras a um job em segundo plano (idempotente pela calibragem)."""
+    if not sp_client:
+        st.error("Supabase não conectado.")
+        return
+    futuro, nova = agendar_licoes(
+        sp_client, table_prefix=st.session_state.get('table_prefix', 'nw_'), criado_em=get_now_sp().isoformat(),
+        ouro=ouro, fonetica=f_regras, estrutura=e_regras, persona=p_regras, imagens=i_regras, codigo_produto=codigo_p
+    )
+    # Avisos exibidos no próximo rerun (o modal fecha com st.rerun logo em seguida)
+    avisos = st.session_state.setdefault('licoes_avisos', [])
+    if not nova and futuro.done():
+        avisos.append(("ok", f"ℹ️ Esta calibragem de {codigo_p or 'produto'} já estava gravada."))
+        return
+    st.session_state.setdefault('licoes_jobs', {})[id(futuro)] = {"futuro": futuro, "codigo": codigo_p, "percentual": ouro['nota_percentual']}
+    avisos.append(("info", f"💾 Gravando as lições de {codigo_p or 'produto'} em segundo plano..."))
+
+@st.fragment(run_every=2)
+def _acompanhar_licoes():
+    """Acompanha os jobs de gravação da calibragem; ao terminar, guarda o aviso e recarrega o app uma vez."""
+    jobs = st.session_state.get('licoes_jobs', {})
+    concluidos = [k for k, j in jobs.items() if j["futuro"].done()]
+    if not concluidos:
+        return
+    avisos = st.session_state.setdefault('licoes_avisos', [])
+    for k in concluidos:
+        job = jobs.pop(k)
         try:
-            sp_client.table("nw_treinamento_persona_lu").insert({
-                "pilar_persona": pilar,
-                "texto_gerado_ia": erro,
-                "texto_corrigido_humano": correcao,
-                "lexico_sugerido": lexico,
-                "criado_em": get_now_sp().isoformat()
-            }).execute()
-            count += 1
+            resumo = job["futuro"].result()
         except Exception as e:
-            st.error(f"Erro ao salvar persona: {e}")
-    
-    if count > 0:
-        st.toast(f"💃 {count} regra(s) de persona da Lu aprendida(s)!", icon="🎭")
-    return count
-
-def _auto_salvar_imagens(sp_client, imagens_regras, codigo_p=""):
-    """Salva calibragem de descrições de imagem automaticamente."""
-    if not sp_client or not imagens_regras:
-        return 0
-    
-    count = 0
-    for regra in imagens_regras:
-        if not isinstance(regra, dict):
-            continue
-        raw_antes = regra.get('antes', '')
-        raw_depois = regra.get('depois', '')
-        antes = str(raw_antes).strip() if raw_antes and str(raw_antes).lower() != 'none' else ""
-        depois = str(raw_depois).strip() if raw_depois and str(raw_depois).lower() != 'none' else ""
-        motivo = str(regra.get('motivo', '')).strip()
-        
-        if not antes or not depois:
+            avisos.append(("erro", f"❌ Falha ao gravar a calibragem de {job['codigo']}: {e}"))
             continue
-            
-        try:
-            prefix = st.session_state.get('table_prefix', 'nw_')
-            sp_client.table(f"{prefix}treinamento_imagens").insert({
-                "codigo_produto": codigo_p,
-                "descricao_ia": antes,
-                "descricao_humano": depois,
-                "aprendizado": motivo,
-                "criado_em": get_now_sp().isoformat()
-            }).execute()
-            count += 1
-        except Exception as e:
-            st.error(f"Erro ao salvar lição visual: {e}")
-            
-    if count > 0:
-        st.toast(f"📸 {count} lição(ões) visual(ais) aprendida(s)!", icon="🖼️")
-    return count
+        erros = falhas(resumo)
+        total = sum(r['gravadas'] for r in resumo.values())
+        if erros:
+            avisos.append(("erro", f"❌ Calibragem de {job['codigo']}: falha em {', '.join(erros)}. Confirme de novo para regravar só essas tabelas."))
+        if total or not erros:
+            avisos.append(("ok", f"🏆 Calibragem de {job['codigo']} gravada ({job['percentual']}%): {total} lição(ões) em {len(resumo) - len(erros)} tabela(s)."))
+    st.rerun()
 
 def salvar_imagem(sp_client, sku, ia_desc, hum_desc, motivo):
     if not sp_client:
@@ -574,6 +448,7 @@ def salvar_imagem(sp_client, sku, ia_desc, hum_desc, motivo):
         prefix = st.session_state.get('table_prefix', 'nw_')
         res = sp_client.table(f"{prefix}treinamento_imagens").insert(data).execute()
         if hasattr(res, 'data') and len(res.data) > 0:
+            invalidar_contexto()
             st.success("🖼️ Calibragem visual salva com sucesso!")
             return True
         else:
@@ -598,6 +473,7 @@ def salvar_estrutura(sp_client, tipo, texto, texto_ia=""):
         }
         res = sp_client.table(f"{st.session_state.get('table_prefix', 'nw_')}treinamento_estruturas").insert(data).execute()
         if hasattr(res, 'data') and len(res.data) > 0:
+            invalidar_contexto()
             st.success(f"💬 {tipo} cadastrada com sucesso!")
             return True
         else:
@@ -620,6 +496,7 @@ def salvar_nuance(sp_client, frase, analise, exemplo):
         }
         res = sp_client.table(f"{st.session_state.get('table_prefix', 'nw_')}treinamento_nuances").insert(data).execute()
         if hasattr(res, 'data') and len(res.data) > 0:
+            invalidar_contexto()
             st.success("🧠 Nuance de linguagem registrada para o treinamento!")
             return True
         else:
@@ -778,31 +655,25 @@ def modal_resultado_calibragem(calc, sp_cli, roteiro_ia, roteiro_humano, titulo_
     st.caption("Ao confirmar, a IA alimentará simultaneamente as tabelas acima.")
     
     if st.button("🚀 Confirmar e Gravar Todas as Lições", type="primary", use_container_width=True):
-        # Salva Feedback Ouro (Aba Feedback)
+        # Salva Feedback Ouro (Aba Feedback); sem categoria, o job usa a "Genérico"
         cat_id = final_cat_id_modal
-        if not cat_id:
-             # Fallback categoria ID
-             try:
-                 # Categoria é sempre nw_categorias independente do prefixo do formato
-                 res_c = sp_cli.table("nw_categorias").select("id, nome").execute()
-                 lista_c = res_c.data if hasattr(res_c, 'data') else []
-                 cat_id = next((c['id'] for c in lista_c if 'Genérico' in c['nome']), 77)
-             except Exception as e_cat:
-                 print(f"Erro ao buscar categorias: {e_cat}")
-                 cat_id = 77
                  
         # Concatena resumo estratégico com diretrizes técnicas
         aprendizado_final = calc['aprendizado']
         if calc.get('resumo_estrategico'):
             aprendizado_final = f"🎯 DIREÇÃO CRIATIVA: {calc['resumo_estrategico']}\n\n📝 DIRETRIZES TÉCNICAS:\n{calc['aprendizado']}"
 
-        salvar_calibracao_ouro(sp_cli, cat_id, roteiro_ia, roteiro_humano, calc['percentual'], aprendizado_final, codigo_p, titulo_curto, calc.get('modelo_calibragem', 'N/A'))
-        
-        # Salva as outras tabelas (Persona, Fonética, Estrutura, Imagens)
-        _auto_salvar_fonetica(sp_cli, f_regras)
-        _auto_salvar_estrutura(sp_cli, e_regras)
-        _auto_salvar_persona(sp_cli, p_regras)
-        _auto_salvar_imagens(sp_cli, i_regras, codigo_p)
+        # Roteiro Ouro + Persona, Fonética, Estrutura e Imagens: gravados em segundo plano, o modal fecha já
+        _agendar_licoes_calibragem(sp_cli, {
+            "categoria_id": cat_id,
+            "codigo_produto": codigo_p,
+            "titulo_produto": titulo_curto if titulo_curto else codigo_p,
+            "roteiro_original_ia": roteiro_ia,
+            "roteiro_perfeito": roteiro_humano,
+            "nota_percentual": calc['percentual'],
+            "aprendizado": aprendizado_final,
+            "modelo_calibragem": calc.get('modelo_calibragem', 'N/A')
+        }, f_regras, e_regras, p_regras, i_regras, codigo_p)
         
         st.session_state['calibragem_concluida'] = True
         if 'pending_calibration' in st.session_state:
@@ -1060,6 +931,12 @@ with st.sidebar:
                 del st.session_state['pending_calibration']
                 st.rerun()
 
+# --- GRAVAÇÃO DAS LIÇÕES EM SEGUNDO PLANO ---
+for tipo_aviso, msg_aviso in st.session_state.pop('licoes_avisos', []):
+    st.toast(msg_aviso, icon={"ok": "🎓", "info": "⏳"}.get(tipo_aviso, "⚠️"))
+if st.session_state.get('licoes_jobs'):
+    _acompanhar_licoes()
+
 @st.fragment
 def show_calibragem_summary():
     """Exibe um resumo persistente das regras aprendidas após calibragem."""
@@ -1190,7 +1067,7 @@ if page == "Criar Roteiros":
             st.markdown("<br>", unsafe_allow_html=True)
             st.markdown("### 3. Códigos dos Produtos")
 
-            st.markdown("<p style='font-size: 14px; color: #8b92a5'>Digite os códigos Magalu, um por linha. Mínimo 3 dígitos. Máximo 15 por vez.</p>", unsafe_allow_html=True)
+            st.markdown(f"<p style='font-size: 14px; color: #8b92a5'>Digite os códigos Magalu, um por linha. Mínimo 3 dígitos. Máximo {MAX_CODIGOS_LOTE} por vez.</p>", unsafe_allow_html=True)
             
             codigos_raw = st.text_area(
                 "Códigos dos Produtos",
@@ -1200,6 +1077,55 @@ if page == "Criar Roteiros":
                 label_visibility="collapsed"
             )
             st.caption("💡 O código fica na URL: magazineluiza.com.br/.../p/**240304700**/...")
+            forcar_extracao = st.checkbox(
+                "🔄 Forçar nova extração (ignorar fichas em cache)",
+                value=False,
+                key="forcar_extracao_auto",
+                help="As fichas extraídas ficam em cache local por SKU. Marque para buscar novamente no Google/Magalu."
+            )
+            modo_lote_job = st.checkbox(
+                "📦 Modo lote offline (batch — ~50% mais barato, entrega em até 24h)",
+                value=False,
+                key="modo_lote_job_auto",
+                help="Para rodadas grandes de catálogo: os roteiros são enviados como um único job ao provedor (Gemini/OpenAI) e importados depois em 'Lotes enviados'."
+            )
+
+            # --- LOTES OFFLINE PENDENTES ---
+            trabalhos_pendentes = listar_trabalhos()
+            if trabalhos_pendentes:
+                with st.expander(f"📦 Lotes enviados ({len(trabalhos_pendentes)} aguardando importação)", expanded=False):
+                    for trab in trabalhos_pendentes:
+                        col_tj, col_bj = st.columns([4, 1])
+                        with col_tj:
+                            st.markdown(f"**{trab.id}** · {len(trab.itens)} SKUs · `{trab.model_id}` via {trab.provedor} · status: {trab.status}")
+                        with col_bj:
+                            if st.button("🔄 Verificar", key=f"btn_lote_job_{trab.id}", use_container_width=True):
+                                try:
+                                    sp_cli_job = st.session_state.get('supabase_client')
+                                    # Prefixo do envio (jobs antigos, sem ele salvo, usam o da sessão)
+                                    prefixo_job = trab.parametros.get('table_prefix') or st.session_state.get('table_prefix', 'nw_')
+                                    ag_job = RoteiristaAgent(supabase_client=sp_cli_job, model_id=trab.model_id, table_prefix=prefixo_job)
+                                    resultados_job = ag_job.coletar_lote_job(trab)
+                                    if resultados_job is None:
+                                        st.info("⏳ O provedor ainda está processando este lote.")
+                                    else:
+                                        # Só os SKUs com roteiro consomem números
+                                        n_ok_job = sucessos(resultados_job)
+                                        cards_job = hidratar_trabalho(
+                                            trab, resultados_job, sp_cli_job,
+                                            table_prefix=prefixo_job,
+                                            global_inicial=reservar_numeros(sp_cli_job, prefixo_job, n_ok_job) if n_ok_job else 1,
+                                            criado_em=get_now_sp().isoformat()
+                                        )
+                                        for card in reversed(cards_job):
+                                            st.session_state['roteiros'].insert(0, card)
+                                        erros_job = [f"❌ Erro no SKU {r['item']['codigo']}: {r['erro']}" for r in resultados_job if r.get("erro")]
+                                        if erros_job:
+                                            st.session_state['last_errors'] = erros_job
+                                        st.session_state['roteiro_ativo_idx'] = 0
+                                        st.rerun()
+                                except Exception as e:
+                                    st.error(f"Erro ao consultar o lote {trab.id}: {e}")
 
             st.markdown("<br>", unsafe_allow_html=True)
             
@@ -1208,8 +1134,8 @@ if page == "Criar Roteiros":
                 codigos = parse_codes(codigos_raw) if codigos_raw else []
                 if not codigos:
                     st.warning("⚠️ Digite pelo menos um código de produto.")
-                elif len(codigos) > 15:
-                    st.warning("⚠️ Limite excedido: Por favor, insira no máximo 15 códigos por vez (Rate Limit da API).")
+                elif len(codigos) > MAX_CODIGOS_LOTE:
+                    st.warning(f"⚠️ Limite excedido: Por favor, insira no máximo {MAX_CODIGOS_LOTE} códigos por vez.")
                 else:
                     df_pre = pd.DataFrame({
                         "SKU Principal": codigos,
@@ -1243,13 +1169,33 @@ if page == "Criar Roteiros":
                     }
                 )
                 
+                # --- PREVISÃO ANTES DE RODAR (tokens, custo e duração do lote) ---
+                try:
+                    modelo_prev = st.session_state.get('modelo_llm', 'gemini-3-flash-preview')
+                    prev, modelo_prev_id = prever_lote_cacheado(
+                        st.session_state.get('supabase_client'), modelo_prev, st.session_state.get('table_prefix', 'nw_'),
+                        len(df_edited), modo_selecionado, paralelismo=paralelismo_efetivo
+                    )
+                    custo_prev = prev.custo_total_brl * (BATCH_DESCONTO if modo_lote_job else 1)
+                    base_prev = f"{prev.amostras} gerações observadas" if prev.amostras else "estimativa padrão, sem histórico deste modelo"
+                    st.caption(
+                        f"📊 **Previsão ({modelo_prev_id}):** ~{prev.tokens_in_sku:,} tokens de entrada e ~{prev.tokens_out_sku:,} de saída por SKU · "
+                        f"custo estimado **R$ {custo_prev:.2f}** · duração ~**{max(1, round(prev.duracao_s / 60))} min** ({base_prev})"
+                    )
+                except Exception as e:
+                    print(f"[BUDGET] Previsão indisponível: {e}")
+
                 if st.button("🚀 Iniciar Extração e Geração", use_container_width=True, type="primary", key="btn_auto"):
                     if modo_selecionado not in ["NW (NewWeb)", "3D (NewWeb 3D)", "SOCIAL", "Review (NwReview)"]:
                         st.warning(f"🚧 O formato {modo_selecionado} ainda está em desenvolvimento.")
                         st.stop()
                     
-                    codigos = [str(row['SKU Principal']).strip() for _, row in df_edited.iterrows()]
-                    total = len(codigos)
+                    itens_lote = []
+                    for _, row in df_edited.iterrows():
+                        val_sub = row['Outros Códigos (Cor/Voltagem)']; sub_skus = str(val_sub).strip() if pd.notna(val_sub) and str(val_sub).lower() != 'nan' else ''
+                        val_vid = row['Vídeo do Fornecedor (Link)']; video_url = str(val_vid).strip() if pd.notna(val_vid) and str(val_vid).lower() != 'nan' else ''
+                        itens_lote.append(ItemLote(codigo=str(row['SKU Principal']).strip(), sub_skus=sub_skus, video_url=video_url))
+                    total = len(itens_lote)
                     progress_text = st.empty()
                     bar = st.progress(0)
                     
@@ -1259,79 +1205,107 @@ if page == "Criar Roteiros":
                     
                      # Instancia Agente (fora do loop para eficiência)
                     agent = RoteiristaAgent(supabase_client=sp_cli, model_id=modelo_id, table_prefix=table_prefix)
-                    
-                    erros_lote = []
-                    for i, (idx, row) in enumerate(df_edited.iterrows()):
-                        current_code = str(row['SKU Principal']).strip()
-                        percent = int((i + 1) / total * 100)
-                        progress_text.markdown(f"**⏳ Processando {i+1}/{total} ({percent}%):** SKU {current_code}")
-                        bar.progress((i + 1) / total)
-                        
+                    gemini_key = os.environ.get("GEMINI_API_KEY") or st.secrets.get("GEMINI_API_KEY")
+                    motor = MotorLote(agent, api_key=gemini_key, force_refresh=forcar_extracao)
+
+                    if modo_lote_job:
+                        # Modo lote offline: extrai todas as fichas e envia um único job ao provedor
                         try:
-                            with st.status(f"🚀 SKU {current_code} ({i+1}/{total})", expanded=True) as status_box:
-                                
-                                # 1. Scrape
-                                status_box.write("🔍 **Etapa 1:** Extraindo dados técnicos Magalu (Scraping)...")
-                                gemini_key = os.environ.get("GEMINI_API_KEY") or st.secrets.get("GEMINI_API_KEY")
-                                ficha_extraida = scrape_with_gemini(current_code, api_key=gemini_key)
-                                
-                                # 2. Geração
-                                status_box.write("🧠 **Etapa 2:** Consultando IA e aplicando aprendizados (Agent)...")
-                                val_sub = row['Outros Códigos (Cor/Voltagem)']; sub_skus = str(val_sub).strip() if pd.notna(val_sub) and str(val_sub).lower() != 'nan' else ''
-                                val_vid = row['Vídeo do Fornecedor (Link)']; video_url = str(val_vid).strip() if pd.notna(val_vid) and str(val_vid).lower() != 'nan' else ''
-                                
-                                res_gen = agent.gerar_roteiro(
-                                    scraped_data=ficha_extraida,
+                            with st.spinner(f"🔍 Extraindo {total} fichas técnicas..."):
+                                fichas_lote = motor.extrair(itens_lote)
+                            with st.spinner("📦 Enviando lote ao provedor..."):
+                                trabalho = agent.submeter_lote_job(
+                                    itens_lote, fichas_lote,
                                     modo_trabalho=modo_selecionado,
-                                    codigo=current_code,
-                                    sub_skus=sub_skus,
-                                    video_url=video_url,
                                     data_roteiro=data_roteiro_str,
                                     mes=mes_selecionado,
-                                    com_lu=(com_lu_auto == "Com LU")
+                                    com_lu=(com_lu_auto == "Com LU"),
+                                    categoria_id=cat_selecionada_id
                                 )
-                                
-                                # 3. Resultado e Salvamento
-                                status_box.write("💾 **Etapa 3:** Registrando no histórico e finalizando...")
-                                global_num = get_total_script_count(sp_cli) + 1
-                                novo_roteiro = {
-                                    "_uid": str(uuid.uuid4()),
-                                    "ficha": ficha_extraida,
-                                    "roteiro_original": res_gen["roteiro"],
-                                    "codigo": current_code,
-                                    "model_id": res_gen["model_id"],
-                                    "tokens_in": res_gen["tokens_in"],
-                                    "tokens_out": res_gen["tokens_out"],
-                                    "custo_brl": res_gen["custo_brl"],
-                                    "global_num": global_num,
-                                    "mes": mes_selecionado,
-                                    "com_lu": "REVIEW" if "Review" in modo_selecionado else (com_lu_auto == "Com LU")
-                                }
-                                
-                                # Log Histórico
-                                if sp_cli:
-                                    try:
-                                        sp_cli.table(f"{table_prefix}historico_roteiros").insert({
-                                            "codigo_produto": current_code,
-                                            "modo_trabalho": modo_selecionado,
-                                            "roteiro_gerado": res_gen["roteiro"],
-                                            "ficha_extraida": str(ficha_extraida)[:5000],
-                                            "modelo_llm": res_gen["model_id"],
-                                            "tokens_entrada": res_gen["tokens_in"],
-                                            "tokens_saida": res_gen["tokens_out"],
-                                            "custo_estimado_brl": res_gen["custo_brl"],
-                                            "categoria_id": cat_selecionada_id,
-                                            "criado_em": get_now_sp().isoformat()
-                                        }).execute()
-                                    except Exception as e:
-                                        print(f"❌ Erro ao salvar histórico (Auto): {e}")
-                                
-                                status_box.update(label=f"✅ SKU {current_code} Finalizado!", state="complete")
-                                
-                                st.session_state['roteiros'].insert(0, novo_roteiro)
+                            st.success(f"📦 Lote {trabalho.id} enviado com {total} SKUs. Use 'Lotes enviados' para importar quando o provedor concluir.")
+                        except Exception as e:
+                            st.error(f"Erro ao enviar o lote: {e}")
+                        st.stop()
+                    
+                    # Uma caixa de status por SKU, criada na ordem do lote e atualizada conforme cada um termina
+                    status_boxes = [
+                        st.status(f"⏳ SKU {itm.codigo} ({i+1}/{total}) na fila...", expanded=False)
+                        for i, itm in enumerate(itens_lote)
+                    ]
+                    
+                    erros_lote = []
+                    concluidos = 0
+                    # Um bloco de números para o lote inteiro (SKUs com erro deixam o número vago)
+                    global_inicial = reservar_numeros(sp_cli, table_prefix, total)
+                    for evento in motor.executar(
+                        itens_lote,
+                        modo_trabalho=modo_selecionado,
+                        data_roteiro=data_roteiro_str,
+                        mes=mes_selecionado,
+                        com_lu=(com_lu_auto == "Com LU"),
+                        categoria_id=cat_selecionada_id
+                    ):
+                        current_code = evento.item.codigo
+                        status_box = status_boxes[evento.indice]
+                        
+                        if evento.tipo == "etapa":
+                            status_box.update(label=f"🚀 SKU {current_code} ({evento.indice+1}/{total})", state="running")
+                            status_box.write(evento.mensagem)
+                            continue
+                        
+                        concluidos += 1
+                        percent = int(concluidos / total * 100)
+                        progress_text.markdown(f"**⏳ Concluídos {concluidos}/{total} ({percent}%):** último SKU {current_code}")
+                        bar.progress(concluidos / total)
+                        
+                        if evento.erro:
+                            err_msg = f"❌ Erro no SKU {current_code}: {evento.erro}"
+                            status_box.update(label=err_msg, state="error")
+                            erros_lote.append(err_msg)
+                            continue
+                        
+                        try:
+                            ficha_extraida = evento.ficha
+                            res_gen = evento.resultado
+                            
+                            # 3. Resultado e Salvamento
+                            status_box.write("💾 **Etapa 3:** Registrando no histórico e finalizando...")
+                            global_num = global_inicial + evento.indice
+                            novo_roteiro = {
+                                "_uid": str(uuid.uuid4()),
+                                "ficha": ficha_extraida,
+                                "roteiro_original": res_gen["roteiro"],
+                                "codigo": current_code,
+                                "model_id": res_gen["model_id"],
+                                "tokens_in": res_gen["tokens_in"],
+                                "tokens_out": res_gen["tokens_out"],
+                                "custo_brl": res_gen["custo_brl"],
+                                "global_num": global_num,
+                                "mes": mes_selecionado,
+                                "com_lu": "REVIEW" if "Review" in modo_selecionado else (com_lu_auto == "Com LU")
+                            }
+                            
+                            # Log Histórico (write-behind: gravado em lote pela thread do histórico)
+                            if sp_cli:
+                                registrar_historico(sp_cli, f"{table_prefix}historico_roteiros", {
+                                    "codigo_produto": current_code,
+                                    "modo_trabalho": modo_selecionado,
+                                    "roteiro_gerado": res_gen["roteiro"],
+                                    "ficha_extraida": sheet_de(ficha_extraida, current_code).texto[:5000],
+                                    "modelo_llm": res_gen["model_id"],
+                                    "tokens_entrada": res_gen["tokens_in"],
+                                    "tokens_saida": res_gen["tokens_out"],
+                                    "custo_estimado_brl": res_gen["custo_brl"],
+                                    "categoria_id": cat_selecionada_id,
+                                    "criado_em": get_now_sp().isoformat()
+                                })
+                            
+                            status_box.update(label=f"✅ SKU {current_code} Finalizado!", state="complete")
+                            
+                            st.session_state['roteiros'].insert(0, novo_roteiro)
                         except Exception as e:
                             err_msg = f"❌ Erro no SKU {current_code}: {str(e)}"
-                            st.error(err_msg)
+                            status_box.update(label=err_msg, state="error")
                             erros_lote.append(err_msg)
 
                     st.session_state['roteiro_ativo_idx'] = 0
@@ -1343,6 +1317,8 @@ if page == "Criar Roteiros":
                     else:
                         st.warning(f"⚠️ Concluído com {len(erros_lote)} erro(s). Veja os detalhes acima.")
                     
+                    # Uma única descarga no fim do lote, para o Histórico já mostrar os roteiros
+                    historico.descarregar(timeout_s=10)
                     st.rerun()
 
         with tab_manual:
@@ -1430,6 +1406,7 @@ if page == "Criar Roteiros":
                     agent = RoteiristaAgent(supabase_client=sp_cli, model_id=modelo_id, table_prefix=table_prefix)
                     
                     progress_text_man = st.empty()
+                    global_inicial_man = reservar_numeros(sp_cli, table_prefix, total)
                     for i, itm in enumerate(fichas_validas):
                         percent = int((i + 1) / total * 100)
                         progress_text_man.markdown(f"**⏳ Processando {i+1}/{total} ({percent}%):** SKU {itm['sku']}")
@@ -1439,11 +1416,12 @@ if page == "Criar Roteiros":
                             with st.status(f"🚀 SKU {itm['sku']} ({i+1}/{total})", expanded=True) as status_box_man:
                                 # 1. Preparação
                                 status_box_man.write("📝 **Etapa 1:** Processando ficha técnica manual...")
-                                ficha_man = {"text": itm["ficha"], "images": []}
+                                ficha_man = {"text": itm["ficha"], "images": [], "sheet": parse_ficha(itm["ficha"], itm["sku"])}
                                 
                                 # 2. Geração
                                 status_box_man.write("🧠 **Etapa 2:** Consultando IA e aplicando aprendizados...")
-                                res_gen = agent.gerar_roteiro(
+                                # Streaming: o roteiro aparece conforme o modelo escreve (cabeçalho corrigido ao final)
+                                stream_man = agent.gerar_roteiro_stream(
                                     scraped_data=ficha_man,
                                     modo_trabalho=modo_man_selecionado,
                                     codigo=itm["sku"],
@@ -1451,12 +1429,15 @@ if page == "Criar Roteiros":
                                     mes=mes_selecionado_man,
                                     video_url=itm.get("link", ""),
                                     com_lu=(com_lu_man == "Com LU"),
-                                    comentarios=itm.get("comentarios", "")
+                                    comentarios=itm.get("comentarios", ""),
+                                    categoria_id=cat_selecionada_id
                                 )
+                                status_box_man.write_stream(stream_man)
+                                res_gen = stream_man.resultado
                                 
                                 # 3. Salvamento
                                 status_box_man.write("💾 **Etapa 3:** Registrando no histórico...")
-                                global_num = get_total_script_count(sp_cli) + 1
+                                global_num = global_inicial_man + i
                                 novo_roteiro = {
                                     "_uid": str(uuid.uuid4()),
                                     "ficha": ficha_man,
@@ -1472,22 +1453,20 @@ if page == "Criar Roteiros":
                                 }
                                 st.session_state['roteiros'].insert(0, novo_roteiro)
                                 
-                                # Log Histórico
+                                # Log Histórico (write-behind; criado_em da geração, não da gravação)
                                 if sp_cli:
-                                    try:
-                                        sp_cli.table(f"{table_prefix}historico_roteiros").insert({
-                                            "codigo_produto": itm['sku'],
-                                            "modo_trabalho": modo_man_selecionado,
-                                            "roteiro_gerado": res_gen["roteiro"],
-                                            "ficha_extraida": itm['ficha'],
-                                            "tokens_entrada": res_gen["tokens_in"],
-                                            "tokens_saida": res_gen["tokens_out"],
-                                            "custo_estimado_brl": res_gen["custo_brl"],
-                                            "modelo_llm": res_gen["model_id"],
-                                            "categoria_id": cat_selecionada_id
-                                        }).execute()
-                                    except Exception as e:
-                                        print(f"❌ Erro ao salvar histórico (Manual): {e}")
+                                    registrar_historico(sp_cli, f"{table_prefix}historico_roteiros", {
+                                        "codigo_produto": itm['sku'],
+                                        "modo_trabalho": modo_man_selecionado,
+                                        "roteiro_gerado": res_gen["roteiro"],
+                                        "ficha_extraida": itm['ficha'],
+                                        "tokens_entrada": res_gen["tokens_in"],
+                                        "tokens_saida": res_gen["tokens_out"],
+                                        "custo_estimado_brl": res_gen["custo_brl"],
+                                        "modelo_llm": res_gen["model_id"],
+                                        "categoria_id": cat_selecionada_id,
+                                        "criado_em": get_now_sp().isoformat()
+                                    })
                                 
                                 status_box_man.update(label=f"✅ SKU {itm['sku']} Finalizado!", state="complete")
                                 
@@ -1495,6 +1474,7 @@ if page == "Criar Roteiros":
                             st.error(f"Erro no SKU {itm['sku']}: {e}")
 
                     st.session_state['roteiro_ativo_idx'] = 0
+                    historico.descarregar(timeout_s=10)
                     st.rerun()
 
     # --- SCRIPTS DA SESSÃO (CARDS VISÍVEIS — SEM EXPANDER) ---
@@ -1514,11 +1494,10 @@ if page == "Criar Roteiros":
             num_tag = f"#{r_item.get('global_num', '?')}"
             modelo_tag = r_item.get("model_id", "").split("/")[-1][:12]
             
-            # Tenta pegar o nome do produto da ficha
-            ficha_raw = r_item.get('ficha', '')
-            ficha_str = ficha_raw.get('text', str(ficha_raw)) if isinstance(ficha_raw, dict) else str(ficha_raw)
-            linhas_f = ficha_str.split('\n')
-            nome_p_card = linhas_f[0][:40].strip() if linhas_f and len(linhas_f[0]) > 2 else "Produto"
+            # Nome do produto pelo cabeçalho do roteiro (parse memoizado); senão, título da ficha
+            nome_p_card = parse_roteiro(r_item.get('roteiro_original', '')).cabecalho.nome_produto[:40].strip()
+            if not nome_p_card or "NOME DO PRODUTO" in nome_p_card.upper():
+                nome_p_card = sheet_de(r_item.get('ficha', ''), codigo_card).nome[:40].strip()
             
             custo = r_item.get("custo_brl", 0)
             tag_custo = "Grátis" if custo == 0 else f"R$ {custo:.4f}"
@@ -1631,9 +1610,9 @@ if page == "Criar Roteiros":
                             textos_para_mix = [r['roteiro_original'] for r in roteiros_to_mix]
                             
                             st.write("🔍 Extraindo Ficha Técnica como referência...")
-                            ficha_base = roteiros_to_mix[0].get('ficha', '')
-                            ficha_str = ficha_base.get('text', str(ficha_base)) if isinstance(ficha_base, dict) else str(ficha_base)
-                            nome_produto = roteiros_to_mix[0].get('codigo', 'Produto')
+                            sheet_base = sheet_de(roteiros_to_mix[0].get('ficha', ''), roteiros_to_mix[0].get('codigo', ''))
+                            ficha_str = sheet_base.texto
+                            nome_produto = sheet_base.titulo or roteiros_to_mix[0].get('codigo', 'Produto')
                             
                             st.write("🧠 Acionando a Inteligência Artificial (Diretor de Criação)...")
                             try:
@@ -1642,12 +1621,14 @@ if page == "Criar Roteiros":
                                     model_id=st.session_state.get('modelo_llm', 'gemini-3-flash-preview'),
                                     table_prefix=st.session_state.get('table_prefix', 'nw_')
                                 )
-                                resultado = ag.otimizar_roteiros(
+                                stream_mix = ag.otimizar_roteiros_stream(
                                     roteiros_textos=textos_para_mix,
                                     codigo=roteiros_to_mix[0].get('codigo', ''),
                                     nome_produto=nome_produto,
                                     ficha_tecnica=ficha_str
                                 )
+                                st.write_stream(stream_mix)
+                                resultado = stream_mix.resultado
                                 
                                 st.write("✅ Roteiro sintetizado com sucesso!")
                                 status.update(label="🚀 Melhor versão concluída!", state="complete", expanded=False)
@@ -1759,14 +1740,9 @@ if page == "Criar Roteiros":
                                             "is_best_version": is_otimizado,
                                             "_uid": str(uuid.uuid4())
                                         }
-                                        try:
-                                            first_line = r_row['roteiro_gerado'].split('\n')[0]
-                                            if "NW LU" in first_line:
-                                                parts = first_line.split()
-                                                if len(parts) >= 3:
-                                                    rec_item["mes"] = parts[2]
-                                        except:
-                                            pass
+                                        mes_cab = parse_roteiro(r_row['roteiro_gerado'] or "").cabecalho.mes
+                                        if mes_cab:
+                                            rec_item["mes"] = mes_cab
                                         if 'roteiros' not in st.session_state:
                                             st.session_state['roteiros'] = []
                                         
@@ -1817,12 +1793,9 @@ if page == "Criar Roteiros":
         
         if idx < len(st.session_state['roteiros']):
             item = st.session_state['roteiros'][idx]
-            ficha_raw = item.get('ficha', '')
-            ficha_str = ficha_raw.get('text', str(ficha_raw)) if isinstance(ficha_raw, dict) else str(ficha_raw)
-            linhas_ficha = ficha_str.split('\n')
-            titulo_curto = linhas_ficha[0][:60] if linhas_ficha and len(linhas_ficha[0]) > 2 else f"Produto {idx+1}"
-            cat_id_roteiro = item.get("categoria_id", cat_selecionada_id)
             codigo_produto = item.get("codigo", "")
+            titulo_curto = sheet_de(item.get('ficha', ''), codigo_produto).titulo[:60] or f"Produto {idx+1}"
+            cat_id_roteiro = item.get("categoria_id", cat_selecionada_id)
             
             custo = item.get('custo_brl', 0)
             tag_custo = "⚡ Gratuito" if custo == 0 else f"💲 R$ {custo:.4f}"
@@ -2273,6 +2246,7 @@ elif page == "Treinar IA":
                         if t_sku.strip():
                             data_ouro["codigo_produto"] = t_sku.strip()
                         sp_client.table(f"{st.session_state.get('table_prefix', 'nw_')}roteiros_ouro").insert(data_ouro).execute()
+                        invalidar_contexto()
                         st.success(f"Roteiro Ouro '{t_prod}' cadastrado!")
                         st.rerun()
                     else:
@@ -2311,7 +2285,9 @@ elif page == "Treinar IA":
                     
                     col_prod_ld, col_cw_ld = st.columns(2)
                     with col_prod_ld:
-                        jsonld_product = export_jsonld_string(roteiro_sel, cat_name, "Product")
+                        jsonld_product = export_jsonld_string(
+                            roteiro_sel, cat_name, "Product", sheet=ficha_cacheada(roteiro_sel.get('codigo_produto') or "")
+                        )
                         st.download_button(
                             "📦 Baixar JSON-LD (Product)",
                             data=jsonld_product,
@@ -2536,32 +2512,28 @@ elif page == "Histórico":
         st.warning("Conecte o Supabase no painel lateral para visualizar o histórico.")
     else:
         sp_client = st.session_state['supabase_client']
+        tabela_hist = f"{st.session_state.get('table_prefix', 'nw_')}historico_roteiros"
         try:
             with st.spinner("Carregando histórico..."):
-                res_hist = sp_client.table(f"{st.session_state.get('table_prefix', 'nw_')}historico_roteiros").select("*").order('criado_em', desc=True).execute()
-                
-            if res_hist.data:
-                df_hist = pd.DataFrame(res_hist.data)
+                # Resumo agregado no banco (uma linha por modo/modelo), cacheado: métricas e opções dos filtros
+                resumo_hist = resumo_historico(sp_client, tabela_hist)
+                df_resumo = pd.DataFrame(resumo_hist["grupos"], columns=['modo_trabalho', 'modelo_llm', 'registros', 'custo'])
                 
-                if not df_hist.empty and 'criado_em' in df_hist.columns:
-                    df_hist['criado_em'] = df_hist['criado_em'].apply(convert_to_sp_time)
-                
-                total_registros = len(df_hist)
+            if not df_resumo.empty:
+                total_registros = resumo_hist["total"]
                 
                 # --- MÉTRICAS DE CUSTO ---
-                custo_total = CUSTO_LEGADO_BRL
-                custo_medio = 0.0
-                modelo_mais_usado = "-"
-                
-                if 'custo_estimado_brl' in df_hist.columns:
-                    custo_total += df_hist['custo_estimado_brl'].sum() or 0.0
-                    custo_medio = custo_total / total_registros if total_registros > 0 else 0.0
-                    
-                if 'modelo_llm' in df_hist.columns:
-                    try:
-                        modelo_mais_usado = df_hist['modelo_llm'].mode().iloc[0] if not df_hist['modelo_llm'].dropna().empty else "-"
-                    except Exception:
-                        modelo_mais_usado = "-"
+                custo_total = CUSTO_LEGADO_BRL + (resumo_hist["custo"] or 0.0)
+                custo_medio = custo_total / total_registros if total_registros > 0 else 0.0
+                if resumo_hist.get("parcial"):
+                    # Custo só da janela recente: a média também sai dela
+                    registros_janela = int(df_resumo['registros'].sum())
+                    custo_medio = resumo_hist["custo"] / registros_janela if registros_janela else 0.0
+                try:
+                    por_modelo = df_resumo.dropna(subset=['modelo_llm']).groupby('modelo_llm')['registros'].sum()
+                    modelo_mais_usado = por_modelo.idxmax() if not por_modelo.empty else "-"
+                except Exception:
+                    modelo_mais_usado = "-"
                 
                 col_m1, col_m2, col_m3, col_m4 = st.columns(4)
                 with col_m1:
@@ -2575,68 +2547,91 @@ elif page == "Histórico":
                 with col_m4:
                     st.markdown(f'<div class="metric-card-premium"><div class="metric-label">🧠 Modelo Mais Usado</div><div class="metric-value">{modelo_mais_usado}</div></div>', unsafe_allow_html=True)
                 
+                if resumo_hist.get("parcial"):
+                    st.caption(f"ℹ️ Custo e modelo mais usado calculados sobre os {HISTORICO_RESUMO_JANELA} roteiros mais recentes (aplique migration_historico_resumo_v1.sql para o resumo completo).")
+                
                 st.divider()
                 
-                # --- BARRA DE FILTROS ---
+                # --- BARRA DE FILTROS (aplicados no banco) ---
                 col_search, col_modo, col_modelo = st.columns([3, 1, 1])
                 with col_search:
                     search = st.text_input("🔍 Filtrar por código ou palavra-chave:", placeholder="Ex: 240304700, Geladeira", label_visibility="collapsed")
                 with col_modo:
-                    modos_unicos = ["Todos"] + sorted(df_hist['modo_trabalho'].dropna().unique().tolist()) if 'modo_trabalho' in df_hist.columns else ["Todos"]
+                    modos_unicos = ["Todos"] + sorted(df_resumo['modo_trabalho'].dropna().unique().tolist())
                     modo_filtro = st.selectbox("Modo", modos_unicos, label_visibility="collapsed")
                 with col_modelo:
-                    if 'modelo_llm' in df_hist.columns:
-                        modelos_unicos = ["Todos"] + sorted(df_hist['modelo_llm'].dropna().unique().tolist())
-                    else:
-                        modelos_unicos = ["Todos"]
+                    modelos_unicos = ["Todos"] + sorted(df_resumo['modelo_llm'].dropna().unique().tolist())
                     modelo_filtro = st.selectbox("Modelo", modelos_unicos, label_visibility="collapsed")
                 
-                # Filtro por texto (múltiplos termos com OR)
-                if search:
-                    import re
-                    termos = [t.strip() for t in re.split(r'[,\s]+', search) if t.strip()]
-                    if termos:
-                        mask = pd.Series(False, index=df_hist.index)
-                        for termo in termos:
-                            mask = mask | (
-                                df_hist['codigo_produto'].str.contains(termo, case=False, na=False) |
-                                df_hist['roteiro_gerado'].str.contains(termo, case=False, na=False)
-                            )
-                        df_hist = df_hist[mask]
-                
-                # Filtro por Modo de Trabalho
-                if modo_filtro != "Todos" and 'modo_trabalho' in df_hist.columns:
-                    df_hist = df_hist[df_hist['modo_trabalho'] == modo_filtro]
+                # Paginação por keyset: pilha de cursores das páginas visitadas, zerada quando os filtros mudam
+                filtros_hist = (tabela_hist, search, modo_filtro, modelo_filtro)
+                if st.session_state.get('hist_filtros') != filtros_hist:
+                    st.session_state['hist_filtros'] = filtros_hist
+                    st.session_state['hist_cursores'] = [None]
+                cursores = st.session_state['hist_cursores']
                 
-                # Filtro por Modelo LLM
-                if modelo_filtro != "Todos" and 'modelo_llm' in df_hist.columns:
-                    df_hist = df_hist[df_hist['modelo_llm'] == modelo_filtro]
+                linhas_hist, proximo_cursor = buscar_pagina_historico(
+                    sp_client, tabela_hist, cursor=cursores[-1], busca=search,
+                    modo=None if modo_filtro == "Todos" else modo_filtro,
+                    modelo=None if modelo_filtro == "Todos" else modelo_filtro
+                )
                 
-                # Formata custo para exibição
-                if 'custo_estimado_brl' in df_hist.columns:
+                if not linhas_hist:
+                    st.info("Nenhum roteiro encontrado com esses filtros.")
+                else:
+                    df_hist = pd.DataFrame(linhas_hist)
+                    ids_pagina = df_hist['id'].tolist()
+                    df_hist['criado_em'] = df_hist['criado_em'].apply(convert_to_sp_time)
+                    
+                    # Formata custo para exibição
                     df_hist['custo_brl'] = df_hist['custo_estimado_brl'].apply(
                         lambda x: f"R$ {x:,.4f}".replace(',', 'X').replace('.', ',').replace('X', '.') if pd.notna(x) and x > 0 else "-"
                     )
-                else:
-                    df_hist['custo_brl'] = "-"
-                
-                # Define o index da tabela para usar a lógica inversa (mais recentes com nº maior)
-                df_hist.reset_index(drop=True, inplace=True)
-                total_linhas = len(df_hist)
-                df_hist.index = [f"#{total_linhas - i:03d}" for i in range(total_linhas)]
-                
-                # Colunas a exibir
-                cols_display = ['criado_em', 'codigo_produto', 'modo_trabalho']
-                if 'modelo_llm' in df_hist.columns:
-                    cols_display.append('modelo_llm')
-                cols_display.append('custo_brl')
-                cols_display.append('roteiro_gerado')
-
-                st.dataframe(
-                    df_hist[cols_display], 
-                    use_container_width=True,
-                    height=600
-                )
+                    
+                    # Numeração inversa (mais recentes com nº maior); com busca por texto o total filtrado não é conhecido
+                    inicio_pagina = (len(cursores) - 1) * HISTORICO_PAGINA
+                    if not search:
+                        mask_resumo = pd.Series(True, index=df_resumo.index)
+                        if modo_filtro != "Todos":
+                            mask_resumo &= df_resumo['modo_trabalho'] == modo_filtro
+                        if modelo_filtro != "Todos":
+                            mask_resumo &= df_resumo['modelo_llm'] == modelo_filtro
+                        total_filtrado = int(mask_resumo.sum())
+                        df_hist.index = [f"#{total_filtrado - inicio_pagina - i:03d}" for i in range(len(df_hist))]
+                    else:
+                        df_hist.index = [f"{inicio_pagina + i + 1}º" for i in range(len(df_hist))]
+                    
+                    cols_display = ['criado_em', 'codigo_produto', 'modo_trabalho', 'modelo_llm', 'custo_brl']
+                    selecao = st.dataframe(
+                        df_hist[cols_display], 
+                        use_container_width=True,
+                        height=600,
+                        on_select="rerun",
+                        selection_mode="single-row",
+                        key=f"grade_hist_{len(cursores)}"
+                    )
+                    
+                    col_pag1, col_pag2, col_pag3 = st.columns([1, 2, 1])
+                    with col_pag1:
+                        if st.button("⬅️ Mais recentes", use_container_width=True, disabled=len(cursores) == 1):
+                            cursores.pop()
+                            st.rerun()
+                    with col_pag2:
+                        st.caption(f"Página {len(cursores)} · {len(df_hist)} roteiro(s) · selecione uma linha para abrir o roteiro completo")
+                    with col_pag3:
+                        if st.button("Mais antigos ➡️", use_container_width=True, disabled=proximo_cursor is None):
+                            cursores.append(proximo_cursor)
+                            st.rerun()
+                    
+                    # Textos grandes só da linha aberta
+                    linhas_sel = selecao.selection.rows if selecao else []
+                    if linhas_sel:
+                        detalhe = buscar_detalhe_historico(sp_client, tabela_hist, ids_pagina[linhas_sel[0]])
+                        if detalhe:
+                            st.markdown(f"#### 📄 {detalhe.get('codigo_produto') or 'Roteiro'} · {convert_to_sp_time(detalhe.get('criado_em'))}")
+                            st.text_area("Roteiro gerado", detalhe.get('roteiro_gerado') or "", height=400)
+                            with st.expander("📋 Ficha extraída"):
+                                st.text(detalhe.get('ficha_extraida') or "—")
             else:
                 st.info("Nenhum roteiro gerado ainda. Vá em 'Criar Roteiros' para começar!")
         except Exception as e:
@@ -0,0 +1,208 @@
+"""
+API assíncrona do RoteiristaAgent (google-genai `client.aio` e AsyncOpenAI).
+Permite que um único event loop (worker headless, script de lote) conduza dezenas de gerações
+e scrapings simultâneos sem uma thread por chamada. Prompt, pós-processamento, cache e
+contabilidade de custo são os mesmos métodos do agente síncrono, então os resultados coincidem.
+
+Uso:
+    agent = RoteiristaAgent(sp_client, model_id="gemini-3-flash-preview")
+    resultados = await asyncio.gather(*(agent.aio.gerar_roteiro(f, codigo=c) for c, f in fichas))
+"""
+import asyncio
+import time
+import weakref
+
+from google.genai import types
+
+from src.agent import calibracao_cache, _hash_conteudo
+from src.batch import limite_concorrencia
+from src.budget import estimar_tokens
+from src.clients import get_async_openai_client
+from src.hedging import latencias
+from src.router import router, Rota, TodasRotasFalharam
+from src.scraper import scrape_with_gemini_async
+
+# event loop -> {provedor: asyncio.Semaphore} (semáforos asyncio pertencem a um único loop)
+_limites = weakref.WeakKeyDictionary()
+
+
+def _limite(provedor: str) -> asyncio.Semaphore:
+    """Semáforo do provedor no loop atual, com o mesmo limite do motor de lote (CONCORRENCIA_<PROVEDOR>)."""
+    por_provedor = _limites.setdefault(asyncio.get_running_loop(), {})
+    if provedor not in por_provedor:
+        por_provedor[provedor] = asyncio.Semaphore(limite_concorrencia(provedor))
+    return por_provedor[provedor]
+
+
+class AsyncRoteiristaAgent:
+    """Contraparte assíncrona de um RoteiristaAgent (mesmo modelo, contexto e caches)."""
+
+    def __init__(self, agent):
+        self.agent = agent
+
+    @property
+    def model_id(self):
+        return self.agent.model_id
+
+    def _openai(self):
+        cliente = self.agent.client_openai
+        return get_async_openai_client(cliente.api_key, str(cliente.base_url))
+
+    async def _gerar_gemini(self, prefixo, sufixo, images_list, codigo=None):
+        """generate_content assíncrono com o prefixo cacheado; se o cache falhar, reenvia inline."""
+        agent = self.agent
+        cached_name = await asyncio.to_thread(agent._prefixo_cacheado, prefixo)
+        imagens = agent._imagens_gemini(images_list)
+
+        async def _chamar(nome_cache):
+            return await agent.client_gemini.aio.models.generate_content(
+                model=agent.model_id,
+                contents=[sufixo if nome_cache else prefixo + sufixo] + imagens,
+                config=agent._config_geracao(nome_cache)
+            )
+
+        if not cached_name:
+            return await _chamar(None)
+        try:
+            return await _chamar(cached_name)
+        except Exception as e:
+            print(f"[PROMPT CACHE] Falha usando {cached_name}: {e}. Reenviando inline.")
+            agent.prefix_cache.descartar(agent._conta_gemini, agent.model_id, prefixo)
+            return await _chamar(None)
+
+    async def scrape(self, code_or_url: str, api_key: str | None = None, force_refresh: bool = False) -> dict:
+        """Ficha do produto via scraper assíncrono (limitado pela concorrência do scraper)."""
+        async with _limite("scraper"):
+            return await scrape_with_gemini_async(code_or_url, api_key=api_key, force_refresh=force_refresh)
+
+    async def gerar_roteiro(self, scraped_data, modo_trabalho="NW (NewWeb)", mes="MAR", data_roteiro=None, codigo=None, nome_produto=None, sub_skus=None, video_url=None, com_lu=True, **kwargs):
+        """Mesmo contrato e resultado de RoteiristaAgent.gerar_roteiro."""
+        agent = self.agent
+        # A montagem consulta o Supabase na primeira vez (cliente síncrono): fora do loop
+        prefixo, sufixo, images_list = await asyncio.to_thread(
+            agent._montar_prompt, scraped_data, modo_trabalho, mes, data_roteiro, codigo, sub_skus, video_url, com_lu,
+            nome_produto=nome_produto, **kwargs
+        )
+
+        final_prompt = prefixo + sufixo
+        inicio = time.monotonic()
+
+        secundario = agent._agente_hedge()
+        if secundario is None:
+            roteiro, uso = await self._chamar_modelo(prefixo, sufixo, images_list, codigo)
+            latencias.registrar("geracao", agent.rota, time.monotonic() - inicio)
+            return await asyncio.to_thread(
+                agent._concluir_roteiro, roteiro, uso, final_prompt, inicio, scraped_data,
+                modo_trabalho, mes, data_roteiro, codigo, sub_skus, video_url, com_lu
+            )
+
+        # Hedge com cancelamento real: a chamada perdedora é cancelada assim que a outra responde
+        agentes = {agent.rota: self, secundario.rota: secundario.aio}
+        descartadas = []
+        (roteiro, uso), rota = await router.executar_async(
+            "geracao",
+            [Rota(nome, lambda a=a: a._chamar_modelo(prefixo, sufixo, images_list, codigo), a.model_id) for nome, a in agentes.items()],
+            hedge=True, ordenar=False, ao_descartar=descartadas.append, fallback=False
+        )
+        resultado = await asyncio.to_thread(
+            agentes[rota.nome].agent._concluir_roteiro, roteiro, uso, final_prompt, inicio, scraped_data,
+            modo_trabalho, mes, data_roteiro, codigo, sub_skus, video_url, com_lu
+        )
+        return agent._somar_hedge(resultado, [agentes[r.nome].agent for r in descartadas], final_prompt)
+
+    async def _chamar_modelo(self, prefixo, sufixo, images_list, codigo=None):
+        """Uma chamada de geração neste modelo (limitada pela concorrência do provedor): (texto, UsoTokens ou None)."""
+        agent = self.agent
+        async with _limite(agent.provider):
+            if agent.client_gemini:
+                response = await self._gerar_gemini(prefixo, sufixo, images_list, codigo=codigo)
+                return agent._texto_resposta_gemini(response), agent._uso_resposta_gemini(response)
+            if agent.client_openai:
+                response = await self._openai().chat.completions.create(
+                    model=agent.model_id,
+                    messages=agent._mensagens(prefixo, sufixo),
+                    **agent._kwargs_timeout_openai()
+                )
+                return response.choices[0].message.content, agent._uso_resposta_openai(response)
+        raise Exception("Nenhum cliente LLM configurado válido.")
+
+    async def otimizar_roteiros(self, roteiros_textos: list, codigo: str, nome_produto: str, ficha_tecnica: str = None) -> dict:
+        """Mesmo contrato e resultado de RoteiristaAgent.otimizar_roteiros."""
+        agent = self.agent
+        sys_prompt, user_prompt = await asyncio.to_thread(
+            agent._montar_prompt_otimizacao, roteiros_textos, codigo, nome_produto, ficha_tecnica
+        )
+
+        async with _limite(agent.provider):
+            if agent.provider == "gemini":
+                response = await agent.client_gemini.aio.models.generate_content(
+                    model=agent.model_id,
+                    contents=[sys_prompt, user_prompt],
+                    config=types.GenerateContentConfig(temperature=0.7)
+                )
+                roteiro = response.text
+                if hasattr(response, 'usage_metadata'):
+                    tokens_in = response.usage_metadata.prompt_token_count
+                    tokens_out = response.usage_metadata.candidates_token_count
+                else:
+                    tokens_in = estimar_tokens(str([sys_prompt, user_prompt]), agent.model_id)
+                    tokens_out = estimar_tokens(roteiro, agent.model_id)
+            elif agent.client_openai:
+                response = await self._openai().chat.completions.create(
+                    model=agent.model_id,
+                    messages=agent._mensagens(sys_prompt, user_prompt)
+                )
+                roteiro = response.choices[0].message.content
+                tokens_in = response.usage.prompt_tokens if hasattr(response, 'usage') else 0
+                tokens_out = response.usage.completion_tokens if hasattr(response, 'usage') else 0
+            else:
+                raise Exception("Nenhum cliente LLM configurado válido.")
+
+        return agent._resultado_otimizacao(roteiro, tokens_in, tokens_out)
+
+    async def chat_with_context(self, user_query, chat_history=[], supabase_context=None):
+        """Mesmo contrato de RoteiristaAgent.chat_with_context (erros viram texto de resposta)."""
+        agent = self.agent
+        try:
+            if agent.provider == "gemini":
+                response = await agent.client_gemini.aio.models.generate_content(
+                    model=agent.model_id,
+                    contents=agent._prompt_chat_gemini(user_query, chat_history, supabase_context),
+                    config=types.GenerateContentConfig(temperature=0.5)
+                )
+                return response.text
+            elif agent.provider in ["openai", "puter", "openrouter", "zai", "kimi"]:
+                response = await self._openai().chat.completions.create(
+                    model=agent.model_id,
+                    messages=agent._mensagens_chat(user_query, chat_history, supabase_context),
+                    temperature=0.7
+                )
+                return response.choices[0].message.content
+            else:
+                return "Provedor LLM não reconhecido para Chat."
+        except Exception as e:
+            return f"Desculpe, tive um problema técnico ao conectar com a IA ({agent.model_id}): {e}"
+
+    async def analisar_calibracao(self, original, final, categories_list=[], codigo_original=""):
+        """Mesmo contrato, rotas, cache e resultado de RoteiristaAgent.analisar_calibracao."""
+        agent = self.agent
+        sys_prompt, user_prompt, fallback_id = agent._prompts_calibracao(original, final, categories_list, codigo_original)
+
+        chave_cache = "analise:" + _hash_conteudo(sys_prompt, user_prompt)
+        cached = calibracao_cache.get(chave_cache)
+        if cached is not None:
+            print(f"[OK] Calibragem reaproveitada do cache ({cached.get('modelo_calibragem')})")
+            return cached
+
+        rotas = agent._rotas_calibracao(sys_prompt, user_prompt, assincrono=True)
+
+        try:
+            res, rota = await router.executar_async("calibragem", rotas)
+            print(f"[OK] Calibragem realizada via {rota.rotulo}")
+            resultado = agent._process_calib_res(res, fallback_id, categories_list, codigo_original, rota.rotulo)
+            calibracao_cache.set(chave_cache, resultado)
+            return resultado
+        except TodasRotasFalharam as e:
+            print(f"[ERROR] Calibragem: {e}")
+
+        return agent._falha_calibracao(fallback_id, codigo_original)
@@ -0,0 +1,150 @@
+"""
+Motor de lote concorrente para o fluxo "Iniciar Extração e Geração".
+Encadeia scraping → geração por SKU em um pool de workers limitado, respeitando
+limites de concorrência por provedor, e devolve eventos por SKU conforme terminam.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+
+from src.scraper import scrape_with_gemini
+from src.budget import registrar_duracao_scrape
+
+load_dotenv()
+
+# Limite de SKUs por lote na interface (antes fixo em 15)
+MAX_CODIGOS_LOTE = int(os.environ.get("MAX_CODIGOS_LOTE", "200"))
+# Workers simultâneos do lote (cada worker leva um SKU do scraping até a geração)
+MAX_WORKERS_LOTE = int(os.environ.get("MAX_WORKERS_LOTE", "8"))
+
+# Requisições simultâneas permitidas por provedor (gerações) e para o scraper (Google Search Grounding)
+PROVIDER_CONCURRENCY = {
+    "scraper": 4,
+    "gemini": 4,
+    "openai": 4,
+    "puter": 2,
+    "openrouter": 2,
+    "kimi": 2,
+    "zai": 1,  # GLM-4.5 é lento e estoura rate limit com facilidade
+}
+
+_semaforos = {}
+_semaforos_lock = threading.Lock()
+
+
+def limite_concorrencia(provedor: str) -> int:
+    """Requisições simultâneas permitidas para o provedor (CONCORRENCIA_<PROVEDOR> sobrescreve)."""
+    return max(1, int(os.environ.get(f"CONCORRENCIA_{provedor.upper()}", PROVIDER_CONCURRENCY.get(provedor, 2))))
+
+
+def _semaforo(provedor: str) -> threading.BoundedSemaphore:
+    """Semáforo de processo por provedor (compartilhado entre sessões do Streamlit)."""
+    with _semaforos_lock:
+        if provedor not in _semaforos:
+            _semaforos[provedor] = threading.BoundedSemaphore(limite_concorrencia(provedor))
+        return _semaforos[provedor]
+
+
+def paralelismo_efetivo(provedor: str, max_workers: int = MAX_WORKERS_LOTE) -> int:
+    """Quantos SKUs do lote andam ao mesmo tempo na prática (workers limitados pelo semáforo do provedor)."""
+    return max(1, min(max_workers, limite_concorrencia(provedor)))
+
+
+@dataclass
+class ItemLote:
+    """Um SKU do lote com seus dados extras da tabela de pré-geração."""
+    codigo: str
+    sub_skus: str = ""
+    video_url: str = ""
+    extras: dict = field(default_factory=dict)
+
+
+@dataclass
+class EventoLote:
+    """
+    Evento emitido pelo motor. tipo='etapa' informa progresso; tipo='concluido' traz
+    a ficha e o resultado da geração (ou o erro).
+    """
+    indice: int
+    item: ItemLote
+    tipo: str
+    mensagem: str = ""
+    ficha: dict | None = None
+    resultado: dict | None = None
+    erro: str | None = None
+
+
+class MotorLote:
+    """Executa scraping e geração de vários SKUs em paralelo com o mesmo RoteiristaAgent."""
+
+    def __init__(self, agent, api_key: str | None = None, max_workers: int = MAX_WORKERS_LOTE, scraper=scrape_with_gemini, force_refresh: bool = False):
+        self.agent = agent
+        self.api_key = api_key
+        self.force_refresh = force_refresh
+        self.max_workers = max(1, max_workers)
+        self.scraper = scraper
+
+    def _processar(self, indice: int, item: ItemLote, gen_kwargs: dict, eventos: queue.Queue):
+        try:
+            eventos.put(EventoLote(indice, item, "etapa", "🔍 **Etapa 1:** Extraindo dados técnicos Magalu (Scraping)..."))
+            with _semaforo("scraper"):
+                inicio = time.monotonic()
+                ficha = self.scraper(item.codigo, api_key=self.api_key, force_refresh=self.force_refresh)
+                registrar_duracao_scrape(time.monotonic() - inicio)
+
+            eventos.put(EventoLote(indice, item, "etapa", "🧠 **Etapa 2:** Consultando IA e aplicando aprendizados (Agent)..."))
+            with _semaforo(self.agent.provider):
+                resultado = self.agent.gerar_roteiro(
+                    scraped_data=ficha,
+                    codigo=item.codigo,
+                    sub_skus=item.sub_skus,
+                    video_url=item.video_url,
+                    **gen_kwargs,
+                    **item.extras
+                )
+            eventos.put(EventoLote(indice, item, "concluido", ficha=ficha, resultado=resultado))
+        except Exception as e:
+            eventos.put(EventoLote(indice, item, "concluido", erro=str(e)))
+
+    def executar(self, itens: list, **gen_kwargs):
+        """
+        Processa o lote e gera EventoLote conforme cada SKU avança/termina (ordem de conclusão).
+        Deve ser consumido na thread principal — é lá que a UI é atualizada.
+        """
+        if not itens:
+            return
+
+        # Aquece o cache de contexto uma vez antes do fan-out (evita N buscas simultâneas no Supabase)
+        try:
+            self.agent._build_context(gen_kwargs.get("modo_trabalho", ""))
+        except Exception as e:
+            print(f"[LOTE] Falha ao pré-carregar contexto: {e}")
+
+        eventos = queue.Queue()
+        pendentes = len(itens)
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(itens)), thread_name_prefix="lote") as pool:
+            for indice, item in enumerate(itens):
+                pool.submit(self._processar, indice, item, gen_kwargs, eventos)
+            while pendentes:
+                evento = eventos.get()
+                if evento.tipo == "concluido":
+                    pendentes -= 1
+                yield evento
+
+    def extrair(self, itens: list) -> list:
+        """Só a etapa de scraping, em paralelo. Retorna as fichas na ordem dos itens (usado pelo modo lote offline)."""
+        def _extrair(item):
+            try:
+                with _semaforo("scraper"):
+                    return self.scraper(item.codigo, api_key=self.api_key, force_refresh=self.force_refresh)
+            except Exception as e:
+                return {"text": f"❌ Erro Crítico no Scraper: {e}", "images": []}
+
+        if not itens:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(itens)), thread_name_prefix="lote") as pool:
+            return list(pool.map(_extrair, itens))
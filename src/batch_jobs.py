@@ -0,0 +1,385 @@
+"""
+Modo lote offline (batch jobs) para rodadas grandes de catálogo.
+Monta os prompts de todos os SKUs, envia como um único job assíncrono ao provedor
+(Gemini Batch API / OpenAI Batch API, ~50% mais baratos), consulta o andamento e, ao
+concluir, hidrata os roteiros no histórico e na Mesa de Trabalho (exportação DOCX).
+O provedor local baseado em arquivos permite exercitar todo o caminho sem rede.
+"""
+import os
+import io
+import json
+import uuid
+import glob
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from dotenv import load_dotenv
+
+from src.cache import CACHE_DIR
+from src.history_logger import registrar_historico
+from src.product_sheet import sheet_de
+
+load_dotenv()
+
+# Metadados dos jobs (um JSON por job) e arquivos do provedor local
+LOTES_DIR = os.environ.get("LOTES_DIR") or os.path.join(CACHE_DIR, "lotes")
+# Desconto das APIs de batch sobre o preço interativo
+BATCH_DESCONTO = 0.5
+# "local" força o provedor de arquivos (testes/desenvolvimento)
+LOTE_PROVEDOR = os.environ.get("LOTE_PROVEDOR", "").lower()
+
+
+@dataclass
+class TrabalhoLote:
+    """Job enviado: o suficiente para consultar o provedor e reconstruir cada roteiro ao final."""
+    id: str
+    provedor: str
+    model_id: str
+    job_ref: str
+    itens: list
+    parametros: dict = field(default_factory=dict)
+    status: str = "processando"
+    criado_em: str = ""
+    hidratado: bool = False
+
+    def salvar(self):
+        os.makedirs(LOTES_DIR, exist_ok=True)
+        with open(os.path.join(LOTES_DIR, f"{self.id}.json"), "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f, ensure_ascii=False)
+
+    @classmethod
+    def carregar(cls, trabalho_id: str) -> "TrabalhoLote":
+        with open(os.path.join(LOTES_DIR, f"{trabalho_id}.json"), "r", encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+
+def listar_trabalhos(incluir_hidratados: bool = False) -> list:
+    """Jobs salvos localmente, do mais recente para o mais antigo."""
+    trabalhos = []
+    for path in glob.glob(os.path.join(LOTES_DIR, "*.json")):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                trabalho = TrabalhoLote(**json.load(f))
+        except (OSError, ValueError, TypeError) as e:
+            print(f"[LOTE JOB] Ignorando metadados inválidos {path}: {e}")
+            continue
+        if incluir_hidratados or not trabalho.hidratado:
+            trabalhos.append(trabalho)
+    return sorted(trabalhos, key=lambda t: t.criado_em, reverse=True)
+
+
+class GeminiBatchProvider:
+    """Gemini Batch API com requisições inline (respostas voltam na mesma ordem)."""
+    nome = "gemini"
+
+    def __init__(self, client):
+        self.client = client
+
+    def submeter(self, trabalho_id: str, model_id: str, requisicoes: list) -> str:
+        src = [
+            {"contents": [{"role": "user", "parts": [{"text": r["prompt"]}]}], "config": {"temperature": 0.7}}
+            for r in requisicoes
+        ]
+        job = self.client.batches.create(model=model_id, src=src, config={"display_name": f"roteiros-{trabalho_id}"})
+        return job.name
+
+    def consultar(self, job_ref: str) -> str:
+        estado = self.client.batches.get(name=job_ref).state.name
+        if estado in ("JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED"):
+            return "concluido"
+        if estado in ("JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"):
+            return "falhou"
+        return "processando"
+
+    def resultados(self, job_ref: str, custom_ids: list) -> dict:
+        job = self.client.batches.get(name=job_ref)
+        saida = {}
+        respostas = (job.dest.inlined_responses if job.dest else None) or []
+        for custom_id, resp in zip(custom_ids, respostas):
+            if resp.error or not resp.response:
+                saida[custom_id] = {"erro": str(resp.error or "Resposta vazia")}
+                continue
+            uso = resp.response.usage_metadata
+            saida[custom_id] = {
+                "texto": resp.response.text or "",
+                "tokens_in": (uso.prompt_token_count or 0) if uso else 0,
+                "tokens_out": (uso.candidates_token_count or 0) if uso else 0,
+            }
+        return saida
+
+
+class OpenAIBatchProvider:
+    """OpenAI Batch API: JSONL de /v1/chat/completions enviado como arquivo."""
+    nome = "openai"
+
+    def __init__(self, client):
+        self.client = client
+
+    def submeter(self, trabalho_id: str, model_id: str, requisicoes: list) -> str:
+        linhas = [
+            json.dumps({
+                "custom_id": r["custom_id"],
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": model_id,
+                    "messages": [
+                        {"role": "system", "content": r["prefixo"]},
+                        {"role": "user", "content": r["sufixo"]}
+                    ]
+                }
+            }, ensure_ascii=False)
+            for r in requisicoes
+        ]
+        arquivo = self.client.files.create(
+            file=(f"roteiros-{trabalho_id}.jsonl", io.BytesIO("\n".join(linhas).encode("utf-8"))),
+            purpose="batch"
+        )
+        job = self.client.batches.create(
+            input_file_id=arquivo.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"trabalho": trabalho_id}
+        )
+        return job.id
+
+    def consultar(self, job_ref: str) -> str:
+        status = self.client.batches.retrieve(job_ref).status
+        if status == "completed":
+            return "concluido"
+        if status in ("failed", "expired", "cancelled"):
+            return "falhou"
+        return "processando"
+
+    def resultados(self, job_ref: str, custom_ids: list) -> dict:
+        job = self.client.batches.retrieve(job_ref)
+        saida = {}
+        if job.output_file_id:
+            for linha in self.client.files.content(job.output_file_id).text.splitlines():
+                if not linha.strip():
+                    continue
+                item = json.loads(linha)
+                body = (item.get("response") or {}).get("body") or {}
+                if item.get("error") or not body.get("choices"):
+                    saida[item["custom_id"]] = {"erro": str(item.get("error") or body.get("error") or "Resposta vazia")}
+                    continue
+                uso = body.get("usage") or {}
+                saida[item["custom_id"]] = {
+                    "texto": body["choices"][0]["message"]["content"] or "",
+                    "tokens_in": uso.get("prompt_tokens", 0),
+                    "tokens_out": uso.get("completion_tokens", 0),
+                }
+        return saida
+
+
+def _responder_local(requisicao: dict) -> str:
+    """Resposta determinística do provedor local: um roteiro mínimo no formato NW."""
+    return (
+        "Cliente: Magalu\n"
+        "Roteirista: -\n"
+        f"Produto: NW XXX 000000000 Roteiro offline {requisicao['custom_id']}\n"
+        "______________________________________________________________________\n"
+        "- Roteiro gerado pelo provedor local de lote (sem LLM)."
+    )
+
+
+class LocalBatchProvider:
+    """
+    Provedor baseado em arquivos: grava requests.jsonl em LOTES_DIR/<job>/ e considera o job
+    concluído quando existe results.jsonl ({custom_id, texto, tokens_in, tokens_out} por linha).
+    Com `responder`, os resultados são produzidos na hora (simula o provedor sem rede).
+    """
+    nome = "local"
+
+    def __init__(self, diretorio: str | None = None, responder=_responder_local):
+        self.diretorio = diretorio or LOTES_DIR
+        self.responder = responder
+
+    def submeter(self, trabalho_id: str, model_id: str, requisicoes: list) -> str:
+        pasta = os.path.join(self.diretorio, trabalho_id)
+        os.makedirs(pasta, exist_ok=True)
+        with open(os.path.join(pasta, "requests.jsonl"), "w", encoding="utf-8") as f:
+            for r in requisicoes:
+                f.write(json.dumps({"custom_id": r["custom_id"], "model": model_id, "prompt": r["prompt"]}, ensure_ascii=False) + "\n")
+        if self.responder:
+            with open(os.path.join(pasta, "results.jsonl"), "w", encoding="utf-8") as f:
+                for r in requisicoes:
+                    texto = self.responder(r)
+                    f.write(json.dumps({
+                        "custom_id": r["custom_id"],
+                        "texto": texto,
+                        "tokens_in": len(r["prompt"]) // 4,
+                        "tokens_out": len(texto) // 4
+                    }, ensure_ascii=False) + "\n")
+        return pasta
+
+    def consultar(self, job_ref: str) -> str:
+        return "concluido" if os.path.exists(os.path.join(job_ref, "results.jsonl")) else "processando"
+
+    def resultados(self, job_ref: str, custom_ids: list) -> dict:
+        saida = {}
+        with open(os.path.join(job_ref, "results.jsonl"), "r", encoding="utf-8") as f:
+            for linha in f:
+                if linha.strip():
+                    item = json.loads(linha)
+                    saida[item["custom_id"]] = item
+        return saida
+
+
+def provedor_para(agent, provedor: str | None = None):
+    """Escolhe o provedor de lote compatível com o agente (ou o informado/forçado por LOTE_PROVEDOR)."""
+    provedor = provedor or LOTE_PROVEDOR or agent.provider
+    if provedor == "local":
+        return LocalBatchProvider()
+    if provedor == "gemini" and agent.client_gemini:
+        return GeminiBatchProvider(agent.client_gemini)
+    if provedor == "openai" and agent.client_openai:
+        return OpenAIBatchProvider(agent.client_openai)
+    raise ValueError(f"Modo lote não disponível para o provedor '{provedor}'. Use um modelo Gemini ou OpenAI.")
+
+
+def submeter_trabalho(agent, itens: list, fichas: list, provedor=None, **gen_kwargs) -> TrabalhoLote:
+    """
+    Monta o prompt de cada SKU (mesmo prefixo/sufixo do modo interativo) e envia tudo como um job.
+    `itens` são ItemLote e `fichas` os resultados do scraper na mesma ordem.
+    """
+    provedor = provedor if hasattr(provedor, "submeter") else provedor_para(agent, provedor)
+    trabalho_id = datetime.now().strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+    requisicoes, metadados = [], []
+    for i, (item, ficha) in enumerate(zip(itens, fichas)):
+        custom_id = f"{i:04d}-{item.codigo}"
+        prefixo, sufixo, _ = agent._montar_prompt(
+            ficha,
+            gen_kwargs.get("modo_trabalho", "NW (NewWeb)"),
+            gen_kwargs.get("mes", "MAR"),
+            gen_kwargs.get("data_roteiro"),
+            item.codigo,
+            item.sub_skus,
+            item.video_url,
+            gen_kwargs.get("com_lu", True),
+            categoria_id=gen_kwargs.get("categoria_id"),
+            **item.extras
+        )
+        requisicoes.append({"custom_id": custom_id, "prefixo": prefixo, "sufixo": sufixo, "prompt": prefixo + sufixo})
+        metadados.append({
+            "custom_id": custom_id,
+            "codigo": item.codigo,
+            "sub_skus": item.sub_skus,
+            "video_url": item.video_url,
+            # Imagens (bytes) não vão para o JSON do job
+            "ficha": {"text": ficha.get("text", ""), "images": []} if isinstance(ficha, dict) else {"text": str(ficha), "images": []},
+        })
+
+    job_ref = provedor.submeter(trabalho_id, agent.model_id, requisicoes)
+    trabalho = TrabalhoLote(
+        id=trabalho_id,
+        provedor=provedor.nome,
+        model_id=agent.model_ref,
+        job_ref=job_ref,
+        itens=metadados,
+        # O prefixo das tabelas é o do envio: a importação não depende do modo aberto na sessão
+        parametros=dict(
+            {k: gen_kwargs.get(k) for k in ("modo_trabalho", "mes", "data_roteiro", "com_lu", "categoria_id")},
+            table_prefix=agent.table_prefix
+        ),
+        criado_em=datetime.now().isoformat()
+    )
+    trabalho.salvar()
+    print(f"[LOTE JOB] {trabalho_id}: {len(requisicoes)} SKUs enviados via {provedor.nome} ({job_ref})")
+    return trabalho
+
+
+def coletar_trabalho(agent, trabalho: TrabalhoLote, provedor=None) -> list | None:
+    """
+    Consulta o job. Enquanto processa, retorna None. Concluído, retorna um resultado por SKU
+    (mesmo formato de gerar_roteiro, com cabeçalho corrigido e custo com desconto de batch, ou 'erro').
+    """
+    from src.agent import calcular_custo_brl
+
+    provedor = provedor if hasattr(provedor, "submeter") else provedor_para(agent, provedor or trabalho.provedor)
+    status = provedor.consultar(trabalho.job_ref)
+    if status != trabalho.status:
+        trabalho.status = status
+        trabalho.salvar()
+    if status == "falhou":
+        raise RuntimeError(f"O job {trabalho.job_ref} falhou no provedor {trabalho.provedor}.")
+    if status != "concluido":
+        return None
+
+    brutos = provedor.resultados(trabalho.job_ref, [m["custom_id"] for m in trabalho.itens])
+    p = trabalho.parametros
+    resultados = []
+    for meta in trabalho.itens:
+        bruto = brutos.get(meta["custom_id"]) or {"erro": "Sem resposta no job"}
+        if bruto.get("erro"):
+            resultados.append({"item": meta, "erro": bruto["erro"]})
+            continue
+        roteiro = agent._aplicar_cabecalho(
+            bruto["texto"], p.get("modo_trabalho") or "NW (NewWeb)", p.get("mes") or "MAR", p.get("data_roteiro"),
+            meta["codigo"], meta["sub_skus"], meta["video_url"], p.get("com_lu", True)
+        )
+        roteiro = agent._pos_processar_fonetica(roteiro, p.get("modo_trabalho") or "NW (NewWeb)")
+        tokens_in, tokens_out = bruto.get("tokens_in", 0), bruto.get("tokens_out", 0)
+        resultados.append({
+            "item": meta,
+            "roteiro": roteiro,
+            "model_id": f"{agent.model_id} (Lote)",
+            "tokens_in": tokens_in,
+            "tokens_out": tokens_out,
+            "custo_brl": round(calcular_custo_brl(agent.model_id, tokens_in, tokens_out) * BATCH_DESCONTO, 6)
+        })
+    return resultados
+
+
+def sucessos(resultados: list) -> int:
+    """Quantos SKUs do job voltaram com roteiro (os que recebem numeração global)."""
+    return sum(1 for r in resultados or [] if not r.get("erro"))
+
+
+def hidratar_trabalho(trabalho: TrabalhoLote, resultados: list, sp_client=None, table_prefix: str | None = None, global_inicial: int = 1, criado_em: str | None = None) -> list:
+    """
+    Grava os roteiros do job no histórico (um insert em massa) e devolve os cards da Mesa de Trabalho,
+    no formato usado pela exportação DOCX. Marca o job como hidratado.
+    Sem `table_prefix`, usa o prefixo salvo no job no momento do envio.
+    """
+    p = trabalho.parametros
+    table_prefix = table_prefix or p.get("table_prefix") or "nw_"
+    modo = p.get("modo_trabalho") or "NW (NewWeb)"
+    com_lu = p.get("com_lu", True)
+    cards, linhas_hist = [], []
+    for i, res in enumerate(r for r in resultados if not r.get("erro")):
+        meta = res["item"]
+        cards.append({
+            "_uid": str(uuid.uuid4()),
+            "ficha": meta["ficha"],
+            "roteiro_original": res["roteiro"],
+            "codigo": meta["codigo"],
+            "model_id": res["model_id"],
+            "tokens_in": res["tokens_in"],
+            "tokens_out": res["tokens_out"],
+            "custo_brl": res["custo_brl"],
+            "global_num": global_inicial + i,
+            "mes": p.get("mes") or "MAR",
+            "com_lu": "REVIEW" if "Review" in modo else com_lu
+        })
+        linha = {
+            "codigo_produto": meta["codigo"],
+            "modo_trabalho": modo,
+            "roteiro_gerado": res["roteiro"],
+            "ficha_extraida": sheet_de(meta["ficha"], meta["codigo"]).texto[:5000],
+            "modelo_llm": res["model_id"],
+            "tokens_entrada": res["tokens_in"],
+            "tokens_saida": res["tokens_out"],
+            "custo_estimado_brl": res["custo_brl"],
+            "categoria_id": p.get("categoria_id")
+        }
+        if criado_em:
+            linha["criado_em"] = criado_em
+        linhas_hist.append(linha)
+
+    if sp_client and linhas_hist:
+        registrar_historico(sp_client, f"{table_prefix}historico_roteiros", linhas_hist)
+
+    trabalho.hidratado = True
+    trabalho.salvar()
+    return cards
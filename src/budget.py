@@ -0,0 +1,177 @@
+"""
+Orçamento de tokens do prompt e previsão de custo/duração de lotes.
+- Mede cada seção do prompt (base, modo, conhecimento, referências, ficha) antes do envio e
+  poda as de menor prioridade quando o total passa do teto configurado.
+- Aprende, por modelo, a razão caracteres/token, o tamanho médio da resposta e a duração
+  média das gerações (a partir do usage_metadata real), usados na previsão antes do lote.
+"""
+import os
+import math
+import threading
+from dataclasses import dataclass
+from dotenv import load_dotenv
+
+from src.cache import PersistentCache
+
+load_dotenv()
+
+# Teto de tokens de entrada por roteiro (as seções podáveis são cortadas acima disso)
+PROMPT_TETO_TOKENS = int(os.environ.get("PROMPT_TETO_TOKENS", "32000"))
+CHARS_POR_TOKEN_PADRAO = 4.0
+# Valores iniciais até haver observações do modelo
+TOKENS_SAIDA_PADRAO = 900
+DURACAO_GERACAO_PADRAO_S = 25.0
+DURACAO_SCRAPE_PADRAO_S = 20.0
+CHARS_FICHA_PADRAO = 3000
+# Peso da observação mais recente nas médias móveis
+ALPHA = 0.2
+
+_estatisticas = PersistentCache("budget", 90 * 24 * 3600)
+_lock = threading.Lock()
+_memoria = {}
+
+
+def _stats(chave: str) -> dict:
+    with _lock:
+        if chave not in _memoria:
+            _memoria[chave] = _estatisticas.get(chave) or {}
+        return dict(_memoria[chave])
+
+
+def _atualizar(chave: str, valores: dict):
+    """Atualiza as médias móveis da chave e persiste."""
+    with _lock:
+        atual = _memoria.get(chave)
+        if atual is None:
+            atual = _estatisticas.get(chave) or {}
+        for campo, valor in valores.items():
+            if valor is None:
+                continue
+            anterior = atual.get(campo)
+            atual[campo] = valor if anterior is None else ALPHA * valor + (1 - ALPHA) * anterior
+        atual["amostras"] = atual.get("amostras", 0) + 1
+        _memoria[chave] = atual
+    _estatisticas.set(chave, atual)
+
+
+def estimar_tokens(texto: str, model_id: str | None = None) -> int:
+    """Tokens estimados do texto, com a razão caracteres/token aprendida para o modelo."""
+    return tokens_de_chars(len(texto or ""), model_id)
+
+
+def tokens_de_chars(n_chars: int, model_id: str | None = None) -> int:
+    razao = _stats(model_id).get("chars_por_token") if model_id else None
+    return int(math.ceil(n_chars / (razao or CHARS_POR_TOKEN_PADRAO)))
+
+
+def registrar_uso(model_id: str, chars_prompt: int, tokens_in: int, tokens_out: int, duracao_s: float | None = None, chars_ficha: int | None = None):
+    """Registra o uso real de uma geração (calibra estimativas e previsões futuras)."""
+    _atualizar(model_id, {
+        "chars_por_token": (chars_prompt / tokens_in) if tokens_in and chars_prompt else None,
+        "tokens_out": tokens_out or None,
+        "duracao_s": duracao_s,
+        "chars_ficha": chars_ficha or None,
+    })
+
+
+def registrar_duracao_scrape(duracao_s: float):
+    _atualizar("scraper", {"duracao_s": duracao_s})
+
+
+def registrar_prompt(modo_trabalho: str, chars_prompt: int):
+    """Tamanho real do prompt de uma geração no modo (com ficha, referências recuperadas e fonética)."""
+    _atualizar(f"prompt:{modo_trabalho}", {"chars_prompt": chars_prompt or None})
+
+
+def chars_prompt_medio(modo_trabalho: str) -> int | None:
+    """Média dos prompts reais do modo (None sem observações)."""
+    valor = _stats(f"prompt:{modo_trabalho}").get("chars_prompt")
+    return int(valor) if valor else None
+
+
+@dataclass
+class SecaoPrompt:
+    """Trecho do prompt. prioridade None = obrigatório; menor prioridade é podada primeiro."""
+    nome: str
+    texto: str
+    prioridade: int | None = None
+
+
+def _podar(texto: str, max_chars: int) -> str:
+    """Corta o texto em fronteira de linha para caber em max_chars, marcando o corte."""
+    if len(texto) <= max_chars:
+        return texto
+    marcador = "\n[...]"
+    corte = texto[:max(0, max_chars - len(marcador))]
+    if "\n" in corte:
+        corte = corte[:corte.rfind("\n")]
+    return (corte + marcador) if corte else ""
+
+
+def ajustar_secoes(secoes: list, teto_tokens: int = PROMPT_TETO_TOKENS, model_id: str | None = None):
+    """
+    Garante que a soma das seções caiba no teto, podando as de menor prioridade primeiro.
+    Retorna ({nome: texto ajustado}, relatorio {nome: tokens, ..., "total", "podadas"}).
+    """
+    razao = (_stats(model_id).get("chars_por_token") if model_id else None) or CHARS_POR_TOKEN_PADRAO
+    textos = {s.nome: s.texto or "" for s in secoes}
+    tokens = {nome: estimar_tokens(t, model_id) for nome, t in textos.items()}
+    excesso = sum(tokens.values()) - teto_tokens
+    podadas = []
+
+    for secao in sorted((s for s in secoes if s.prioridade is not None), key=lambda s: s.prioridade):
+        if excesso <= 0:
+            break
+        disponivel = max(0, tokens[secao.nome] - excesso)
+        novo = _podar(textos[secao.nome], int(disponivel * razao))
+        excesso -= tokens[secao.nome] - estimar_tokens(novo, model_id)
+        textos[secao.nome] = novo
+        tokens[secao.nome] = estimar_tokens(novo, model_id)
+        podadas.append(secao.nome)
+
+    if podadas:
+        print(f"[BUDGET] Prompt acima de {teto_tokens} tokens; seções podadas: {', '.join(podadas)}")
+    relatorio = dict(tokens)
+    relatorio["total"] = sum(tokens.values())
+    relatorio["podadas"] = podadas
+    return textos, relatorio
+
+
+@dataclass
+class PrevisaoLote:
+    n_skus: int
+    tokens_in_sku: int
+    tokens_out_sku: int
+    custo_total_brl: float
+    duracao_s: float
+    amostras: int
+
+
+def prever_lote(model_id: str, n_skus: int, tokens_in_sku: int, paralelismo: int = 1, custo_fn=None) -> PrevisaoLote:
+    """
+    Previsão de custo (tabela de preços) e duração (throughput observado) para n SKUs.
+    `custo_fn(model_id, tokens_in, tokens_out)` calcula o custo em BRL de um roteiro.
+    """
+    stats = _stats(model_id)
+    tokens_out = tokens_saida_medio(model_id)
+    duracao_geracao = stats.get("duracao_s") or DURACAO_GERACAO_PADRAO_S
+    duracao_scrape = _stats("scraper").get("duracao_s") or DURACAO_SCRAPE_PADRAO_S
+    custo_sku = custo_fn(model_id, tokens_in_sku, tokens_out) if custo_fn else 0.0
+    ondas = math.ceil(n_skus / max(1, paralelismo)) if n_skus else 0
+    return PrevisaoLote(
+        n_skus=n_skus,
+        tokens_in_sku=tokens_in_sku,
+        tokens_out_sku=tokens_out,
+        custo_total_brl=round(custo_sku * n_skus, 4),
+        duracao_s=round(ondas * (duracao_scrape + duracao_geracao), 1),
+        amostras=int(stats.get("amostras", 0))
+    )
+
+
+def chars_ficha_medio(model_id: str) -> int:
+    return int(_stats(model_id).get("chars_ficha") or CHARS_FICHA_PADRAO)
+
+
+def tokens_saida_medio(model_id: str) -> int:
+    """Tokens de saída médios observados do modelo (TOKENS_SAIDA_PADRAO sem observações)."""
+    return int(_stats(model_id).get("tokens_out") or TOKENS_SAIDA_PADRAO)
@@ -0,0 +1,153 @@
+"""
+Caches da suíte.
+- Em memória: contexto de conhecimento (Supabase) com TTL e contador de versão; qualquer
+  gravação de calibragem incrementa a versão e invalida o que estava em memória.
+- Persistente: armazenamento chave → JSON em SQLite local (ex.: fichas extraídas por SKU).
+"""
+import os
+import json
+import sqlite3
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROJECT_ROOT = os.path.join(os.path.dirname(__file__), '..')
+# Diretório dos caches persistentes locais (fora do controle de versão)
+CACHE_DIR = os.environ.get("MAGALU_CACHE_DIR") or os.path.join(PROJECT_ROOT, ".cache")
+
+# Tempo de vida (segundos) do contexto de conhecimento em memória
+CONTEXTO_CACHE_TTL_S = int(os.environ.get("CONTEXTO_CACHE_TTL_S", "600"))
+
+
+class VersionedTTLCache:
+    """Cache em memória, thread-safe, com expiração por TTL e invalidação global por versão."""
+
+    def __init__(self, ttl_s: float):
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._data = {}
+        self._version = 0
+
+    @property
+    def version(self) -> int:
+        with self._lock:
+            return self._version
+
+    def get(self, key):
+        """Retorna o valor se ainda válido (mesma versão e dentro do TTL), senão None."""
+        with self._lock:
+            entry = self._data.get(key)
+            if not entry:
+                return None
+            versao, gravado_em, valor = entry
+            if versao != self._version or (time.monotonic() - gravado_em) > self.ttl_s:
+                self._data.pop(key, None)
+                return None
+            return valor
+
+    def set(self, key, value, version: int | None = None):
+        """
+        Grava o valor. Se `version` for informado e a versão atual já for outra
+        (houve invalidação durante a busca), o valor é descartado para não cachear dado velho.
+        """
+        with self._lock:
+            if version is not None and version != self._version:
+                return False
+            self._data[key] = (self._version, time.monotonic(), value)
+            return True
+
+    def bump(self) -> int:
+        """Incrementa a versão e descarta todas as entradas."""
+        with self._lock:
+            self._version += 1
+            self._data.clear()
+            return self._version
+
+
+# Cache global (por processo) do contexto de conhecimento, indexado pelo prefixo do modo
+contexto_cache = VersionedTTLCache(CONTEXTO_CACHE_TTL_S)
+
+
+def invalidar_contexto() -> int:
+    """Invalida o contexto de conhecimento cacheado. Chamar após qualquer gravação de calibragem/treino."""
+    versao = contexto_cache.bump()
+    print(f"[CACHE] Contexto de conhecimento invalidado (versão {versao})")
+    return versao
+
+
+class PersistentCache:
+    """
+    Cache persistente chave → valor (JSON) em SQLite, com TTL por entrada.
+    Uma conexão por operação: seguro para uso a partir das threads do lote.
+    """
+
+    def __init__(self, nome: str, ttl_s: float, path: str | None = None):
+        self.nome = nome
+        self.ttl_s = ttl_s
+        self.path = path or os.path.join(CACHE_DIR, "magalu_cache.sqlite")
+        self._lock = threading.Lock()
+        self._pronto = False
+
+    def _conectar(self):
+        if not self._pronto:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._pronto:
+            with self._lock:
+                if not self._pronto:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS cache ("
+                        " namespace TEXT NOT NULL, chave TEXT NOT NULL, valor TEXT NOT NULL,"
+                        " expira_em REAL NOT NULL, PRIMARY KEY (namespace, chave))"
+                    )
+                    conn.commit()
+                    self._pronto = True
+        return conn
+
+    def get(self, chave: str):
+        """Retorna o valor salvo ou None se não existir/expirou."""
+        try:
+            conn = self._conectar()
+            try:
+                row = conn.execute(
+                    "SELECT valor, expira_em FROM cache WHERE namespace = ? AND chave = ?",
+                    (self.nome, chave)
+                ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[CACHE] Erro lendo cache '{self.nome}': {e}")
+            return None
+        if not row or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, chave: str, valor, ttl_s: float | None = None):
+        """Grava o valor (serializável em JSON) com o TTL informado ou o padrão do cache."""
+        expira_em = time.time() + (self.ttl_s if ttl_s is None else ttl_s)
+        try:
+            conn = self._conectar()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, chave, valor, expira_em) VALUES (?, ?, ?, ?)",
+                    (self.nome, chave, json.dumps(valor, ensure_ascii=False), expira_em)
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[CACHE] Erro gravando cache '{self.nome}': {e}")
+
+    def delete(self, chave: str):
+        try:
+            conn = self._conectar()
+            try:
+                conn.execute("DELETE FROM cache WHERE namespace = ? AND chave = ?", (self.nome, chave))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"[CACHE] Erro removendo do cache '{self.nome}': {e}")
@@ -0,0 +1,66 @@
+"""
+Registro de clientes dos provedores de LLM, compartilhado pelo processo inteiro.
+Um cliente por (provedor, API key, base_url/timeout): o pool HTTP e as sessões TLS são
+reaproveitados entre chamadas, agentes e reruns do Streamlit. Os clientes dos SDKs são thread-safe.
+Os clientes assíncronos ficam presos ao event loop em que foram criados, então o registro os separa por loop.
+"""
+import asyncio
+import threading
+from google import genai
+from openai import OpenAI, AsyncOpenAI
+
+PUTER_BASE_URL = "https://api.puter.com/puterai/openai/v1/"
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+ZAI_BASE_URL = "https://api.z.ai/api/paas/v4/"
+KIMI_BASE_URL = "https://api.moonshot.ai/v1"
+
+_clientes = {}
+_lock = threading.Lock()
+
+
+def _obter(chave, fabrica):
+    with _lock:
+        cliente = _clientes.get(chave)
+        if cliente is None:
+            cliente = fabrica()
+            _clientes[chave] = cliente
+        return cliente
+
+
+def get_gemini_client(api_key: str, timeout_ms: int | None = None) -> genai.Client:
+    """Cliente google-genai compartilhado para a chave (e timeout HTTP, quando informado)."""
+    def _fabrica():
+        if timeout_ms:
+            return genai.Client(api_key=api_key, http_options={'timeout': timeout_ms})
+        return genai.Client(api_key=api_key)
+    return _obter(("gemini", api_key, timeout_ms), _fabrica)
+
+
+def get_openai_client(api_key: str, base_url: str | None = None) -> OpenAI:
+    """Cliente OpenAI (ou compatível: Puter, OpenRouter, Z.ai, Kimi) compartilhado para a chave e base_url."""
+    def _fabrica():
+        if base_url:
+            return OpenAI(api_key=api_key, base_url=base_url)
+        return OpenAI(api_key=api_key)
+    return _obter(("openai", api_key, base_url), _fabrica)
+
+
+def get_async_openai_client(api_key: str, base_url: str | None = None) -> AsyncOpenAI:
+    """AsyncOpenAI (ou compatível) compartilhado para a chave, base_url e event loop em execução."""
+    loop = asyncio.get_running_loop()
+
+    def _fabrica():
+        if base_url:
+            return AsyncOpenAI(api_key=api_key, base_url=base_url)
+        return AsyncOpenAI(api_key=api_key)
+    with _lock:
+        # Descarta clientes de loops já encerrados (ex.: asyncio.run em sequência)
+        for chave in [c for c in _clientes if c[0] == "openai_async" and c[3].is_closed()]:
+            del _clientes[chave]
+    return _obter(("openai_async", api_key, base_url, loop), _fabrica)
+
+
+def limpar_clientes():
+    """Descarta os clientes em cache (ex.: após trocar as chaves no painel)."""
+    with _lock:
+        _clientes.clear()
@@ -14,6 +14,14 @@ from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.oxml.ns import qn
 from docx.oxml import OxmlElement
 
+from src.roteiro import parse_roteiro
+from src.product_sheet import sheet_de
+
+_RE_PLACEHOLDER_NOME = re.compile(r'\[?NOME DO PRODUTO\]?', re.IGNORECASE)
+_RE_TITULO_IA = re.compile(r'^\**TÍTULO( DO PRODUTO)?:?\**\s*', re.IGNORECASE)
+_RE_ESTE_PRODUTO = re.compile(r'Est[ea]\s+(.+?),\s+d[ao]')
+_RE_DATA_HEADER = re.compile(r'Data:\s*[\d/]+')
+
 
 def _add_header_line(doc, text: str):
     """Adiciona linha de cabeçalho: Tahoma 14pt Bold."""
@@ -67,72 +75,27 @@ def _add_empty_line(doc):
 
 def _extract_product_name(roteiro_text: str) -> str:
     """Tenta extrair o nome do produto do texto do roteiro."""
-    # Procura na linha de Produto:
-    match = re.search(r'Produto:\s*(.+)', roteiro_text)
-    if match:
-        name = match.group(1).strip()
-        # Remove prefixos conhecidos (NW REVIEW, NW 3D, NW LU, NW, SOCIAL) + Mês + SKU
-        name = re.sub(r'^(NW REVIEW|NW 3D|NW LU|NW|SOCIAL)\s+[A-Z]{3}\s+\d+\s+', '', name, flags=re.IGNORECASE)
+    roteiro = parse_roteiro(roteiro_text)
+    # Procura na linha de Produto: (o parser já separa taxonomia + mês + SKU do nome)
+    if roteiro.cabecalho.produto:
+        name = roteiro.cabecalho.nome_produto
         # Remove placeholder [NOME DO PRODUTO] ou "Nome do Produto"
-        name = re.sub(r'\[?NOME DO PRODUTO\]?', '', name, flags=re.IGNORECASE)
+        name = _RE_PLACEHOLDER_NOME.sub('', name)
         # Remove "TÍTULO DO PRODUTO:" ou similares da IA
-        name = re.sub(r'^\**TÍTULO( DO PRODUTO)?:?\**\s*', '', name, flags=re.IGNORECASE)
+        name = _RE_TITULO_IA.sub('', name)
         return name.strip()
 
     # Fallback: procura no título (primeiras palavras do roteiro que parecem nome de produto)
-    lines = roteiro_text.strip().split('\n')
-    for line in lines:
-        line = line.strip()
-        if line.startswith('- ') and ('da ' in line or 'do ' in line):
+    for fala in roteiro.falas:
+        if 'da ' in fala or 'do ' in fala:
             # Tenta extrair "Este [Produto], da [Marca]"
-            match2 = re.search(r'Est[ea]\s+(.+?),\s+d[ao]', line)
+            match2 = _RE_ESTE_PRODUTO.search(fala)
             if match2:
                 return match2.group(1).strip()
 
     return "Produto"
 
 
-def _parse_roteiro(roteiro_text: str) -> list[dict]:
-    """
-    Parseia o texto bruto do roteiro em blocos estruturados.
-    Retorna lista de dicts com tipo (header, separator, locucao, imagem, lettering, empty).
-    """
-    blocks = []
-    lines = roteiro_text.strip().split('\n')
-
-    for line in lines:
-        stripped = line.strip()
-
-        # Limpa markdown bold da linha para análise de tipo
-        analysis_line = stripped.strip("*").strip()
-
-        if not stripped:
-            blocks.append({"type": "empty"})
-        elif analysis_line.startswith("Cliente:"):
-            blocks.append({"type": "header", "text": analysis_line})
-        elif analysis_line.startswith("Roteirista:"):
-            blocks.append({"type": "header", "text": analysis_line})
-        elif analysis_line.startswith("Produto:"):
-            blocks.append({"type": "header", "text": analysis_line})
-        elif stripped.startswith("____"):
-            blocks.append({"type": "separator"})
-        elif analysis_line.startswith("Imagem:"):
-            blocks.append({"type": "imagem", "text": analysis_line})
-        elif analysis_line.startswith("Lettering:"):
-            blocks.append({"type": "lettering", "text": analysis_line})
-        elif analysis_line.startswith("- "):
-            blocks.append({"type": "locucao", "text": analysis_line})
-        elif stripped.startswith("**") and stripped.endswith("**"):
-            # Se for apenas bold e não foi pego acima como header/imagem etc
-            clean = analysis_line
-            blocks.append({"type": "locucao", "text": f"- {clean}"})
-        else:
-            # Linhas genéricas
-            blocks.append({"type": "text", "text": stripped})
-
-    return blocks
-
-
 def generate_filename(code: str, product_name: str, selected_month: str = "MAR", model_id: str = "", com_lu: bool = True) -> str:
     """Gera nome do arquivo no padrão: NW [LU] {selected_month} {code} {product_name} [{model}].docx"""
     # Garante que o código tenha 9 dígitos (preenche com 0 à direita se necessário)
@@ -188,10 +151,10 @@ def export_roteiro_docx(roteiro_text: str, code: str = "", product_name: str = "
         product_name = _extract_product_name(roteiro_text)
 
     # Parseia o roteiro
-    blocks = _parse_roteiro(roteiro_text)
+    roteiro = parse_roteiro(roteiro_text)
 
     # Verifica se já tem cabeçalho no texto
-    has_header = any(b["type"] == "header" for b in blocks)
+    has_header = roteiro.tem_cabecalho
 
     if not has_header:
         # Gera cabeçalho padrão
@@ -210,15 +173,15 @@ def export_roteiro_docx(roteiro_text: str, code: str = "", product_name: str = "
         _add_empty_line(doc)
 
     # Renderiza cada bloco
-    for block in blocks:
-        btype = block["type"]
-        text = block.get("text", "")
+    for block in roteiro.blocos:
+        btype = block.tipo
+        text = block.texto
 
         if btype == "header":
             # Corrige a data se necessário
             if "Data:" in text:
                 now = datetime.now(pytz.timezone('America/Sao_Paulo'))
-                text = re.sub(r'Data:\s*[\d/]+', f"Data: {now.strftime('%d/%m/%y')}", text)
+                text = _RE_DATA_HEADER.sub(f"Data: {now.strftime('%d/%m/%y')}", text)
             _add_header_line(doc, text)
         elif btype == "separator":
             _add_separator(doc)
@@ -226,7 +189,7 @@ def export_roteiro_docx(roteiro_text: str, code: str = "", product_name: str = "
             _add_locucao(doc, text)
         elif btype == "imagem":
             _add_imagem(doc, text)
-        elif btype == "lettering":
+        elif btype in ("lettering", "tl"):
             _add_imagem(doc, text)
         elif btype == "empty":
             _add_empty_line(doc)
@@ -248,34 +211,25 @@ def format_for_display(roteiro_text: str) -> str:
     Formata o roteiro para exibição no Streamlit com Markdown.
     Locução em **bold**, Imagem sem bold, com quebra de linha.
     """
-    lines = roteiro_text.strip().split('\n')
     formatted = []
 
-    for line in lines:
-        stripped = line.strip()
-
-        if not stripped:
+    for linha in parse_roteiro(roteiro_text).blocos:
+        if linha.tipo == "empty":
             formatted.append("")
-        elif stripped.startswith("Cliente:") or stripped.startswith("Roteirista:") or stripped.startswith("Produto:"):
-            formatted.append(f"**{stripped}**")
-        elif stripped.startswith("____"):
+        elif linha.tipo == "header":
+            formatted.append(f"**{linha.texto}**")
+        elif linha.tipo == "separator":
             formatted.append("---")
-        elif stripped.startswith("- "):
+        elif linha.tipo == "locucao":
             # Verifica se tem "Imagem:" inline (separar)
-            if "Imagem:" in stripped:
-                parts = stripped.split("Imagem:", 1)
-                locucao = parts[0].strip()
-                imagem = "Imagem:" + parts[1]
-                formatted.append(f"**{locucao}**")
-                formatted.append(f"\n{imagem}")
+            if "Imagem:" in linha.texto:
+                locucao, imagem = linha.texto.split("Imagem:", 1)
+                formatted.append(f"**{locucao.strip()}**")
+                formatted.append(f"\nImagem:{imagem}")
             else:
-                formatted.append(f"**{stripped}**")
-        elif stripped.startswith("Imagem:"):
-            formatted.append(stripped)
-        elif stripped.startswith("Lettering:"):
-            formatted.append(stripped)
+                formatted.append(f"**{linha.texto}**")
         else:
-            formatted.append(stripped)
+            formatted.append(linha.texto)
 
     return "\n".join(formatted)
 
@@ -298,10 +252,14 @@ def export_all_roteiros_zip(roteiros: list, selected_month: str = "MAR", selecte
             if roteiro_text.startswith("⚠️"):
                 continue
                 
+            # Nome do cabeçalho do roteiro; sem ele, o título da ficha do produto
+            product_name = _extract_product_name(roteiro_text)
+            if product_name in ("", "Produto"):
+                product_name = sheet_de(item.get('ficha', ''), item.get('codigo', '')).nome
             doc_bytes, filename = export_roteiro_docx(
                 roteiro_text,
                 code=item.get('codigo', ''),
-                product_name='', # Será extraído do texto do roteiro
+                product_name=product_name,
                 selected_month=selected_month,
                 selected_date=selected_date,
                 model_id=item.get('model_id', ''),
@@ -0,0 +1,199 @@
+"""
+Dicionário fonético compilado (Aho-Corasick) a partir de nw_treinamento_fonetica.
+Compilado uma vez por versão do contexto; localiza em uma passada todos os `termo_errado`
+presentes num texto (ficha ou roteiro), para injetar no prompt só as regras relevantes
+e para aplicar localmente as correções de pronúncia nas falas do roteiro gerado (aplicar_fonetica).
+A busca ignora maiúsculas e acentos e respeita fronteira de palavra; a normalização
+preserva o comprimento do texto, então as posições valem para o texto original.
+"""
+import unicodedata
+from collections import deque
+
+from src.roteiro import parse_roteiro
+
+
+def _normalizar_char(c: str) -> str:
+    base = unicodedata.normalize("NFKD", c)[:1] or c
+    return base.lower()[:1] or base
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas e sem acentos, caractere a caractere (mesmo comprimento do original)."""
+    return "".join(_normalizar_char(c) for c in texto)
+
+
+def _eh_palavra(c: str) -> bool:
+    return c.isalnum() or c == "_"
+
+
+class AhoCorasick:
+    """Autômato de múltiplos padrões: uma passada linear pelo texto encontra todos os padrões."""
+
+    def __init__(self, padroes: list):
+        self.goto = [{}]
+        self.falha = [0]
+        self.saida = [[]]
+        self.tamanhos = []
+        for pid, padrao in enumerate(padroes):
+            self.tamanhos.append(len(padrao))
+            no = 0
+            for c in padrao:
+                prox = self.goto[no].get(c)
+                if prox is None:
+                    prox = len(self.goto)
+                    self.goto[no][c] = prox
+                    self.goto.append({})
+                    self.falha.append(0)
+                    self.saida.append([])
+                no = prox
+            if padrao:
+                self.saida[no].append(pid)
+
+        fila = deque(self.goto[0].values())
+        while fila:
+            no = fila.popleft()
+            for c, filho in self.goto[no].items():
+                fila.append(filho)
+                f = self.falha[no]
+                while f and c not in self.goto[f]:
+                    f = self.falha[f]
+                destino = self.goto[f].get(c, 0)
+                self.falha[filho] = destino if destino != filho else 0
+                self.saida[filho] = self.saida[filho] + self.saida[self.falha[filho]]
+
+    def buscar(self, texto: str) -> list:
+        """Todas as ocorrências (inicio, fim, id) em texto já normalizado."""
+        ocorrencias = []
+        no = 0
+        for i, c in enumerate(texto):
+            while no and c not in self.goto[no]:
+                no = self.falha[no]
+            no = self.goto[no].get(c, 0)
+            for pid in self.saida[no]:
+                ocorrencias.append((i - self.tamanhos[pid] + 1, i + 1, pid))
+        return ocorrencias
+
+
+class DicionarioFonetico:
+    """Regras {termo_errado, termo_corrigido} compiladas para busca em lote."""
+
+    def __init__(self, rows: list):
+        self.regras = []
+        vistos = set()
+        for r in rows or []:
+            termo = normalizar(str(r.get("termo_errado") or "").strip())
+            if not termo or termo in vistos:
+                continue
+            vistos.add(termo)
+            self.regras.append(r)
+        self._padroes = [normalizar(str(r["termo_errado"]).strip()) for r in self.regras]
+        self._automato = AhoCorasick(self._padroes)
+
+    def __len__(self):
+        return len(self.regras)
+
+    def ocorrencias(self, texto: str) -> list:
+        """
+        Ocorrências com fronteira de palavra, sem sobreposição (a mais longa vence), em ordem:
+        lista de (inicio, fim, regra).
+        """
+        if not texto or not self.regras:
+            return []
+        norm = normalizar(texto)
+        candidatas = []
+        for ini, fim, pid in self._automato.buscar(norm):
+            antes_ok = ini == 0 or not _eh_palavra(norm[ini - 1]) or not _eh_palavra(norm[ini])
+            depois_ok = fim == len(norm) or not _eh_palavra(norm[fim]) or not _eh_palavra(norm[fim - 1])
+            if antes_ok and depois_ok:
+                candidatas.append((ini, fim, pid))
+        candidatas.sort(key=lambda o: (o[0], -(o[1] - o[0])))
+        escolhidas, limite = [], 0
+        for ini, fim, pid in candidatas:
+            if ini >= limite:
+                escolhidas.append((ini, fim, self.regras[pid]))
+                limite = fim
+        return escolhidas
+
+    def regras_para(self, *textos) -> list:
+        """Regras cujo termo_errado aparece em algum dos textos (ordem do dicionário)."""
+        achadas = set()
+        for texto in textos:
+            achadas.update(id(regra) for _, _, regra in self.ocorrencias(texto or ""))
+        return [r for r in self.regras if id(r) in achadas]
+
+
+def _dentro_de_parenteses(texto: str) -> list:
+    """Para cada posição do texto, se ela está dentro de um trecho entre parênteses."""
+    profundidade, marcas = 0, []
+    for c in texto:
+        if c == "(":
+            profundidade += 1
+        marcas.append(profundidade > 0)
+        if c == ")" and profundidade:
+            profundidade -= 1
+    return marcas
+
+
+def _correcao(linha: str, ini: int, fim: int, chave: str, corrigido: str):
+    """
+    Trecho (inicio, fim, texto) que aplica termo_corrigido à ocorrência, ou None:
+    - pronúncia entre parênteses (ex.: "(léd)") é anotada logo depois do termo, como está;
+    - termo_corrigido que contém o termo fora dos parênteses (ex.: "Echo Dot (écou dót)") substitui a ocorrência;
+    - outros valores (ex.: "3 velocidades" para "85W") não são dica de pronúncia: ficam só no prompt.
+    """
+    alvo = normalizar(corrigido)
+    if alvo == chave:
+        return None
+    # Pronúncia entre parênteses: o termo fica na fala (nunca é trocado pela dica)
+    if corrigido.startswith("(") and corrigido.endswith(")"):
+        if linha[fim:].lstrip().startswith("("):
+            return None
+        return fim, fim, f" {corrigido}"
+    parenteses = _dentro_de_parenteses(corrigido)
+    fora = normalizar("".join(c for c, dentro in zip(corrigido, parenteses) if not dentro))
+    if chave in fora:
+        # Já aplicada (em qualquer ponto da fala) ou termo já seguido de parênteses
+        if alvo in normalizar(linha) or linha[fim:].lstrip().startswith("("):
+            return None
+        if alvo.startswith(chave):
+            # Mantém o termo como está na fala e acrescenta só o restante
+            return fim, fim, corrigido[len(chave):]
+        return ini, fim, corrigido
+    return None
+
+
+def aplicar_fonetica(roteiro: str, dicionario: DicionarioFonetico) -> tuple:
+    """
+    Aplica o termo_corrigido na primeira ocorrência de cada termo nas falas da locução,
+    ex.: "Echo Dot" -> "Echo Dot (écou dót)" (ver _correcao; o valor salvo é usado sem alteração).
+    Idempotente: correção já presente ou termo já seguido de parênteses contam como aplicados,
+    e texto dentro de parênteses nunca é alterado. Retorna (roteiro, lista de termo_errado aplicados).
+    """
+    if not roteiro or not dicionario or not len(dicionario):
+        return roteiro, []
+    resolvidos, aplicados = set(), []
+    estrutura = parse_roteiro(roteiro)
+    linhas = [l.bruto for l in estrutura.linhas]
+    for l in estrutura.linhas:
+        if l.tipo != "locucao":
+            continue
+        n, linha = l.indice, l.bruto
+        ocorrencias = dicionario.ocorrencias(linha)
+        if not ocorrencias:
+            continue
+        parenteses = _dentro_de_parenteses(linha)
+        trechos = []
+        for ini, fim, regra in ocorrencias:
+            chave = normalizar(str(regra["termo_errado"]).strip())
+            if chave in resolvidos or parenteses[ini]:
+                continue
+            resolvidos.add(chave)
+            corrigido = str(regra.get("termo_corrigido") or "").strip()
+            trecho = _correcao(linha, ini, fim, chave, corrigido) if corrigido else None
+            if trecho:
+                trechos.append(trecho)
+                aplicados.append(regra["termo_errado"])
+        for ini, fim, texto in reversed(trechos):
+            linha = linha[:ini] + texto + linha[fim:]
+        linhas[n] = linha
+    return "\n".join(linhas), aplicados
@@ -0,0 +1,90 @@
+"""
+Estatísticas de latência por (tarefa, provedor/modelo) para hedging e timeouts adaptativos.
+- Janela rolante das últimas durações de cada rota: o p95 define quando uma chamada está
+  "atrasada" e vale disparar a mesma requisição numa rota secundária (hedge);
+- o timeout HTTP de cada chamada sai de um múltiplo do p95 observado (limitado por um piso e
+  um teto), em vez de um valor fixo para todos os provedores.
+O roteador (src/router.py) alimenta as amostras e executa o hedge.
+"""
+import os
+import math
+import threading
+from collections import deque
+from concurrent.futures import Future
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Liga/desliga o hedge (os timeouts adaptativos continuam valendo)
+HEDGE_ATIVO = os.environ.get("HEDGE_ATIVO", "1") != "0"
+# Percentil de latência a partir do qual a rota secundária é disparada
+HEDGE_PERCENTIL = float(os.environ.get("HEDGE_PERCENTIL", "0.95"))
+# Amostras mínimas antes de confiar no percentil (antes disso: sem hedge e timeout padrão)
+HEDGE_MIN_AMOSTRAS = int(os.environ.get("HEDGE_MIN_AMOSTRAS", "10"))
+HEDGE_JANELA = 100
+# Timeout adaptativo = fator x p95, entre o piso e o teto
+TIMEOUT_FATOR = float(os.environ.get("TIMEOUT_FATOR", "3"))
+TIMEOUT_MIN_S = float(os.environ.get("TIMEOUT_MIN_S", "30"))
+TIMEOUT_MAX_S = float(os.environ.get("TIMEOUT_MAX_S", "300"))
+
+
+class LatenciasRolantes:
+    """Últimas HEDGE_JANELA durações (s) por (tarefa, rota). Thread-safe."""
+
+    def __init__(self, janela: int = HEDGE_JANELA):
+        self.janela = janela
+        self._amostras = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, tarefa: str, rota: str, duracao_s: float):
+        with self._lock:
+            amostras = self._amostras.get((tarefa, rota))
+            if amostras is None:
+                amostras = self._amostras[(tarefa, rota)] = deque(maxlen=self.janela)
+            amostras.append(duracao_s)
+
+    def percentil(self, tarefa: str, rota: str, p: float = HEDGE_PERCENTIL) -> float | None:
+        """Percentil p (0-1) das durações da rota; None com menos de HEDGE_MIN_AMOSTRAS."""
+        with self._lock:
+            amostras = sorted(self._amostras.get((tarefa, rota), ()))
+        if len(amostras) < HEDGE_MIN_AMOSTRAS:
+            return None
+        return amostras[min(len(amostras) - 1, max(0, math.ceil(p * len(amostras)) - 1))]
+
+    def atraso_hedge(self, tarefa: str, rota: str) -> float | None:
+        """Depois de quantos segundos sem resposta disparar a rota secundária (None = não fazer hedge)."""
+        if not HEDGE_ATIVO:
+            return None
+        return self.percentil(tarefa, rota)
+
+    def timeout_s(self, tarefa: str, rota: str, padrao_s: float | None) -> float | None:
+        p95 = self.percentil(tarefa, rota)
+        if p95 is None:
+            return padrao_s
+        return min(TIMEOUT_MAX_S, max(TIMEOUT_MIN_S, p95 * TIMEOUT_FATOR))
+
+    def timeout_ms(self, tarefa: str, rota: str, padrao_ms: int) -> int:
+        return int(self.timeout_s(tarefa, rota, padrao_ms / 1000) * 1000)
+
+
+# Estatísticas do processo (todas as sessões)
+latencias = LatenciasRolantes()
+
+
+def disparar(fn) -> Future:
+    """
+    Executa fn() numa thread daemon própria e devolve o Future do resultado.
+    Threads não podem ser interrompidas: uma chamada perdedora do hedge segue até responder
+    (ou até o seu timeout adaptativo) e é ignorada, sem ocupar a vaga de um pool compartilhado.
+    """
+    futuro = Future()
+    futuro.set_running_or_notify_cancel()
+
+    def _rodar():
+        try:
+            futuro.set_result(fn())
+        except BaseException as e:
+            futuro.set_exception(e)
+
+    threading.Thread(target=_rodar, name="hedge", daemon=True).start()
+    return futuro
@@ -0,0 +1,122 @@
+"""
+Consultas da página Histórico.
+- Grade: só colunas leves, paginada por keyset em (criado_em, id) decrescente. Cada página é um
+  range no índice, não importa quão longe se navegue (sem OFFSET e sem carregar a tabela inteira);
+- filtros (código/palavra-chave, modo, modelo) aplicados no banco;
+- roteiro_gerado e ficha_extraida só são buscados quando uma linha é aberta;
+- métricas (total, custo, modelo mais usado) e opções de filtro vêm de um GROUP BY no banco
+  (RPC resumo_historico, migration_historico_resumo_v1.sql), cacheado por alguns minutos.
+  Sem a migração, são calculadas sobre os HISTORICO_RESUMO_JANELA registros mais recentes
+  (o total continua exato, via count).
+"""
+import os
+import re
+from dotenv import load_dotenv
+
+from src.cache import VersionedTTLCache
+
+load_dotenv()
+
+# Linhas por página da grade
+HISTORICO_PAGINA = int(os.environ.get("HISTORICO_PAGINA", "50"))
+# Colunas da grade e do resumo (sem os textos grandes)
+COLUNAS_GRADE = "id, criado_em, codigo_produto, modo_trabalho, modelo_llm, custo_estimado_brl"
+COLUNAS_RESUMO = "modo_trabalho, modelo_llm, custo_estimado_brl"
+# Registros usados no resumo quando a RPC não está disponível
+HISTORICO_RESUMO_JANELA = int(os.environ.get("HISTORICO_RESUMO_JANELA", "1000"))
+COLUNAS_DETALHE = "id, criado_em, codigo_produto, roteiro_gerado, ficha_extraida"
+
+# Resumo por tabela (5 min); novas gerações entram no próximo ciclo
+resumo_cache = VersionedTTLCache(int(os.environ.get("HISTORICO_RESUMO_TTL_S", "300")))
+
+_RE_RESERVADOS = re.compile(r'[(),"\\*]')
+
+
+def _literal(valor: str) -> str:
+    """Valor entre aspas para filtros or() do PostgREST (datas com ':' e '+', termos com espaços)."""
+    return '"' + str(valor).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def termos_busca(texto: str) -> list:
+    """Termos da busca (separados por vírgula ou espaço), sem os caracteres reservados do filtro."""
+    return [t for t in (_RE_RESERVADOS.sub("", t).strip() for t in re.split(r"[,\s]+", texto or "")) if t]
+
+
+def buscar_pagina(sp_client, tabela: str, cursor: dict | None = None, limite: int = HISTORICO_PAGINA,
+                  busca: str = "", modo: str | None = None, modelo: str | None = None) -> tuple:
+    """
+    Uma página da grade, do mais recente para o mais antigo: (linhas, cursor da próxima página ou None).
+    `cursor` é {"criado_em", "id"} da última linha da página anterior.
+    """
+    consulta = sp_client.table(tabela).select(COLUNAS_GRADE)
+    if modo:
+        consulta = consulta.eq("modo_trabalho", modo)
+    if modelo:
+        consulta = consulta.eq("modelo_llm", modelo)
+    termos = termos_busca(busca)
+    if termos:
+        # Qualquer termo no código ou no roteiro (OR), como o filtro antigo em pandas
+        consulta = consulta.or_(",".join(
+            f"{coluna}.ilike.{_literal(f'*{t}*')}" for t in termos for coluna in ("codigo_produto", "roteiro_gerado")
+        ))
+    if cursor:
+        # Keyset: estritamente depois de (criado_em, id) na ordem decrescente
+        c, i = _literal(cursor["criado_em"]), _literal(cursor["id"])
+        consulta = consulta.or_(f"criado_em.lt.{c},and(criado_em.eq.{c},id.lt.{i})")
+
+    # Uma linha a mais só para saber se existe próxima página
+    res = consulta.order("criado_em", desc=True).order("id", desc=True).limit(limite + 1).execute()
+    linhas = res.data or []
+    if len(linhas) <= limite:
+        return linhas, None
+    linhas = linhas[:limite]
+    return linhas, {"criado_em": linhas[-1]["criado_em"], "id": linhas[-1]["id"]}
+
+
+def buscar_detalhe(sp_client, tabela: str, registro_id) -> dict | None:
+    """Textos completos (roteiro e ficha) de um registro, sob demanda."""
+    res = sp_client.table(tabela).select(COLUNAS_DETALHE).eq("id", registro_id).limit(1).execute()
+    return res.data[0] if res.data else None
+
+
+def _agrupar(linhas: list) -> list:
+    grupos = {}
+    for l in linhas:
+        chave = (l.get("modo_trabalho"), l.get("modelo_llm"))
+        g = grupos.setdefault(chave, {"modo_trabalho": chave[0], "modelo_llm": chave[1], "registros": 0, "custo": 0.0})
+        g["registros"] += 1
+        try:
+            g["custo"] += float(l.get("custo_estimado_brl") or 0)
+        except (TypeError, ValueError):
+            pass
+    return list(grupos.values())
+
+
+def _resumo_janela(sp_client, tabela: str) -> dict:
+    """Fallback sem a RPC: total exato (count) e grupos dos registros mais recentes."""
+    res = (sp_client.table(tabela).select(COLUNAS_RESUMO, count="exact")
+           .order("criado_em", desc=True).limit(HISTORICO_RESUMO_JANELA).execute())
+    linhas = res.data or []
+    total = res.count if getattr(res, "count", None) is not None else len(linhas)
+    return {"total": total, "grupos": _agrupar(linhas), "parcial": total > len(linhas)}
+
+
+def resumo(sp_client, tabela: str, forcar: bool = False) -> dict:
+    """
+    {"total", "custo", "grupos": [{modo_trabalho, modelo_llm, registros, custo}], "parcial"},
+    cacheado por HISTORICO_RESUMO_TTL_S. parcial=True: custo e grupos cobrem só a janela recente.
+    """
+    if not forcar:
+        cached = resumo_cache.get(tabela)
+        if cached is not None:
+            return cached
+    versao = resumo_cache.version
+    try:
+        grupos = sp_client.rpc("resumo_historico", {"p_tabela": tabela}).execute().data or []
+        dados = {"total": sum(int(g.get("registros") or 0) for g in grupos), "grupos": grupos, "parcial": False}
+    except Exception as e:
+        print(f"[HISTORICO] RPC resumo_historico indisponível ({e}). Resumindo os {HISTORICO_RESUMO_JANELA} registros mais recentes.")
+        dados = _resumo_janela(sp_client, tabela)
+    dados["custo"] = sum(float(g.get("custo") or 0) for g in dados["grupos"])
+    resumo_cache.set(tabela, dados, version=versao)
+    return dados
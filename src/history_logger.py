@@ -0,0 +1,233 @@
+"""
+Gravação do histórico de roteiros em segundo plano (write-behind).
+Os loops de lote só enfileiram a linha e seguem para o próximo SKU; uma thread descarrega a fila
+em inserts de várias linhas por chamada. Cada linha vai antes para um spool local em SQLite,
+e só sai de lá depois que o Supabase confirma o insert. Assim, falha de rede ou queda do
+processo não perde o registro: ele é reenviado com backoff, inclusive na próxima execução.
+"""
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+from src.cache import CACHE_DIR
+from src.historico import resumo_cache
+
+load_dotenv()
+
+# Spool local das linhas ainda não confirmadas pelo banco
+HIST_SPOOL_PATH = os.environ.get("HIST_SPOOL_PATH") or os.path.join(CACHE_DIR, "historico_spool.sqlite")
+# Linhas por insert e intervalo (s) máximo entre descargas
+HIST_CHUNK = int(os.environ.get("HIST_CHUNK", "200"))
+HIST_FLUSH_S = float(os.environ.get("HIST_FLUSH_S", "2"))
+# Tentativas por linha nesta execução (as que esgotarem ficam no spool para a próxima)
+HIST_MAX_TENTATIVAS = int(os.environ.get("HIST_MAX_TENTATIVAS", "8"))
+# Backoff entre tentativas: base * 2^tentativas, até o teto
+HIST_BACKOFF_S = float(os.environ.get("HIST_BACKOFF_S", "2"))
+HIST_BACKOFF_MAX_S = float(os.environ.get("HIST_BACKOFF_MAX_S", "60"))
+
+
+class HistoryLogger:
+    """
+    Fila persistente de linhas (tabela, dados) descarregada por uma thread daemon.
+    Linhas da mesma tabela e com as mesmas colunas vão juntas num insert (o PostgREST grava NULL,
+    e não o DEFAULT, nas colunas ausentes de um insert em lote). Depois de uma falha, o lote
+    seguinte da mesma linha cai pela metade, isolando a linha inválida sem travar as demais.
+    """
+
+    def __init__(self, path: str = HIST_SPOOL_PATH):
+        self.path = path
+        self._cliente = None
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._ocioso = threading.Condition(self._lock)
+        self._thread = None
+        self._pronto = False
+        self._proxima_tentativa = 0.0
+        self._ciclos = 0
+        self._em_passada = False
+
+    def _conectar(self):
+        if not self._pronto:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._pronto:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS spool ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, tabela TEXT NOT NULL, colunas TEXT NOT NULL,"
+                " dados TEXT NOT NULL, tentativas INTEGER NOT NULL DEFAULT 0, erro TEXT)"
+            )
+            # Linhas que esgotaram as tentativas numa execução anterior voltam para a fila
+            conn.execute("UPDATE spool SET tentativas = 0")
+            conn.commit()
+            self._pronto = True
+        return conn
+
+    def registrar(self, sp_client, tabela: str, linhas):
+        """Enfileira uma linha (dict) ou várias (lista) para inserir em `tabela`. Não bloqueia na rede."""
+        linhas = [linhas] if isinstance(linhas, dict) else list(linhas)
+        if not linhas:
+            return
+        with self._lock:
+            if sp_client is not None:
+                self._cliente = sp_client
+            try:
+                conn = self._conectar()
+                try:
+                    conn.executemany(
+                        "INSERT INTO spool (tabela, colunas, dados) VALUES (?, ?, ?)",
+                        [(tabela, ",".join(sorted(l)), json.dumps(l, ensure_ascii=False, default=str)) for l in linhas]
+                    )
+                    conn.commit()
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                print(f"[HISTORICO] Spool local indisponível ({e}); gravando direto no banco.")
+                self._inserir_direto(sp_client, tabela, linhas)
+                return
+            self._iniciar()
+        self._acordar.set()
+
+    @staticmethod
+    def _inserir_direto(sp_client, tabela: str, linhas: list):
+        if sp_client is None:
+            return
+        try:
+            sp_client.table(tabela).insert(linhas).execute()
+        except Exception as e:
+            print(f"❌ Erro ao salvar histórico ({len(linhas)} linhas em {tabela}): {e}")
+
+    def pendentes(self, tabela: str | None = None) -> int:
+        """Linhas no spool (de `tabela` ou de todas) ainda não confirmadas pelo banco."""
+        with self._lock:
+            try:
+                conn = self._conectar()
+                try:
+                    if tabela is None:
+                        return conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+                    return conn.execute("SELECT COUNT(*) FROM spool WHERE tabela = ?", (tabela,)).fetchone()[0]
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                print(f"[HISTORICO] Erro lendo o spool local: {e}")
+                return 0
+
+    def descarregar(self, timeout_s: float = 10) -> bool:
+        """
+        Pede uma descarga imediata (ignorando o backoff) e espera uma passada completa da thread,
+        no máximo timeout_s. True se o spool ficou vazio.
+        """
+        limite = time.monotonic() + timeout_s
+        with self._lock:
+            if self._cliente is None:
+                return False
+            self._iniciar()
+            self._proxima_tentativa = 0.0
+            # Uma passada já em andamento pode não ver as linhas recentes: espera a próxima
+            alvo = self._ciclos + (2 if self._em_passada else 1)
+        self._acordar.set()
+        with self._ocioso:
+            while self._ciclos < alvo and time.monotonic() < limite:
+                self._ocioso.wait(limite - time.monotonic())
+        return not self.pendentes()
+
+    def _iniciar(self):
+        # Chamado com self._lock
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="historico", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            self._acordar.wait(HIST_FLUSH_S)
+            self._acordar.clear()
+            with self._lock:
+                self._em_passada = True
+            try:
+                while time.monotonic() >= self._proxima_tentativa and self._descarregar_lote():
+                    pass
+            except sqlite3.Error as e:
+                print(f"[HISTORICO] Erro no spool local: {e}")
+            with self._ocioso:
+                self._em_passada = False
+                self._ciclos += 1
+                self._ocioso.notify_all()
+
+    def _proximo_lote(self, conn):
+        primeira = conn.execute(
+            "SELECT tabela, colunas, tentativas FROM spool WHERE tentativas < ? ORDER BY id LIMIT 1",
+            (HIST_MAX_TENTATIVAS,)
+        ).fetchone()
+        if not primeira:
+            return []
+        tabela, colunas, tentativas = primeira
+        tamanho = max(1, HIST_CHUNK >> tentativas)
+        return conn.execute(
+            "SELECT id, tabela, dados, tentativas FROM spool WHERE tabela = ? AND colunas = ? AND tentativas < ?"
+            " ORDER BY id LIMIT ?",
+            (tabela, colunas, HIST_MAX_TENTATIVAS, tamanho)
+        ).fetchall()
+
+    def _descarregar_lote(self) -> bool:
+        """Insere o próximo lote do spool. True se inseriu (pode haver mais), False se parou."""
+        with self._lock:
+            cliente = self._cliente
+            conn = self._conectar()
+            try:
+                lote = self._proximo_lote(conn)
+            finally:
+                conn.close()
+        if not lote or cliente is None:
+            return False
+
+        ids = [r[0] for r in lote]
+        tabela = lote[0][1]
+        try:
+            cliente.table(tabela).insert([json.loads(r[2]) for r in lote]).execute()
+        except Exception as e:
+            tentativas = max(r[3] for r in lote) + 1
+            espera = min(HIST_BACKOFF_MAX_S, HIST_BACKOFF_S * 2 ** (tentativas - 1))
+            print(f"❌ Erro ao salvar histórico ({len(lote)} linhas em {tabela}, tentativa {tentativas}): {e}. Nova tentativa em {espera:.0f}s.")
+            with self._lock:
+                self._proxima_tentativa = time.monotonic() + espera
+                conn = self._conectar()
+                try:
+                    conn.executemany(
+                        "UPDATE spool SET tentativas = tentativas + 1, erro = ? WHERE id = ?",
+                        [(str(e)[:500], i) for i in ids]
+                    )
+                    conn.commit()
+                finally:
+                    conn.close()
+            return False
+
+        with self._lock:
+            conn = self._conectar()
+            try:
+                conn.executemany("DELETE FROM spool WHERE id = ?", [(i,) for i in ids])
+                conn.commit()
+            finally:
+                conn.close()
+        # Métricas da página Histórico passam a incluir as linhas novas
+        resumo_cache.bump()
+        print(f"[HISTORICO] {len(lote)} linhas gravadas em {tabela}")
+        return True
+
+
+# Logger do processo (todas as sessões do Streamlit compartilham o spool)
+historico = HistoryLogger()
+
+
+def registrar_historico(sp_client, tabela: str, linhas):
+    """Atalho para historico.registrar (sem cliente Supabase, a linha fica no spool até haver um)."""
+    historico.registrar(sp_client, tabela, linhas)
+
+
+@atexit.register
+def _descarregar_ao_sair():
+    if historico._thread is not None:
+        historico.descarregar(timeout_s=5)
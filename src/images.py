@@ -0,0 +1,205 @@
+"""
+Pipeline de imagens do produto para o caminho multimodal da geração.
+- Baixa as imagens em paralelo numa sessão HTTP com pool de conexões (ou lê arquivos locais,
+  o que permite testar com fixtures: caminhos e URLs file:// são aceitos);
+- reduz para IMAGENS_MAX_LADO px e recomprime em JPEG até caber em IMAGENS_MAX_BYTES;
+- descarta quase-duplicatas (mesma foto em outra resolução/crop leve) pelo dHash;
+- guarda o resultado processado por SKU no cache persistente.
+O formato de saída é o que gerar_roteiro já espera em scraped_data["images"]: [{"mime", "bytes"}].
+"""
+import io
+import os
+import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image, ImageOps
+from dotenv import load_dotenv
+
+from src.cache import PersistentCache
+
+load_dotenv()
+
+# Liga/desliga a coleta de imagens no scraper
+IMAGENS_ATIVO = os.environ.get("IMAGENS_ATIVO", "1") != "0"
+# Quantas imagens por produto vão para o modelo (depois da deduplicação)
+IMAGENS_MAX = int(os.environ.get("IMAGENS_MAX", "4"))
+# Maior lado (px) e tamanho máximo (bytes) de cada imagem enviada
+IMAGENS_MAX_LADO = int(os.environ.get("IMAGENS_MAX_LADO", "768"))
+IMAGENS_MAX_BYTES = int(os.environ.get("IMAGENS_MAX_BYTES", "150000"))
+# Distância de Hamming (bits, de 64) abaixo da qual duas imagens contam como a mesma
+IMAGENS_DHASH_DISTANCIA = int(os.environ.get("IMAGENS_DHASH_DISTANCIA", "6"))
+# Downloads simultâneos e timeout (s) de cada download
+IMAGENS_WORKERS = int(os.environ.get("IMAGENS_WORKERS", "8"))
+IMAGENS_TIMEOUT_S = float(os.environ.get("IMAGENS_TIMEOUT_S", "10"))
+# Imagens processadas por SKU (7 dias)
+IMAGENS_CACHE_TTL_S = int(os.environ.get("IMAGENS_CACHE_TTL_S", str(7 * 24 * 3600)))
+imagens_cache = PersistentCache("imagens", IMAGENS_CACHE_TTL_S)
+
+# Imagens originais acima disso são ignoradas (evita baixar/abrir arquivos gigantes)
+_MAX_BYTES_ORIGINAL = 15 * 1024 * 1024
+_QUALIDADES_JPEG = (85, 75, 65, 55, 45)
+_HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+_sessao = None
+_sessao_lock = threading.Lock()
+
+
+def sessao_http() -> requests.Session:
+    """Sessão requests compartilhada (keep-alive e pool de conexões por host)."""
+    global _sessao
+    with _sessao_lock:
+        if _sessao is None:
+            sessao = requests.Session()
+            adaptador = HTTPAdapter(pool_connections=IMAGENS_WORKERS, pool_maxsize=IMAGENS_WORKERS, max_retries=1)
+            sessao.mount("https://", adaptador)
+            sessao.mount("http://", adaptador)
+            sessao.headers.update(_HEADERS)
+            _sessao = sessao
+        return _sessao
+
+
+def _caminho_local(origem: str) -> str | None:
+    if origem.startswith("file://"):
+        return url2pathname(urlparse(origem).path)
+    if not urlparse(origem).scheme or os.path.exists(origem):
+        return origem
+    return None
+
+
+def ler_origem(origem: str) -> bytes | None:
+    """Bytes da imagem em uma URL http(s), URL file:// ou caminho local; None se falhar."""
+    try:
+        caminho = _caminho_local(origem)
+        if caminho is not None:
+            if os.path.getsize(caminho) > _MAX_BYTES_ORIGINAL:
+                return None
+            with open(caminho, "rb") as f:
+                return f.read()
+        resp = sessao_http().get(origem, timeout=IMAGENS_TIMEOUT_S)
+        if resp.status_code != 200 or len(resp.content) > _MAX_BYTES_ORIGINAL:
+            return None
+        return resp.content
+    except (OSError, requests.RequestException) as e:
+        print(f"[IMAGENS] Falha lendo {origem}: {e}")
+        return None
+
+
+def dhash(img: Image.Image) -> int:
+    """Hash perceptual de diferença (64 bits): gradiente horizontal de uma miniatura 9x8 em cinza."""
+    pixels = img.convert("L").resize((9, 8), Image.LANCZOS).tobytes()
+    bits = 0
+    for linha in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[linha * 9 + col] > pixels[linha * 9 + col + 1])
+    return bits
+
+
+def distancia_hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _rgb(img: Image.Image) -> Image.Image:
+    """RGB para JPEG; transparência vira fundo branco (fotos de produto costumam ser PNG recortado)."""
+    img = ImageOps.exif_transpose(img)
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        fundo = Image.new("RGB", img.size, (255, 255, 255))
+        fundo.paste(img, mask=img.getchannel("A"))
+        return fundo
+    return img.convert("RGB")
+
+
+def comprimir(img: Image.Image, max_lado: int = IMAGENS_MAX_LADO, max_bytes: int = IMAGENS_MAX_BYTES) -> bytes:
+    """JPEG com o maior lado <= max_lado, baixando a qualidade (e depois a resolução) até caber em max_bytes."""
+    img = _rgb(img)
+    img.thumbnail((max_lado, max_lado), Image.LANCZOS)
+    while True:
+        for qualidade in _QUALIDADES_JPEG:
+            saida = io.BytesIO()
+            img.save(saida, format="JPEG", quality=qualidade, optimize=True, progressive=True)
+            if saida.tell() <= max_bytes:
+                return saida.getvalue()
+        if max(img.size) <= 128:
+            return saida.getvalue()
+        img = img.resize((max(1, int(img.width * 0.8)), max(1, int(img.height * 0.8))), Image.LANCZOS)
+
+
+def processar_imagem(dados: bytes):
+    """(bytes JPEG comprimidos, dHash) de uma imagem; None se não for uma imagem legível."""
+    try:
+        with Image.open(io.BytesIO(dados)) as img:
+            img.load()
+            return comprimir(img), dhash(img)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"[IMAGENS] Imagem ignorada: {e}")
+        return None
+
+
+def _baixar_e_processar(origem: str):
+    dados = ler_origem(origem)
+    if not dados:
+        return None
+    processada = processar_imagem(dados)
+    return (origem,) + processada if processada else None
+
+
+def _deduplicar(processadas: list, limite: int) -> list:
+    escolhidas, hashes = [], []
+    for origem, dados, h in processadas:
+        if any(distancia_hamming(h, outro) <= IMAGENS_DHASH_DISTANCIA for outro in hashes):
+            print(f"[IMAGENS] Duplicata descartada: {origem}")
+            continue
+        hashes.append(h)
+        escolhidas.append({"mime": "image/jpeg", "bytes": dados, "url": origem})
+        if len(escolhidas) >= limite:
+            break
+    return escolhidas
+
+
+def _serializar(imagens: list) -> list:
+    return [{"mime": i["mime"], "url": i["url"], "b64": base64.b64encode(i["bytes"]).decode("ascii")} for i in imagens]
+
+
+def _desserializar(salvas: list) -> list:
+    return [{"mime": i["mime"], "url": i["url"], "bytes": base64.b64decode(i["b64"])} for i in salvas]
+
+
+def imagens_em_cache(codigo: str):
+    """Imagens já processadas do SKU (lista, possivelmente vazia) ou None se não houver cache."""
+    salvas = imagens_cache.get(str(codigo).lower())
+    return None if salvas is None else _desserializar(salvas)
+
+
+def obter_imagens(codigo: str, origens: list, limite: int = IMAGENS_MAX, force_refresh: bool = False) -> list:
+    """
+    Baixa (em paralelo), comprime e deduplica as imagens do SKU, na ordem das origens.
+    Resultado em cache por SKU: [{"mime": "image/jpeg", "bytes": ..., "url": origem}].
+    """
+    chave = str(codigo).lower()
+    if not force_refresh:
+        cached = imagens_em_cache(chave)
+        if cached is not None:
+            print(f"[IMAGENS] Cache hit para {codigo} ({len(cached)} imagens)")
+            return cached
+
+    origens = list(dict.fromkeys(o for o in origens or [] if o))
+    if not origens:
+        return []
+    # Baixa algumas a mais que o limite: parte pode ser duplicata ou falhar
+    candidatas = origens[:limite * 3]
+    with ThreadPoolExecutor(max_workers=min(IMAGENS_WORKERS, len(candidatas))) as pool:
+        processadas = [p for p in pool.map(_baixar_e_processar, candidatas) if p]
+
+    imagens = _deduplicar(processadas, limite)
+    total = sum(len(i["bytes"]) for i in imagens)
+    print(f"[IMAGENS] {codigo}: {len(imagens)} imagens ({total // 1024} KB) de {len(candidatas)} origens")
+    if imagens:
+        imagens_cache.set(chave, _serializar(imagens))
+    return imagens
+
+
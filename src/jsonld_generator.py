@@ -6,13 +6,14 @@ import json
 from datetime import datetime
 
 
-def generate_product_jsonld(roteiro: dict, categoria_nome: str = "Genérico") -> dict:
+def generate_product_jsonld(roteiro: dict, categoria_nome: str = "Genérico", sheet=None) -> dict:
     """
     Gera um payload JSON-LD do tipo Product a partir de um registro de roteiro_ouro.
     
     Args:
         roteiro: dict com keys: titulo_produto, codigo_produto, roteiro_perfeito, criado_em
         categoria_nome: nome da categoria associada
+        sheet: ProductSheet do SKU (opcional) — marca, cores e ficha técnica reais
     
     Returns:
         dict representando o JSON-LD
@@ -46,6 +47,12 @@ def generate_product_jsonld(roteiro: dict, categoria_nome: str = "Genérico") ->
         "name": "Magazine Luiza"
     }
 
+    if sheet is not None:
+        dados_ficha = sheet.json_ld()
+        for campo in ("brand", "color", "additionalProperty"):
+            if campo in dados_ficha:
+                jsonld[campo] = dados_ficha[campo]
+
     jsonld["review"] = {
         "@type": "Review",
         "author": {
@@ -100,7 +107,7 @@ def generate_creative_work_jsonld(roteiro: dict, categoria_nome: str = "Genéric
     return jsonld
 
 
-def export_jsonld_string(roteiro: dict, categoria_nome: str = "Genérico", schema_type: str = "Product") -> str:
+def export_jsonld_string(roteiro: dict, categoria_nome: str = "Genérico", schema_type: str = "Product", sheet=None) -> str:
     """
     Retorna o JSON-LD como string formatada, pronto para injeção em <script type="application/ld+json">.
     
@@ -108,6 +115,7 @@ def export_jsonld_string(roteiro: dict, categoria_nome: str = "Genérico", schem
         roteiro: dict do roteiro_ouro
         categoria_nome: nome da categoria
         schema_type: "Product" ou "CreativeWork"
+        sheet: ProductSheet do SKU (opcional, só para Product)
     
     Returns:
         String JSON formatada
@@ -115,7 +123,7 @@ def export_jsonld_string(roteiro: dict, categoria_nome: str = "Genérico", schem
     if schema_type == "CreativeWork":
         payload = generate_creative_work_jsonld(roteiro, categoria_nome)
     else:
-        payload = generate_product_jsonld(roteiro, categoria_nome)
+        payload = generate_product_jsonld(roteiro, categoria_nome, sheet)
     
     return json.dumps(payload, indent=2, ensure_ascii=False)
 
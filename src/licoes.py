@@ -0,0 +1,250 @@
+"""
+Gravação em lote das lições de uma calibragem (Roteiro Ouro, persona, estruturas, fonética e imagens).
+Cada tabela recebe uma única escrita de várias linhas, e as tabelas são gravadas em paralelo.
+A fonética é um upsert com on_conflict em termo_errado e ignore-duplicates (índice único em
+migration_fonetica_unique_v1.sql): termos já cadastrados são mantidos, como antes. Sem o índice,
+são 2 chamadas (um select com in_ e o insert das novas) em vez de 2 por regra.
+Sem dependência do Streamlit: o app mostra o resumo devolvido numa única confirmação.
+
+A confirmação da calibragem roda em segundo plano (agendar_licoes): o modal fecha na hora e o app
+acompanha o Future. A chave de idempotência é o hash da calibragem. Clique duplo, rerun ou
+reenvio da mesma calibragem não gravam de novo, e uma nova tentativa depois de falha parcial só
+grava as tabelas que falharam.
+"""
+import json
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from src.cache import PersistentCache, invalidar_contexto
+
+# Gravações de calibragem simultâneas (cada uma já grava as tabelas em paralelo)
+LICOES_WORKERS = 2
+# Tabelas já gravadas por chave de calibragem (30 dias)
+licoes_cache = PersistentCache("licoes_gravadas", 30 * 24 * 3600)
+# Categoria usada quando a calibragem não trouxe uma
+CATEGORIA_PADRAO_ID = 77
+
+
+def _texto(valor) -> str:
+    """Texto limpo; None e "none" (como o modelo às vezes devolve) viram vazio."""
+    texto = str(valor).strip() if valor else ""
+    return "" if texto.lower() == "none" else texto
+
+
+def _regras(regras) -> list:
+    return [r for r in regras or [] if isinstance(r, dict)]
+
+
+def linhas_fonetica(regras, criado_em: str) -> list:
+    """Linhas de treinamento_fonetica, sem termo_errado repetido dentro da mesma calibragem."""
+    linhas = {}
+    for regra in _regras(regras):
+        termo_err = _texto(regra.get('termo_errado'))
+        termo_cor = _texto(regra.get('termo_corrigido'))
+        if not termo_err or not termo_cor or termo_err in linhas:
+            continue
+        linhas[termo_err] = {
+            "termo_errado": termo_err,
+            "termo_corrigido": termo_cor,
+            "exemplo_no_roteiro": _texto(regra.get('exemplo')),
+            "criado_em": criado_em
+        }
+    return list(linhas.values())
+
+
+def linhas_estrutura(regras, criado_em: str) -> list:
+    linhas = []
+    for regra in _regras(regras):
+        tipo = _texto(regra.get('tipo'))
+        texto_ouro = _texto(regra.get('texto_ouro'))
+        # Tenta pegar prioritariamente 'texto_ia' (novo padrão) ou 'antes' (fallback)
+        texto_ia_rej = _texto(regra.get('texto_ia', regra.get('antes', '')))
+
+        # Normalização para o padrão do banco
+        if "Abertura" in tipo: tipo = "Abertura (Gancho)"
+        elif "Fechamento" in tipo or "CTA" in tipo: tipo = "Fechamento (CTA)"
+        else: tipo = "Desenvolvimento (Venda)"
+
+        if not texto_ouro:
+            continue
+        linhas.append({
+            "tipo_estrutura": tipo,
+            "texto_ouro": texto_ouro,
+            "texto_ia_rejeitado": texto_ia_rej,
+            "aprendizado": _texto(regra.get('motivo')),
+            "criado_em": criado_em
+        })
+    return linhas
+
+
+def linhas_persona(regras, criado_em: str) -> list:
+    linhas = []
+    for regra in _regras(regras):
+        pilar = _texto(regra.get('pilar'))
+        erro = _texto(regra.get('erro'))
+        if not pilar or not erro:
+            continue
+        linhas.append({
+            "pilar_persona": pilar,
+            "texto_gerado_ia": erro,
+            "texto_corrigido_humano": _texto(regra.get('correcao')),
+            "lexico_sugerido": _texto(regra.get('lexico')),
+            "criado_em": criado_em
+        })
+    return linhas
+
+
+def linhas_imagens(regras, criado_em: str, codigo_produto: str = "") -> list:
+    linhas = []
+    for regra in _regras(regras):
+        antes = _texto(regra.get('antes'))
+        depois = _texto(regra.get('depois'))
+        if not antes or not depois:
+            continue
+        linhas.append({
+            "codigo_produto": codigo_produto,
+            "descricao_ia": antes,
+            "descricao_humano": depois,
+            "aprendizado": _texto(regra.get('motivo')),
+            "criado_em": criado_em
+        })
+    return linhas
+
+
+def _inserir(sp_client, tabela: str, linhas: list) -> int:
+    res = sp_client.table(tabela).insert(linhas).execute()
+    return len(res.data or [])
+
+
+def _gravar_fonetica(sp_client, tabela: str, linhas: list) -> int:
+    """Upsert ignorando termos já cadastrados; sem o índice único, filtra com um único select."""
+    try:
+        res = sp_client.table(tabela).upsert(linhas, on_conflict="termo_errado", ignore_duplicates=True).execute()
+        return len(res.data or [])
+    except Exception as e:
+        # 42P10: não há índice único em termo_errado (migração ainda não aplicada)
+        if "42P10" not in str(e):
+            raise
+        print(f"[LICOES] Sem índice único em {tabela}.termo_errado; usando select + insert.")
+    termos = [l["termo_errado"] for l in linhas]
+    existentes = sp_client.table(tabela).select("termo_errado").in_("termo_errado", termos).execute()
+    ja_cadastrados = {r["termo_errado"] for r in existentes.data or []}
+    novas = [l for l in linhas if l["termo_errado"] not in ja_cadastrados]
+    return _inserir(sp_client, tabela, novas) if novas else 0
+
+
+def gravar_licoes(sp_client, table_prefix: str = "nw_", criado_em: str = "", ouro: dict | None = None,
+                  fonetica=None, estrutura=None, persona=None, imagens=None, codigo_produto: str = "",
+                  pular=()) -> dict:
+    """
+    Grava as lições de uma calibragem, uma escrita por tabela e todas em paralelo.
+    Retorna {tabela: {"gravadas": n, "erro": mensagem ou None}} só das tabelas com algo a gravar.
+    Persona e fonética ficam sempre nas tabelas nw_ (como na gravação manual); o resto segue o prefixo.
+    Tabelas em `pular` (já gravadas numa tentativa anterior) são ignoradas.
+    """
+    escritas = {}
+    if ouro:
+        escritas[f"{table_prefix}roteiros_ouro"] = (_inserir, [dict(ouro, criado_em=ouro.get("criado_em") or criado_em)])
+    por_tabela = (
+        ("nw_treinamento_fonetica", _gravar_fonetica, linhas_fonetica(fonetica, criado_em)),
+        (f"{table_prefix}treinamento_estruturas", _inserir, linhas_estrutura(estrutura, criado_em)),
+        ("nw_treinamento_persona_lu", _inserir, linhas_persona(persona, criado_em)),
+        (f"{table_prefix}treinamento_imagens", _inserir, linhas_imagens(imagens, criado_em, codigo_produto)),
+    )
+    for tabela, gravar, linhas in por_tabela:
+        if linhas:
+            escritas[tabela] = (gravar, linhas)
+    escritas = {t: e for t, e in escritas.items() if t not in pular}
+    if not sp_client or not escritas:
+        return {}
+
+    def _gravar(item):
+        tabela, (gravar, linhas) = item
+        try:
+            return tabela, {"gravadas": gravar(sp_client, tabela, linhas), "erro": None}
+        except Exception as e:
+            print(f"❌ Erro ao gravar {len(linhas)} lição(ões) em {tabela}: {e}")
+            return tabela, {"gravadas": 0, "erro": str(e)}
+
+    with ThreadPoolExecutor(max_workers=len(escritas), thread_name_prefix="licoes") as pool:
+        resumo = dict(pool.map(_gravar, escritas.items()))
+
+    if any(r["gravadas"] for r in resumo.values()):
+        invalidar_contexto()
+    return resumo
+
+
+def _categoria_padrao(sp_client) -> int:
+    """Categoria "Genérico" (nw_categorias vale para todos os prefixos), ou CATEGORIA_PADRAO_ID."""
+    try:
+        res = sp_client.table("nw_categorias").select("id, nome").execute()
+        return next((c['id'] for c in res.data or [] if 'Genérico' in c['nome']), CATEGORIA_PADRAO_ID)
+    except Exception as e:
+        print(f"Erro ao buscar categorias: {e}")
+        return CATEGORIA_PADRAO_ID
+
+
+def chave_calibracao(table_prefix: str, ouro: dict | None = None, fonetica=None, estrutura=None,
+                     persona=None, imagens=None, codigo_produto: str = "") -> str:
+    """Hash do conteúdo da calibragem (sem horários): a mesma calibragem sempre gera a mesma chave."""
+    conteudo = {
+        "prefixo": table_prefix,
+        "ouro": {k: v for k, v in (ouro or {}).items() if k != "criado_em"},
+        "fonetica": fonetica, "estrutura": estrutura, "persona": persona, "imagens": imagens,
+        "codigo": codigo_produto,
+    }
+    return hashlib.sha256(json.dumps(conteudo, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+def falhas(resumo: dict) -> dict:
+    """{tabela: erro} das tabelas que não foram gravadas."""
+    return {t: r["erro"] for t, r in (resumo or {}).items() if r.get("erro")}
+
+
+_pool = None
+_trabalhos = {}
+_lock = threading.Lock()
+
+
+def _pool_licoes() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=LICOES_WORKERS, thread_name_prefix="licoes-job")
+    return _pool
+
+
+def _executar(chave: str, sp_client, kwargs: dict) -> dict:
+    anterior = licoes_cache.get(chave) or {}
+    gravadas = {t: r for t, r in anterior.items() if not r.get("erro")}
+    ouro = kwargs.get("ouro")
+    if ouro and not ouro.get("categoria_id"):
+        kwargs = dict(kwargs, ouro=dict(ouro, categoria_id=_categoria_padrao(sp_client)))
+    resumo = dict(gravadas, **gravar_licoes(sp_client, pular=set(gravadas), **kwargs))
+    licoes_cache.set(chave, resumo)
+    print(f"[LICOES] Calibragem {chave[:12]} gravada: {resumo}")
+    return resumo
+
+
+def agendar_licoes(sp_client, chave: str | None = None, **kwargs) -> tuple:
+    """
+    Agenda a gravação (gravar_licoes) em segundo plano e retorna (Future do resumo, nova).
+    nova=False quando a mesma calibragem já está em andamento ou já foi gravada por completo:
+    o Future devolvido é o existente (ou um já concluído com o resumo salvo).
+    """
+    chave = chave or chave_calibracao(
+        kwargs.get("table_prefix", "nw_"), kwargs.get("ouro"), kwargs.get("fonetica"), kwargs.get("estrutura"),
+        kwargs.get("persona"), kwargs.get("imagens"), kwargs.get("codigo_produto", "")
+    )
+    with _lock:
+        atual = _trabalhos.get(chave)
+        if atual is not None and (not atual.done() or (atual.exception() is None and not falhas(atual.result()))):
+            return atual, False
+        salvo = licoes_cache.get(chave)
+        if salvo and not falhas(salvo):
+            feito = Future()
+            feito.set_result(salvo)
+            return feito, False
+        futuro = _pool_licoes().submit(_executar, chave, sp_client, kwargs)
+        _trabalhos[chave] = futuro
+        return futuro, True
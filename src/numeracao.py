@@ -0,0 +1,50 @@
+"""
+Numeração global dos roteiros (global_num) por prefixo de tabela.
+Um lote reserva um bloco de N números numa única chamada à RPC reservar_numeros_roteiro
+(migration_numeracao_v1.sql): O(1) no banco e sem colisão entre usuários gerando ao mesmo tempo.
+Sem a migração aplicada, cai no count exato do histórico, mas uma vez por lote e não por SKU.
+"""
+import time
+import threading
+
+from src.history_logger import historico
+
+# Prefixo -> instante da última falha da RPC (sem a migração, só tenta de novo depois disso)
+RPC_RETENTAR_S = 600
+_sem_rpc = {}
+_lock = threading.Lock()
+# Fallback: números já entregues neste processo por prefixo (o count só enxerga o que já foi gravado)
+_reservados_local = {}
+
+
+def _contar_historico(sp_client, prefixo: str) -> int:
+    tabela = f"{prefixo}historico_roteiros"
+    # Linhas ainda no spool do histórico (write-behind) também contam
+    pendentes = historico.pendentes(tabela)
+    try:
+        res = sp_client.table(tabela).select("id", count="exact").limit(1).execute()
+        return (res.count if getattr(res, "count", None) is not None else 0) + pendentes
+    except Exception:
+        return pendentes
+
+
+def reservar_numeros(sp_client, prefixo: str, quantidade: int = 1) -> int:
+    """Reserva `quantidade` números consecutivos para o prefixo e devolve o primeiro (1 sem Supabase)."""
+    quantidade = max(1, int(quantidade))
+    if not sp_client:
+        return 1
+
+    if time.monotonic() - _sem_rpc.get(prefixo, float("-inf")) > RPC_RETENTAR_S:
+        try:
+            res = sp_client.rpc("reservar_numeros_roteiro", {"p_prefixo": prefixo, "p_quantidade": quantidade}).execute()
+            if res.data is not None:
+                return int(res.data)
+        except Exception as e:
+            print(f"[NUMERACAO] RPC reservar_numeros_roteiro indisponível ({e}). Usando o total do histórico.")
+            _sem_rpc[prefixo] = time.monotonic()
+
+    total = _contar_historico(sp_client, prefixo)
+    with _lock:
+        inicio = max(total, _reservados_local.get(prefixo, 0)) + 1
+        _reservados_local[prefixo] = inicio + quantidade - 1
+    return inicio
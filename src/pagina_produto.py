@@ -0,0 +1,283 @@
+"""
+Extração estruturada da página do produto, sem LLM.
+Lê, nesta ordem, o JSON-LD (schema.org Product), o __NEXT_DATA__ (Next.js) e as tabelas de
+especificação do HTML, e monta a ficha no mesmo formato que o prompt de grounding pede
+(TÍTULO / MARCA / ... / FICHA TÉCNICA / VOLTAGEM / CORES DISPONÍVEIS).
+O HTML é parseado uma vez (lxml quando instalado) e serve também às imagens (src/images.py).
+Trabalha só com a string do HTML: testável com páginas salvas em arquivo.
+"""
+import os
+import re
+import json
+from html import unescape
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup, FeatureNotFound
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Mínimo de itens de ficha técnica para a página dispensar o grounding
+PAGINA_MIN_ITENS = int(os.environ.get("PAGINA_MIN_ITENS", "3"))
+# Limites do texto extraído
+PAGINA_MAX_ITENS = 60
+PAGINA_MAX_DESCRICAO = 2000
+
+_RE_VOLTAGEM = re.compile(r"\b(bivolt|110\s?v|127\s?v|220\s?v)\b", re.IGNORECASE)
+_RE_NOME_VOLTAGEM = re.compile(r"volt|tens[aã]o", re.IGNORECASE)
+_RE_NOME_COR = re.compile(r"^cor(es)?\b", re.IGNORECASE)
+_RE_NOME_LINHA = re.compile(r"^linha\b", re.IGNORECASE)
+_RE_NOME_MARCA = re.compile(r"^marca\b", re.IGNORECASE)
+_RE_ESPACOS = re.compile(r"\s+")
+_CHAVES_NOME = ("keyName", "displayName", "name", "label", "title")
+_CHAVES_FILHOS = ("elements", "values", "items", "children")
+
+
+def parse_html(html: str) -> BeautifulSoup:
+    """BeautifulSoup com lxml (bem mais rápido) e html.parser como alternativa."""
+    try:
+        return BeautifulSoup(html, "lxml")
+    except FeatureNotFound:
+        return BeautifulSoup(html, "html.parser")
+
+
+def _limpar(texto) -> str:
+    """Texto sem tags HTML e com espaços normalizados."""
+    if texto is None:
+        return ""
+    texto = str(texto)
+    if "<" in texto:
+        texto = parse_html(texto).get_text(" ")
+    return _RE_ESPACOS.sub(" ", unescape(texto)).strip()
+
+
+def _tipos(obj: dict) -> list:
+    tipo = obj.get("@type")
+    return tipo if isinstance(tipo, list) else [tipo]
+
+
+def _objetos(dado):
+    """Todos os dicts de uma estrutura JSON (inclui @graph e listas aninhadas)."""
+    if isinstance(dado, list):
+        for item in dado:
+            yield from _objetos(item)
+    elif isinstance(dado, dict):
+        yield dado
+        for valor in dado.values():
+            if isinstance(valor, (dict, list)):
+                yield from _objetos(valor)
+
+
+def _nome(valor) -> str:
+    """Nome de um campo que pode vir como texto ou objeto ({"name": ...} / {"label": ...})."""
+    if isinstance(valor, dict):
+        for chave in _CHAVES_NOME:
+            if isinstance(valor.get(chave), str):
+                return _limpar(valor[chave])
+        return ""
+    if isinstance(valor, list):
+        return _nome(valor[0]) if valor else ""
+    return _limpar(valor)
+
+
+def _escalar(valor) -> bool:
+    return isinstance(valor, (str, int, float)) and not isinstance(valor, bool)
+
+
+def _pares_aninhados(obj, nome_pai=""):
+    """
+    Pares (nome, valor) de estruturas de ficha em árvore (ex.: factsheet do Next.js):
+    um nó com nome e "value" escalar é um item; um nó com filhos passa o nome adiante.
+    """
+    if isinstance(obj, list):
+        for item in obj:
+            yield from _pares_aninhados(item, nome_pai)
+        return
+    if not isinstance(obj, dict):
+        return
+    nome = next((_limpar(obj[c]) for c in _CHAVES_NOME if isinstance(obj.get(c), str)), "") or nome_pai
+    if _escalar(obj.get("value")):
+        if nome:
+            yield nome, _limpar(obj["value"])
+        return
+    for chave in _CHAVES_FILHOS:
+        if isinstance(obj.get(chave), list):
+            yield from _pares_aninhados(obj[chave], nome)
+
+
+def _juntar_pares(pares) -> dict:
+    """Agrupa valores do mesmo item (ordem de aparição, sem repetir)."""
+    ficha = {}
+    for nome, valor in pares:
+        if not nome or not valor or nome == valor:
+            continue
+        valores = ficha.setdefault(nome, [])
+        if valor not in valores:
+            valores.append(valor)
+    return {nome: ", ".join(valores) for nome, valores in ficha.items()}
+
+
+def _imagens_json(dado) -> list:
+    """Campos "image"/"images" de objetos JSON (Product e afins), em qualquer nível."""
+    urls = []
+    for obj in _objetos(dado):
+        imagem = obj.get("image") or obj.get("images")
+        for item in imagem if isinstance(imagem, list) else [imagem]:
+            if isinstance(item, str):
+                urls.append(item)
+            elif isinstance(item, dict) and isinstance(item.get("url") or item.get("contentUrl"), str):
+                urls.append(item.get("url") or item.get("contentUrl"))
+    return urls
+
+
+class PaginaProduto:
+    """Página de produto parseada uma vez; `ficha_texto()` e `urls_imagens()` reaproveitam o parse."""
+
+    def __init__(self, html: str, url: str = ""):
+        self.url = url
+        self.soup = parse_html(html or "")
+        self.json_ld = []
+        for script in self.soup.find_all("script", type="application/ld+json"):
+            try:
+                self.json_ld.append(json.loads(script.string or script.get_text() or ""))
+            except ValueError:
+                continue
+        self.next_data = None
+        script = self.soup.find("script", id="__NEXT_DATA__")
+        if script:
+            try:
+                self.next_data = json.loads(script.string or script.get_text() or "")
+            except ValueError:
+                pass
+
+    # --- Fontes ---
+
+    def _produto_json_ld(self) -> dict:
+        for obj in _objetos(self.json_ld):
+            if any(t in ("Product", "ProductGroup") for t in _tipos(obj)):
+                return obj
+        return {}
+
+    def _produto_next(self) -> dict:
+        """O dict de produto do __NEXT_DATA__: o primeiro com título e ficha/atributos."""
+        if not self.next_data:
+            return {}
+        for obj in _objetos(self.next_data):
+            if (isinstance(obj.get("title"), str) or isinstance(obj.get("name"), str)) and (
+                "factsheet" in obj or "attributes" in obj or "additionalProperty" in obj
+            ):
+                return obj
+        return {}
+
+    def _pares_tabelas(self):
+        for linha in self.soup.select("table tr"):
+            celulas = linha.find_all(["th", "td"], recursive=False)
+            if len(celulas) == 2:
+                yield _limpar(celulas[0].get_text(" ")), _limpar(celulas[1].get_text(" "))
+        for lista in self.soup.find_all("dl"):
+            for dt in lista.find_all("dt"):
+                dd = dt.find_next_sibling("dd")
+                if dd:
+                    yield _limpar(dt.get_text(" ")), _limpar(dd.get_text(" "))
+
+    # --- Campos ---
+
+    def campos(self) -> dict:
+        """Campos da ficha: titulo, marca, linha, descricao, ficha (dict), voltagem, cores (lista)."""
+        ld = self._produto_json_ld()
+        nx = self._produto_next()
+
+        pares = list(_pares_aninhados(ld.get("additionalProperty") or []))
+        pares += list(_pares_aninhados(nx.get("factsheet") or nx.get("additionalProperty") or []))
+        pares += list(self._pares_tabelas())
+        ficha = _juntar_pares(pares)
+
+        titulo = _nome(ld.get("name")) or _nome(nx.get("title") or nx.get("name"))
+        if not titulo:
+            og = self.soup.find("meta", attrs={"property": "og:title"})
+            titulo = _limpar(og.get("content")) if og and (ld or nx or ficha) else ""
+        marca = _nome(ld.get("brand")) or _nome(nx.get("brand")) or next(
+            (v for k, v in ficha.items() if _RE_NOME_MARCA.match(k)), ""
+        )
+        descricao = _limpar(ld.get("description") or nx.get("description"))
+
+        cores = [c for k, v in ficha.items() if _RE_NOME_COR.match(k) for c in v.split(", ")]
+        cores += [_nome(ld.get("color"))] if ld.get("color") else []
+        for variante in ld.get("hasVariant") or []:
+            if isinstance(variante, dict) and variante.get("color"):
+                cores.append(_nome(variante["color"]))
+        voltagens = []
+        # Seletores de variação do Next.js: [{"type": "color" | "voltage", "values": [...]}]
+        for atributo in nx.get("attributes") or []:
+            if not isinstance(atributo, dict):
+                continue
+            tipo = f"{atributo.get('type', '')} {atributo.get('label', '')}".lower()
+            valores = [
+                _limpar(v["value"]) if isinstance(v, dict) and _escalar(v.get("value")) else _nome(v)
+                for v in atributo.get("values") or []
+            ]
+            if "cor" in tipo or "color" in tipo:
+                cores += [v for v in valores if v]
+            elif _RE_NOME_VOLTAGEM.search(tipo):
+                voltagens += [v for v in valores if v]
+
+        voltagem = next((v for k, v in ficha.items() if _RE_NOME_VOLTAGEM.search(k)), "") or " / ".join(dict.fromkeys(voltagens))
+        if not voltagem:
+            achada = _RE_VOLTAGEM.search(titulo)
+            voltagem = achada.group(1) if achada else ""
+
+        return {
+            "titulo": titulo,
+            "marca": marca,
+            "linha": next((v for k, v in ficha.items() if _RE_NOME_LINHA.match(k)), ""),
+            "descricao": descricao[:PAGINA_MAX_DESCRICAO],
+            "ficha": dict(list(ficha.items())[:PAGINA_MAX_ITENS]),
+            "voltagem": voltagem,
+            "cores": list(dict.fromkeys(c for c in cores if c)),
+        }
+
+    def ficha_texto(self, campos: dict | None = None) -> str | None:
+        """Ficha no formato do prompt de extração, ou None se a página não tiver dados suficientes."""
+        c = campos or self.campos()
+        if not c["titulo"] or len(c["ficha"]) < PAGINA_MIN_ITENS:
+            return None
+        voltagem = c["voltagem"]
+        if re.fullmatch(r"\d+\s?v", voltagem, re.IGNORECASE):
+            voltagem = voltagem.replace(" ", "").upper()
+        if len(c["cores"]) == 1:
+            cores = f"Apenas {c['cores'][0]}"
+        else:
+            cores = ", ".join(c["cores"]) or "Não informado"
+        linhas = [
+            f"TÍTULO: {c['titulo']}",
+            f"MARCA: {c['marca'] or 'Não informado'}",
+            f"LINHA/NOME COMERCIAL: {c['linha'] or 'N/A'}",
+            f"DESCRIÇÃO: {c['descricao'] or 'Não informado'}",
+            "FICHA TÉCNICA:",
+        ]
+        linhas += [f"- {nome}: {valor}" for nome, valor in c["ficha"].items()]
+        linhas += [
+            "",
+            f"VOLTAGEM: {voltagem or 'Não informado'}",
+            f"CORES DISPONÍVEIS: {cores}",
+            "FEATURES PRÁTICAS: Ver ficha técnica e descrição",
+        ]
+        return "\n".join(linhas)
+
+    def urls_imagens(self) -> list:
+        """URLs das imagens do produto: JSON-LD, depois __NEXT_DATA__ e og:image / twitter:image."""
+        urls = _imagens_json(self.json_ld)
+        nx = self._produto_next()
+        if nx:
+            # Ignora modelos de URL com placeholders (ex.: "{w}x{h}")
+            urls += [u for u in _imagens_json(nx) if u.startswith("http") and "{" not in u]
+        for prop in ("og:image", "og:image:secure_url", "twitter:image"):
+            for meta in self.soup.find_all("meta", attrs={"property": prop}) + self.soup.find_all("meta", attrs={"name": prop}):
+                if meta.get("content"):
+                    urls.append(meta["content"])
+        absolutas = [urljoin(self.url, unescape(u.strip())) for u in urls if u and u.strip()]
+        return list(dict.fromkeys(absolutas))
+
+    def texto(self) -> str:
+        """Texto corrido da página (para o fallback de resumo por LLM)."""
+        return self.soup.get_text(separator="\n")
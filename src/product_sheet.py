@@ -0,0 +1,205 @@
+"""
+Ficha do produto tipada (ProductSheet), produzida uma vez pelo scraper e reaproveitada por todos.
+Campos já separados (título, marca, ficha técnica, voltagem, cores) junto do texto bruto que vai
+para o prompt. O scraper grava a ficha no cache por SKU; fichas que chegam só como texto
+(entrada manual, histórico do banco) são parseadas uma vez e memoizadas pelo hash do conteúdo.
+"""
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+
+# Quantas fichas parseadas de texto ficam em memória
+SHEET_CACHE_MAX = 512
+
+# Rótulos do formato de saída do scraper (EXTRACTION_PROMPT / pagina_produto)
+_ROTULOS = {
+    "TÍTULO": "titulo",
+    "MARCA": "marca",
+    "LINHA/NOME COMERCIAL": "linha",
+    "DESCRIÇÃO": "descricao",
+    "FICHA TÉCNICA": "ficha",
+    "VOLTAGEM": "voltagem",
+    "CORES DISPONÍVEIS": "cores",
+    "FEATURES PRÁTICAS": "features",
+}
+_RE_ROTULO = re.compile(
+    r"^[\s*#]*(" + "|".join(re.escape(r) for r in _ROTULOS) + r")[\s*]*:[\s*]*(.*)$", re.IGNORECASE
+)
+_RE_ITEM = re.compile(r"^[\s*•-]*([^:\n]{2,60}?)\s*:\s*(.+)$")
+_RE_VOLTAGEM = re.compile(r"\b(bivolt|110\s?v|127\s?v|220\s?v)\b", re.IGNORECASE)
+_RE_SEPARADOR_CORES = re.compile(r"\s*(?:,|;|/|\be\b)\s*")
+_VAZIOS = {"", "n/a", "na", "não informado", "nao informado", "nenhum identificado", "não se aplica", "-"}
+
+
+def _valor(texto: str) -> str:
+    texto = (texto or "").strip().strip("*").strip()
+    return "" if texto.lower() in _VAZIOS else texto
+
+
+@dataclass(frozen=True, slots=True)
+class ProductSheet:
+    codigo: str = ""
+    titulo: str = ""
+    marca: str = ""
+    linha: str = ""
+    descricao: str = ""
+    # ((item, valor), ...) na ordem da página
+    ficha: tuple = ()
+    voltagem: str = ""
+    cores: tuple = ()
+    features: str = ""
+    # Texto completo enviado ao modelo (e gravado no histórico)
+    texto: str = ""
+    # pagina (dados estruturados), grounding (LLM) ou texto (manual/histórico)
+    origem: str = "texto"
+
+    @property
+    def nome(self) -> str:
+        return self.titulo or "Produto"
+
+    def item(self, nome: str, padrao: str = "") -> str:
+        """Valor de um item da ficha técnica pelo nome (sem diferenciar maiúsculas)."""
+        alvo = nome.lower()
+        return next((v for k, v in self.ficha if k.lower() == alvo), padrao)
+
+    def to_dict(self) -> dict:
+        """Dicionário serializável em JSON (cache persistente)."""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, dados: dict) -> "ProductSheet":
+        dados = dict(dados)
+        dados["ficha"] = tuple(tuple(par) for par in dados.get("ficha") or ())
+        dados["cores"] = tuple(dados.get("cores") or ())
+        return cls(**{k: v for k, v in dados.items() if k in cls.__dataclass_fields__})
+
+    def json_ld(self) -> dict:
+        """schema.org Product da ficha (campos vazios omitidos)."""
+        dados = {"@context": "https://schema.org", "@type": "Product", "name": self.titulo, "sku": self.codigo}
+        if self.marca:
+            dados["brand"] = {"@type": "Brand", "name": self.marca}
+        if self.descricao:
+            dados["description"] = self.descricao
+        if self.cores:
+            dados["color"] = ", ".join(self.cores)
+        propriedades = list(self.ficha)
+        if self.voltagem and not any(_RE_VOLTAGEM.search(v) for _, v in propriedades):
+            propriedades.append(("Voltagem", self.voltagem))
+        if propriedades:
+            dados["additionalProperty"] = [{"@type": "PropertyValue", "name": k, "value": v} for k, v in propriedades]
+        return {k: v for k, v in dados.items() if v}
+
+
+def _cores(texto: str) -> tuple:
+    texto = _valor(texto)
+    if texto.lower().startswith("apenas "):
+        texto = texto[7:]
+    return tuple(c for c in (_valor(p) for p in _RE_SEPARADOR_CORES.split(texto)) if c)
+
+
+def _parsear(texto: str, codigo: str, origem: str) -> ProductSheet:
+    campos = {}
+    itens = []
+    atual = None
+    linhas = texto.split("\n")
+    rotulado = any(_RE_ROTULO.match(l) for l in linhas)
+
+    for linha in linhas:
+        rotulo = _RE_ROTULO.match(linha)
+        if rotulo:
+            atual = _ROTULOS[rotulo.group(1).upper()]
+            if atual != "ficha":
+                campos[atual] = rotulo.group(2).strip()
+            continue
+        if not linha.strip():
+            continue
+        # Texto livre (sem rótulos): qualquer "Item: valor" conta como ficha técnica
+        if atual == "ficha" or not rotulado:
+            item = _RE_ITEM.match(linha)
+            if item and _valor(item.group(2)):
+                itens.append((item.group(1).strip(), _valor(item.group(2))))
+        elif atual in ("descricao", "features"):
+            campos[atual] = f"{campos[atual]} {linha.strip()}".strip()
+
+    titulo = _valor(campos.get("titulo", ""))
+    if not titulo and not rotulado:
+        # Ficha manual: a primeira linha com conteúdo costuma ser o nome do produto
+        primeira = next((l.strip().strip("*#").strip() for l in linhas if len(l.strip()) > 2), "")
+        titulo = primeira[:120]
+
+    voltagem = _valor(campos.get("voltagem", "")) or next(
+        (v for k, v in itens if re.search(r"volt|tens[aã]o", k, re.IGNORECASE)), ""
+    )
+    if not voltagem:
+        achada = _RE_VOLTAGEM.search(titulo)
+        voltagem = achada.group(1) if achada else ""
+
+    return ProductSheet(
+        codigo=str(codigo or ""),
+        titulo=titulo,
+        marca=_valor(campos.get("marca", "")) or next((v for k, v in itens if k.lower() == "marca"), ""),
+        linha=_valor(campos.get("linha", "")),
+        descricao=_valor(campos.get("descricao", "")),
+        ficha=tuple(itens),
+        voltagem=voltagem,
+        cores=_cores(campos.get("cores", "")) or tuple(c for k, v in itens if k.lower().startswith("cor") for c in _cores(v)),
+        features=_valor(campos.get("features", "")),
+        texto=texto,
+        origem=origem,
+    )
+
+
+def sheet_de_campos(campos: dict, texto: str, codigo: str = "") -> ProductSheet:
+    """ProductSheet dos campos estruturados de uma página (PaginaProduto.campos), sem reparsear o texto."""
+    return ProductSheet(
+        codigo=str(codigo or ""),
+        titulo=campos.get("titulo", ""),
+        marca=campos.get("marca", ""),
+        linha=campos.get("linha", ""),
+        descricao=campos.get("descricao", ""),
+        ficha=tuple((campos.get("ficha") or {}).items()),
+        voltagem=campos.get("voltagem", ""),
+        cores=tuple(campos.get("cores") or ()),
+        texto=texto,
+        origem="pagina",
+    )
+
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def parse_ficha(texto: str, codigo: str = "", origem: str = "texto") -> ProductSheet:
+    """ProductSheet do texto da ficha (formato do scraper ou texto livre), memoizado pelo conteúdo."""
+    texto = texto or ""
+    chave = hashlib.sha1(f"{codigo}\0{origem}\0{texto}".encode("utf-8")).hexdigest()
+    with _lock:
+        sheet = _cache.get(chave)
+        if sheet is not None:
+            _cache.move_to_end(chave)
+            return sheet
+    sheet = _parsear(texto, codigo, origem)
+    with _lock:
+        _cache[chave] = sheet
+        while len(_cache) > SHEET_CACHE_MAX:
+            _cache.popitem(last=False)
+    return sheet
+
+
+def sheet_de(ficha, codigo: str = "") -> ProductSheet:
+    """
+    ProductSheet de qualquer forma de ficha que circula no app: o dict do scraper (com "sheet"),
+    um dict só com "text" (entrada manual), o texto do histórico ou a própria ProductSheet.
+    """
+    if isinstance(ficha, ProductSheet):
+        return ficha
+    if isinstance(ficha, dict):
+        sheet = ficha.get("sheet")
+        if isinstance(sheet, ProductSheet):
+            return sheet
+        if isinstance(sheet, dict):
+            return ProductSheet.from_dict(sheet)
+        return parse_ficha(str(ficha.get("text", "")), codigo)
+    return parse_ficha("" if ficha is None else str(ficha), codigo)
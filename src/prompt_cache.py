@@ -0,0 +1,110 @@
+"""
+Reaproveitamento do prefixo estático do prompt (base.txt + prompt do modo + conhecimento Supabase).
+- Gemini: context caching explícito (client.caches.create) — o prefixo é enviado uma vez e
+  as gerações seguintes referenciam o `cached_content` e mandam só a parte do SKU.
+- OpenAI-compatíveis: não precisa de registro; o agente envia o prefixo como mensagem de
+  sistema idêntica em todas as chamadas, o que ativa o cache automático de prefixo do provedor.
+- Offline: stub sem rede que só registra criações/reusos (testes e desenvolvimento).
+"""
+import os
+import time
+import hashlib
+import threading
+from google.genai import types
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Tempo de vida do cache no Gemini (cobrado por hora de armazenamento)
+PROMPT_CACHE_TTL_S = int(os.environ.get("PROMPT_CACHE_TTL_S", "3600"))
+# Após falha na criação (ex.: prefixo abaixo do mínimo de tokens do modelo), espera antes de tentar de novo
+PROMPT_CACHE_RETRY_S = int(os.environ.get("PROMPT_CACHE_RETRY_S", "600"))
+# "gemini" (padrão), "offline" (stub) ou "off"
+PROMPT_CACHE_MODE = os.environ.get("PROMPT_CACHE_MODE", "gemini").lower()
+
+
+def hash_prefixo(prefixo: str) -> str:
+    return hashlib.sha256(prefixo.encode("utf-8")).hexdigest()
+
+
+class GeminiPrefixCache:
+    """
+    Registro thread-safe de caches explícitos do Gemini indexados por (conta, modelo, hash do prefixo).
+    Só uma thread cria o cache de um mesmo prefixo; as demais do lote esperam e reutilizam.
+    """
+
+    def __init__(self, ttl_s: int = PROMPT_CACHE_TTL_S, retry_s: int = PROMPT_CACHE_RETRY_S):
+        self.ttl_s = ttl_s
+        self.retry_s = retry_s
+        self._lock = threading.Lock()
+        self._locks_chave = {}
+        # chave -> (nome do cached_content ou None se a criação falhou, expira_em)
+        self._entradas = {}
+
+    def _lock_da_chave(self, chave):
+        with self._lock:
+            return self._locks_chave.setdefault(chave, threading.Lock())
+
+    def _criar(self, client, modelo: str, prefixo: str, digest: str) -> str:
+        cache = client.caches.create(
+            model=modelo,
+            config=types.CreateCachedContentConfig(
+                contents=[prefixo],
+                display_name=f"roteirista-{digest[:12]}",
+                ttl=f"{self.ttl_s}s",
+            )
+        )
+        return cache.name
+
+    def obter(self, client, conta: str, modelo: str, prefixo: str) -> str | None:
+        """Devolve o nome do cached_content para o prefixo (criando se preciso) ou None para enviar inline."""
+        digest = hash_prefixo(prefixo)
+        chave = (conta, modelo, digest)
+        with self._lock_da_chave(chave):
+            with self._lock:
+                entrada = self._entradas.get(chave)
+            # Margem de 60s para não referenciar um cache prestes a expirar
+            if entrada and entrada[1] - 60 > time.time():
+                return entrada[0]
+            try:
+                nome = self._criar(client, modelo, prefixo, digest)
+                print(f"[PROMPT CACHE] Prefixo {digest[:12]} cacheado para {modelo} ({nome})")
+                expira_em = time.time() + self.ttl_s
+            except Exception as e:
+                print(f"[PROMPT CACHE] Não foi possível cachear o prefixo ({modelo}): {e}. Enviando inline.")
+                nome, expira_em = None, time.time() + self.retry_s
+            with self._lock:
+                self._entradas[chave] = (nome, expira_em)
+            return nome
+
+    def descartar(self, conta: str, modelo: str, prefixo: str):
+        """Esquece o cache do prefixo (ex.: o provedor respondeu que ele expirou ou não existe)."""
+        with self._lock:
+            self._entradas.pop((conta, modelo, hash_prefixo(prefixo)), None)
+
+
+class PrefixCacheOffline(GeminiPrefixCache):
+    """Stub sem rede: gera nomes determinísticos e conta criações, para testes com clientes falsos."""
+
+    def __init__(self, ttl_s: int = PROMPT_CACHE_TTL_S, retry_s: int = PROMPT_CACHE_RETRY_S):
+        super().__init__(ttl_s, retry_s)
+        self.criados = []
+
+    def _criar(self, client, modelo: str, prefixo: str, digest: str) -> str:
+        self.criados.append((modelo, digest))
+        return f"cachedContents/offline-{digest[:12]}"
+
+
+_prefix_cache_padrao = None
+_prefix_cache_lock = threading.Lock()
+
+
+def prefix_cache_padrao() -> GeminiPrefixCache | None:
+    """Registro compartilhado do processo conforme PROMPT_CACHE_MODE (None quando desligado)."""
+    global _prefix_cache_padrao
+    if PROMPT_CACHE_MODE == "off":
+        return None
+    with _prefix_cache_lock:
+        if _prefix_cache_padrao is None:
+            _prefix_cache_padrao = PrefixCacheOffline() if PROMPT_CACHE_MODE == "offline" else GeminiPrefixCache()
+        return _prefix_cache_padrao
@@ -0,0 +1,161 @@
+"""
+Recuperação por relevância (BM25) do conhecimento injetado no prompt.
+Em vez dos N registros mais recentes, os Roteiros Ouro, as nuances e as lições de imagem
+são ranqueados contra a ficha técnica/categoria do SKU e só os top-k entram, dentro de um
+orçamento de tokens por seção. O índice é montado uma vez por versão do contexto em cache.
+"""
+import os
+import re
+import threading
+import unicodedata
+from math import log
+from collections import Counter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Seções recuperadas por relevância (as demais continuam no prefixo estático do prompt)
+SECOES_RECUPERADAS = ("ouro", "nuances", "imagens")
+# Campos usados na busca de cada seção
+CAMPOS_BUSCA = {
+    "ouro": ("titulo_produto", "roteiro_perfeito"),
+    "nuances": ("frase_ia", "analise_critica", "exemplo_ouro"),
+    "imagens": ("descricao_ia", "descricao_humano", "aprendizado"),
+}
+# Colunas buscadas de cada seção: as da busca, as do prompt e a categoria dos Roteiros Ouro
+COLUNAS_RECUPERADAS = {
+    "ouro": "titulo_produto, roteiro_perfeito, categoria_id",
+    "nuances": "frase_ia, analise_critica, exemplo_ouro",
+    "imagens": "descricao_ia, descricao_humano, aprendizado",
+}
+RETRIEVAL_TOP_K = {
+    "ouro": int(os.environ.get("RETRIEVAL_TOP_K_OURO", "3")),
+    "nuances": int(os.environ.get("RETRIEVAL_TOP_K_NUANCES", "8")),
+    "imagens": int(os.environ.get("RETRIEVAL_TOP_K_IMAGENS", "6")),
+}
+# Orçamento aproximado (tokens ~ caracteres/4) de cada seção recuperada
+RETRIEVAL_ORCAMENTO_TOKENS = {
+    "ouro": int(os.environ.get("RETRIEVAL_TOKENS_OURO", "2500")),
+    "nuances": int(os.environ.get("RETRIEVAL_TOKENS_NUANCES", "800")),
+    "imagens": int(os.environ.get("RETRIEVAL_TOKENS_IMAGENS", "600")),
+}
+# Quantos registros recentes de cada seção entram no índice
+RETRIEVAL_POOL = int(os.environ.get("RETRIEVAL_POOL", "100"))
+# Bônus de pontuação para Roteiros Ouro da mesma categoria do SKU (nunca para a "Genérico",
+# que é a padrão de quase todo SKU e empurraria os ouros genéricos acima dos relevantes)
+BONUS_CATEGORIA = 2.0
+
+STOPWORDS = {
+    "a", "o", "as", "os", "de", "da", "do", "das", "dos", "e", "em", "no", "na", "nos", "nas",
+    "um", "uma", "uns", "umas", "para", "pra", "por", "com", "sem", "que", "se", "ao", "aos",
+    "ou", "mais", "muito", "ja", "nao", "sim", "seu", "sua", "seus", "suas", "voce", "isso",
+    "este", "esta", "esse", "essa", "tem", "ter", "como", "mas", "bem", "the", "and", "of",
+}
+
+
+def tokenizar(texto: str) -> list:
+    """Minúsculas, sem acentos, palavras com 2+ caracteres e fora da lista de stopwords."""
+    texto = unicodedata.normalize("NFKD", str(texto or "").lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return [t for t in re.findall(r"\w+", texto) if len(t) > 1 and t not in STOPWORDS]
+
+
+class BM25Index:
+    """Índice BM25 (Okapi) em memória sobre uma lista de documentos já tokenizados."""
+
+    def __init__(self, documentos: list, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.tfs = [Counter(doc) for doc in documentos]
+        self.tamanhos = [len(doc) for doc in documentos]
+        self.media = (sum(self.tamanhos) / len(self.tamanhos)) if self.tamanhos else 0
+        df = Counter()
+        for tf in self.tfs:
+            df.update(tf.keys())
+        n = len(documentos)
+        self.idf = {termo: log((n - freq + 0.5) / (freq + 0.5) + 1) for termo, freq in df.items()}
+
+    def pontuar(self, consulta: list) -> list:
+        termos = [t for t in set(consulta) if t in self.idf]
+        scores = []
+        for tf, tamanho in zip(self.tfs, self.tamanhos):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * tamanho / self.media) if self.media else self.k1
+            for termo in termos:
+                freq = tf.get(termo)
+                if freq:
+                    score += self.idf[termo] * freq * (self.k1 + 1) / (freq + norm)
+            scores.append(score)
+        return scores
+
+
+class ColecaoRecuperavel:
+    """Linhas de uma seção de conhecimento com índice BM25 construído sob demanda (uma vez)."""
+
+    def __init__(self, nome: str, rows: list):
+        self.nome = nome
+        self.rows = rows or []
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _texto(self, row) -> str:
+        return " ".join(str(row.get(c) or "") for c in CAMPOS_BUSCA.get(self.nome, ()))
+
+    @property
+    def index(self) -> BM25Index:
+        with self._lock:
+            if self._index is None:
+                self._index = BM25Index([tokenizar(self._texto(r)) for r in self.rows])
+            return self._index
+
+    def selecionar(self, consulta: str = "", categoria_id=None, top_k: int | None = None, orcamento_tokens: int | None = None,
+                   categoria_generica=None) -> list:
+        """
+        Top-k linhas mais relevantes para a consulta, respeitando o orçamento de tokens.
+        Sem consulta (ou sem termos em comum) prevalece a ordem de recência original.
+        A categoria do SKU só pesa nos Roteiros Ouro, e não quando é a `categoria_generica` (id da "Genérico").
+        """
+        if not self.rows:
+            return []
+        top_k = RETRIEVAL_TOP_K.get(self.nome, 5) if top_k is None else top_k
+        orcamento = RETRIEVAL_ORCAMENTO_TOKENS.get(self.nome, 1000) if orcamento_tokens is None else orcamento_tokens
+
+        termos = tokenizar(consulta)
+        scores = self.index.pontuar(termos) if termos else [0.0] * len(self.rows)
+        if self.nome == "ouro" and categoria_id is not None and str(categoria_id) != str(categoria_generica):
+            scores = [
+                s + (BONUS_CATEGORIA if str(r.get("categoria_id")) == str(categoria_id) else 0.0)
+                for s, r in zip(scores, self.rows)
+            ]
+        # Maior pontuação primeiro; empate pelo mais recente (posição original).
+        # Havendo qualquer registro relevante, os de pontuação zero ficam de fora.
+        ordem = sorted(range(len(self.rows)), key=lambda i: (-scores[i], i))
+        if scores and max(scores) > 0:
+            ordem = [i for i in ordem if scores[i] > 0]
+
+        escolhidas, usados = [], 0
+        for i in ordem:
+            if len(escolhidas) >= top_k:
+                break
+            custo = len(self._texto(self.rows[i])) // 4
+            # Sempre aceita a primeira, mesmo acima do orçamento (melhor um exemplo do que nenhum)
+            if escolhidas and usados + custo > orcamento:
+                continue
+            escolhidas.append(self.rows[i])
+            usados += custo
+        return escolhidas
+
+
+class ContextoConhecimento:
+    """
+    Conhecimento de um prefixo de tabelas (nw_, 3d_, ...): texto estático pronto para o
+    prefixo cacheável do prompt + coleções recuperáveis por relevância para o sufixo por SKU
+    + dicionário fonético compilado (DicionarioFonetico) para selecionar regras pelo texto.
+    `categoria_generica` é o id da categoria "Genérico" em nw_categorias (sem bônus de categoria).
+    """
+
+    def __init__(self, estatico: str, colecoes: dict, fonetica=None, categoria_generica=None):
+        self.estatico = estatico
+        self.colecoes = colecoes
+        self.fonetica = fonetica
+        self.categoria_generica = categoria_generica
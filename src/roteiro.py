@@ -0,0 +1,187 @@
+"""
+Parser único do texto de roteiro (cabeçalho, locução, imagem, lettering, TL).
+Produz uma estrutura imutável (dataclasses congeladas) compartilhada pelo exportador DOCX,
+pela exibição, pela correção do cabeçalho e pelos cards da Mesa de Trabalho.
+O resultado é memoizado pelo hash do conteúdo: o mesmo texto é parseado uma única vez.
+"""
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+# Quantos roteiros parseados ficam em memória
+ROTEIRO_CACHE_MAX = 512
+
+_RE_ROTULO = re.compile(r"^(Cliente|Roteirista|Produto|Imagem|Lettering|TL):")
+_RE_DATA = re.compile(r"Data:\s*([\d/]+)")
+# Taxonomia + mês + SKU no início da linha Produto, tolerante a espaços (ex.: "NW LU MAR 123", "NW3D MAR123")
+_RE_PRODUTO = re.compile(r"^((?:NW|SOCIAL)(?:\s*(?:REVIEW|3D|LU))*)\s*([A-Z]{3})\s*(\d+)(?:\s+|$)(.*)$", re.IGNORECASE)
+_TIPO_ROTULO = {
+    "Cliente": "header",
+    "Roteirista": "header",
+    "Produto": "header",
+    "Imagem": "imagem",
+    "Lettering": "lettering",
+    "TL": "tl",
+}
+# Elementos que fecham uma cena (a próxima fala abre outra)
+_TIPOS_CENA = ("imagem", "lettering", "tl")
+
+
+@dataclass(frozen=True)
+class Linha:
+    """Uma linha do roteiro. tipo: header, separator, locucao, imagem, lettering, tl, empty, text."""
+    indice: int
+    tipo: str
+    texto: str
+    bruto: str
+
+
+@dataclass(frozen=True)
+class Cena:
+    locucao: tuple
+    imagem: tuple
+    lettering: tuple
+    tl: tuple
+
+
+@dataclass(frozen=True)
+class Cabecalho:
+    """Cabeçalho NW (linhas Cliente/Roteirista/Produto); campos vazios quando ausentes."""
+    indice: int | None = None
+    cliente: str = ""
+    roteirista: str = ""
+    data: str = ""
+    produto: str = ""
+    taxonomia: str = ""
+    mes: str = ""
+    codigo: str = ""
+    nome_produto: str = ""
+
+
+@dataclass(frozen=True)
+class Roteiro:
+    linhas: tuple
+    cabecalho: Cabecalho
+    cenas: tuple
+
+    @property
+    def tem_cabecalho(self) -> bool:
+        return any(l.tipo == "header" for l in self.linhas)
+
+    @property
+    def blocos(self) -> tuple:
+        """Linhas sem as vazias do início e do fim (o que vai para o documento)."""
+        linhas = self.linhas
+        ini, fim = 0, len(linhas)
+        while ini < fim and linhas[ini].tipo == "empty":
+            ini += 1
+        while fim > ini and linhas[fim - 1].tipo == "empty":
+            fim -= 1
+        return linhas[ini:fim]
+
+    @property
+    def falas(self) -> tuple:
+        return tuple(l.texto for l in self.linhas if l.tipo == "locucao")
+
+
+def _classificar(indice: int, bruto: str) -> Linha:
+    stripped = bruto.strip()
+    # Limpa markdown bold da linha para análise de tipo
+    analise = stripped.strip("*").strip()
+    if not stripped:
+        return Linha(indice, "empty", "", bruto)
+    # Cabeçalho sem nenhum asterisco ("**Cliente:** Magalu" -> "Cliente: Magalu")
+    sem_negrito = stripped.replace("*", "").strip()
+    rotulo = _RE_ROTULO.match(sem_negrito)
+    if rotulo and rotulo.group(1) in ("Cliente", "Roteirista", "Produto"):
+        return Linha(indice, "header", sem_negrito, bruto)
+    if stripped.startswith("____"):
+        return Linha(indice, "separator", "", bruto)
+    if rotulo:
+        return Linha(indice, _TIPO_ROTULO[rotulo.group(1)], analise, bruto)
+    if analise.startswith("- "):
+        return Linha(indice, "locucao", analise, bruto)
+    if stripped.startswith("**") and stripped.endswith("**"):
+        # Só negrito, sem rótulo: tratado como fala
+        return Linha(indice, "locucao", f"- {analise}", bruto)
+    return Linha(indice, "text", stripped, bruto)
+
+
+def _cabecalho(linhas: list) -> Cabecalho:
+    campos = {}
+    for linha in linhas:
+        if linha.tipo != "header":
+            continue
+        rotulo, _, valor = linha.texto.partition(":")
+        if rotulo in campos:
+            continue
+        campos[rotulo] = (linha.indice, valor.strip())
+    if not campos:
+        return Cabecalho()
+
+    produto = campos.get("Produto", (None, ""))[1]
+    taxonomia = mes = codigo = ""
+    nome = produto
+    m = _RE_PRODUTO.match(produto)
+    if m:
+        taxonomia = " ".join(re.findall(r"NW|SOCIAL|REVIEW|3D|LU", m.group(1).upper()))
+        mes, codigo, nome = m.group(2).upper(), m.group(3), m.group(4)
+    roteirista = campos.get("Roteirista", (None, ""))[1]
+    data = _RE_DATA.search(roteirista)
+    return Cabecalho(
+        indice=campos["Cliente"][0] if "Cliente" in campos else min(i for i, _ in campos.values()),
+        cliente=campos.get("Cliente", (None, ""))[1],
+        roteirista=roteirista,
+        data=data.group(1) if data else "",
+        produto=produto,
+        taxonomia=taxonomia,
+        mes=mes,
+        codigo=codigo,
+        nome_produto=nome.strip(),
+    )
+
+
+def _cenas(linhas: list) -> tuple:
+    cenas, atual = [], None
+    for linha in linhas:
+        if linha.tipo == "locucao":
+            if atual is None or any(atual[t] for t in _TIPOS_CENA):
+                atual = {"locucao": [], "imagem": [], "lettering": [], "tl": []}
+                cenas.append(atual)
+            atual["locucao"].append(linha.texto)
+        elif linha.tipo in _TIPOS_CENA:
+            if atual is None:
+                atual = {"locucao": [], "imagem": [], "lettering": [], "tl": []}
+                cenas.append(atual)
+            atual[linha.tipo].append(linha.texto)
+        elif linha.tipo in ("header", "separator"):
+            atual = None
+    return tuple(Cena(*(tuple(c[t]) for t in ("locucao", "imagem", "lettering", "tl"))) for c in cenas)
+
+
+def _parsear(texto: str) -> Roteiro:
+    linhas = [_classificar(i, bruto) for i, bruto in enumerate(texto.split("\n"))]
+    return Roteiro(tuple(linhas), _cabecalho(linhas), _cenas(linhas))
+
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def parse_roteiro(texto: str) -> Roteiro:
+    """Roteiro estruturado do texto (memoizado pelo hash do conteúdo)."""
+    texto = texto or ""
+    chave = hashlib.sha1(texto.encode("utf-8")).hexdigest()
+    with _lock:
+        roteiro = _cache.get(chave)
+        if roteiro is not None:
+            _cache.move_to_end(chave)
+            return roteiro
+    roteiro = _parsear(texto)
+    with _lock:
+        _cache[chave] = roteiro
+        while len(_cache) > ROTEIRO_CACHE_MAX:
+            _cache.popitem(last=False)
+    return roteiro
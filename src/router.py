@@ -0,0 +1,327 @@
+"""
+Roteamento entre provedores/modelos de LLM com circuit breaker e preferência por latência.
+Substitui as cadeias de fallback escritas à mão: cada chamada declara suas rotas em ordem
+de preferência e o roteador pula as que estão com o circuito aberto e ordena as saudáveis
+pela latência observada para aquele tipo de tarefa.
+Com `hedge=True`, uma chamada que passa do p95 de latência da rota dispara a mesma tarefa na
+rota seguinte e fica com a primeira resposta (ver src/hedging.py). Com `fallback=False`, as rotas
+seguintes só entram como hedge: uma falha da principal nunca troca de provedor.
+"""
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from typing import Callable
+from dotenv import load_dotenv
+
+from src.hedging import latencias, disparar
+
+load_dotenv()
+
+# Falhas consecutivas que abrem o circuito de uma rota
+ROUTER_FALHAS_PARA_ABRIR = int(os.environ.get("ROUTER_FALHAS_PARA_ABRIR", "3"))
+# Tempo (s) com o circuito aberto antes de uma tentativa de teste; dobra a cada nova falha
+ROUTER_COOLDOWN_S = float(os.environ.get("ROUTER_COOLDOWN_S", "60"))
+ROUTER_COOLDOWN_MAX_S = float(os.environ.get("ROUTER_COOLDOWN_MAX_S", "900"))
+# Peso da amostra mais recente na média móvel exponencial de latência
+ROUTER_EWMA_ALPHA = 0.3
+
+
+class TodasRotasFalharam(Exception):
+    """Nenhuma rota disponível concluiu a tarefa. `erros` traz (rota, exceção) de cada tentativa."""
+
+    def __init__(self, tarefa: str, erros: list):
+        self.tarefa = tarefa
+        self.erros = erros
+        detalhes = "; ".join(f"{nome}: {msg}" for nome, msg in erros) or "todas as rotas com circuito aberto"
+        super().__init__(f"[{tarefa}] {detalhes}")
+
+
+@dataclass
+class Rota:
+    """Uma opção de execução: `nome` identifica o circuito (ex.: 'gemini/gemini-2.0-flash')."""
+    nome: str
+    executar: Callable
+    rotulo: str = ""
+
+
+class _Circuito:
+    def __init__(self):
+        self.falhas_seguidas = 0
+        self.aberto_ate = 0.0
+        self.cooldown = ROUTER_COOLDOWN_S
+        self.em_teste = False
+
+    def disponivel(self, agora: float) -> bool:
+        if self.falhas_seguidas < ROUTER_FALHAS_PARA_ABRIR:
+            return True
+        # Meio-aberto: passado o cooldown, libera uma única chamada de teste
+        if agora >= self.aberto_ate and not self.em_teste:
+            self.em_teste = True
+            return True
+        return False
+
+    def sucesso(self):
+        self.falhas_seguidas = 0
+        self.cooldown = ROUTER_COOLDOWN_S
+        self.em_teste = False
+
+    def falha(self, agora: float):
+        self.falhas_seguidas += 1
+        if self.falhas_seguidas >= ROUTER_FALHAS_PARA_ABRIR:
+            if self.em_teste:
+                self.cooldown = min(self.cooldown * 2, ROUTER_COOLDOWN_MAX_S)
+            self.aberto_ate = agora + self.cooldown
+        self.em_teste = False
+
+
+class ProviderRouter:
+    """Roteador thread-safe, compartilhado pelo processo (estado de saúde vale para todas as sessões)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._circuitos = {}
+        # (tarefa, nome da rota) -> latência média (s)
+        self._latencias = {}
+
+    def _circuito(self, nome: str) -> _Circuito:
+        circuito = self._circuitos.get(nome)
+        if circuito is None:
+            circuito = self._circuitos[nome] = _Circuito()
+        return circuito
+
+    def _ordenar(self, tarefa: str, rotas: list) -> list:
+        """
+        Ordena pela latência média da tarefa (mais rápida antes). Rotas sem medição recebem,
+        de forma otimista, a melhor latência conhecida; empates mantêm a ordem declarada (preferência).
+        """
+        medidas = [self._latencias[(tarefa, r.nome)] for r in rotas if (tarefa, r.nome) in self._latencias]
+        otimista = min(medidas) if medidas else 0.0
+        ordem = {id(r): i for i, r in enumerate(rotas)}
+        return sorted(rotas, key=lambda r: (self._latencias.get((tarefa, r.nome), otimista), ordem[id(r)]))
+
+    def _liberada(self, tarefa: str, rota: Rota) -> bool:
+        with self._lock:
+            if self._circuito(rota.nome).disponivel(time.monotonic()):
+                return True
+        print(f"[ROUTER] {tarefa}: pulando {rota.nome} (circuito aberto)")
+        return False
+
+    def _registrar_falha(self, tarefa: str, rota: Rota, erro: Exception, erros: list):
+        with self._lock:
+            self._circuito(rota.nome).falha(time.monotonic())
+        print(f"[ROUTER] {tarefa}: {rota.nome} falhou ({erro})")
+        erros.append((rota.nome, erro))
+
+    def _registrar_sucesso(self, tarefa: str, rota: Rota, duracao: float):
+        with self._lock:
+            self._circuito(rota.nome).sucesso()
+            anterior = self._latencias.get((tarefa, rota.nome))
+            self._latencias[(tarefa, rota.nome)] = duracao if anterior is None else (
+                ROUTER_EWMA_ALPHA * duracao + (1 - ROUTER_EWMA_ALPHA) * anterior
+            )
+        latencias.registrar(tarefa, rota.nome, duracao)
+
+    def _ordenadas(self, tarefa: str, rotas: list, ordenar: bool) -> list:
+        if not ordenar:
+            return list(rotas)
+        with self._lock:
+            return self._ordenar(tarefa, rotas)
+
+    def _proxima_liberada(self, tarefa: str, pendentes: list):
+        """Retira de `pendentes` a próxima rota com circuito liberado (None se não houver)."""
+        while pendentes:
+            rota = pendentes.pop(0)
+            if self._liberada(tarefa, rota):
+                return rota
+        return None
+
+    def _atraso_hedge(self, tarefa: str, rota: Rota, hedge: bool, pendentes: list):
+        return latencias.atraso_hedge(tarefa, rota.nome) if hedge and pendentes else None
+
+    @staticmethod
+    def _cronometrar(rota: Rota):
+        inicio = time.monotonic()
+        resultado = rota.executar()
+        return resultado, time.monotonic() - inicio
+
+    @staticmethod
+    async def _cronometrar_async(rota: Rota):
+        inicio = time.monotonic()
+        resultado = await rota.executar()
+        return resultado, time.monotonic() - inicio
+
+    def _concluir_descartada(self, tarefa: str, rota: Rota, futuro):
+        """Chamada perdedora que terminou depois: a latência e a saúde da rota ainda contam."""
+        if futuro.cancelled():
+            return
+        erro = futuro.exception()
+        if erro is not None:
+            self._registrar_falha(tarefa, rota, erro, [])
+            return
+        self._registrar_sucesso(tarefa, rota, futuro.result()[1])
+
+    def _executar_com_hedge(self, tarefa: str, rota: Rota, pendentes: list, atraso: float, erros: list, ao_descartar):
+        """
+        Executa `rota` numa thread; sem resposta em `atraso` s, dispara também a próxima rota liberada.
+        A primeira que concluir vence. A secundária só sai por atraso: se `rota` falhar antes disso,
+        nada mais é disparado. Threads não podem ser interrompidas: a perdedora segue em thread própria
+        (hedging.disparar) até o fim e o resultado é ignorado. Retorna (resultado, rota) ou None se as
+        lançadas falharem.
+        """
+        lancadas = {disparar(lambda: self._cronometrar(rota)): rota}
+        feitas, _ = wait(lancadas, timeout=atraso)
+        if not feitas:
+            secundaria = self._proxima_liberada(tarefa, pendentes)
+            if secundaria is not None:
+                print(f"[HEDGE] {tarefa}: {rota.nome} passou de {atraso:.1f}s (p95); disparando {secundaria.nome}")
+                lancadas[disparar(lambda: self._cronometrar(secundaria))] = secundaria
+
+        while lancadas:
+            feitas, _ = wait(lancadas, return_when=FIRST_COMPLETED)
+            for futuro in feitas:
+                atual = lancadas.pop(futuro)
+                try:
+                    resultado, duracao = futuro.result()
+                except Exception as e:
+                    self._registrar_falha(tarefa, atual, e, erros)
+                    continue
+                self._registrar_sucesso(tarefa, atual, duracao)
+                for perdedor, rota_perdedora in lancadas.items():
+                    print(f"[HEDGE] {tarefa}: {atual.nome} venceu; descartando {rota_perdedora.nome}")
+                    if ao_descartar:
+                        ao_descartar(rota_perdedora)
+                    perdedor.add_done_callback(lambda f, r=rota_perdedora: self._concluir_descartada(tarefa, r, f))
+                return resultado, atual
+        return None
+
+    async def _executar_com_hedge_async(self, tarefa: str, rota: Rota, pendentes: list, atraso: float, erros: list, ao_descartar):
+        """Igual a `_executar_com_hedge` com tarefas asyncio: a chamada perdedora é cancelada."""
+        lancadas = {asyncio.ensure_future(self._cronometrar_async(rota)): rota}
+        try:
+            feitas, _ = await asyncio.wait(lancadas, timeout=atraso)
+            if not feitas:
+                secundaria = self._proxima_liberada(tarefa, pendentes)
+                if secundaria is not None:
+                    print(f"[HEDGE] {tarefa}: {rota.nome} passou de {atraso:.1f}s (p95); disparando {secundaria.nome}")
+                    lancadas[asyncio.ensure_future(self._cronometrar_async(secundaria))] = secundaria
+
+            while lancadas:
+                feitas, _ = await asyncio.wait(lancadas, return_when=asyncio.FIRST_COMPLETED)
+                for tarefa_async in feitas:
+                    atual = lancadas.pop(tarefa_async)
+                    try:
+                        resultado, duracao = tarefa_async.result()
+                    except Exception as e:
+                        self._registrar_falha(tarefa, atual, e, erros)
+                        continue
+                    self._registrar_sucesso(tarefa, atual, duracao)
+                    for rota_perdedora in lancadas.values():
+                        print(f"[HEDGE] {tarefa}: {atual.nome} venceu; cancelando {rota_perdedora.nome}")
+                        if ao_descartar:
+                            ao_descartar(rota_perdedora)
+                    return resultado, atual
+            return None
+        finally:
+            # Perdedoras (ou todas, se quem chamou foi cancelado) não seguem consumindo o provedor
+            for tarefa_async in lancadas:
+                tarefa_async.cancel()
+
+    @staticmethod
+    def _levantar_erro_principal(rota: Rota, erros: list):
+        """Sem fallback, a falha da rota principal sobe com a exceção original (como sem roteador)."""
+        for nome, erro in erros:
+            if nome == rota.nome:
+                raise erro
+
+    def executar(self, tarefa: str, rotas: list, hedge: bool = False, ordenar: bool = True, ao_descartar=None,
+                 fallback: bool = True):
+        """
+        Executa a tarefa na melhor rota disponível, passando para a próxima em caso de exceção.
+        Retorna (resultado, rota). Levanta TodasRotasFalharam se nenhuma concluir.
+        - hedge: se a rota passar do seu p95 de latência, dispara também a próxima e usa a primeira resposta;
+        - ordenar=False mantém a ordem declarada (a primeira rota é sempre a principal);
+        - ao_descartar(rota) é chamado para cada rota disparada cuja resposta foi descartada (custo a contabilizar);
+        - fallback=False: só a primeira rota é executada; as demais apenas como hedge, nunca depois de uma falha
+          (que sobe com a exceção original da principal).
+        """
+        erros = []
+        pendentes = self._ordenadas(tarefa, rotas, ordenar)
+
+        while pendentes:
+            rota = pendentes.pop(0)
+            # Sem fallback, a principal é sempre chamada: pular o circuito seria trocar de provedor
+            if fallback and not self._liberada(tarefa, rota):
+                continue
+            atraso = self._atraso_hedge(tarefa, rota, hedge, pendentes)
+            if atraso is not None:
+                concluido = self._executar_com_hedge(tarefa, rota, pendentes, atraso, erros, ao_descartar)
+                if concluido is not None:
+                    return concluido
+            else:
+                inicio = time.monotonic()
+                try:
+                    resultado = rota.executar()
+                except Exception as e:
+                    self._registrar_falha(tarefa, rota, e, erros)
+                else:
+                    self._registrar_sucesso(tarefa, rota, time.monotonic() - inicio)
+                    return resultado, rota
+            if not fallback:
+                self._levantar_erro_principal(rota, erros)
+
+        raise TodasRotasFalharam(tarefa, erros)
+
+    async def executar_async(self, tarefa: str, rotas: list, hedge: bool = False, ordenar: bool = True, ao_descartar=None,
+                             fallback: bool = True):
+        """
+        Igual a `executar`, para rotas cujo `executar()` devolve uma corrotina.
+        Compartilha circuitos e latências com as chamadas síncronas.
+        """
+        erros = []
+        pendentes = self._ordenadas(tarefa, rotas, ordenar)
+
+        while pendentes:
+            rota = pendentes.pop(0)
+            # Sem fallback, a principal é sempre chamada: pular o circuito seria trocar de provedor
+            if fallback and not self._liberada(tarefa, rota):
+                continue
+            atraso = self._atraso_hedge(tarefa, rota, hedge, pendentes)
+            if atraso is not None:
+                concluido = await self._executar_com_hedge_async(tarefa, rota, pendentes, atraso, erros, ao_descartar)
+                if concluido is not None:
+                    return concluido
+            else:
+                inicio = time.monotonic()
+                try:
+                    resultado = await rota.executar()
+                except Exception as e:
+                    self._registrar_falha(tarefa, rota, e, erros)
+                else:
+                    self._registrar_sucesso(tarefa, rota, time.monotonic() - inicio)
+                    return resultado, rota
+            if not fallback:
+                self._levantar_erro_principal(rota, erros)
+
+        raise TodasRotasFalharam(tarefa, erros)
+
+    def status(self) -> dict:
+        """Fotografia do estado (para depuração): circuitos e latências médias."""
+        agora = time.monotonic()
+        with self._lock:
+            return {
+                "circuitos": {
+                    nome: {
+                        "falhas_seguidas": c.falhas_seguidas,
+                        "aberto": c.falhas_seguidas >= ROUTER_FALHAS_PARA_ABRIR and agora < c.aberto_ate,
+                    }
+                    for nome, c in self._circuitos.items()
+                },
+                "latencias": {f"{t}:{n}": round(v, 2) for (t, n), v in self._latencias.items()},
+            }
+
+
+# Roteador global do processo
+router = ProviderRouter()
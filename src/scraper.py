@@ -4,12 +4,35 @@ Foca na pesquisa do Código do Produto Magalu no Google para evitar bloqueios de
 """
 import os
 import re
-from google import genai
-from google.genai.types import Tool, GenerateContentConfig, GoogleSearch
+import asyncio
+from google.genai.types import Tool, GenerateContentConfig, GoogleSearch, HttpOptions
 from dotenv import load_dotenv
+from src.cache import PersistentCache
+from src.clients import get_gemini_client
+from src.router import router, Rota, TodasRotasFalharam
+from src.hedging import latencias
+from src.images import IMAGENS_ATIVO, obter_imagens, imagens_em_cache, sessao_http
+from src.pagina_produto import PaginaProduto
+from src.product_sheet import ProductSheet, parse_ficha, sheet_de_campos
 
 load_dotenv()
 
+# Cache local de fichas por SKU (7 dias) e de "produto não encontrado" (2 horas)
+SCRAPE_CACHE_TTL_S = int(os.environ.get("SCRAPE_CACHE_TTL_S", str(7 * 24 * 3600)))
+SCRAPE_CACHE_NEGATIVE_TTL_S = int(os.environ.get("SCRAPE_CACHE_NEGATIVE_TTL_S", str(2 * 3600)))
+scrape_cache = PersistentCache("scrape", SCRAPE_CACHE_TTL_S)
+
+# Modelos do scraper em ordem de preferência
+SCRAPER_MODELOS = ["gemini-2.5-flash", "gemini-3.1-pro-preview"]
+# Timeout das chamadas do scraper enquanto não há latências observadas para o modelo
+SCRAPER_TIMEOUT_MS = 150000
+
+# Antes do grounding, tenta ler a ficha direto da página (JSON-LD / __NEXT_DATA__ / tabelas), sem LLM
+SCRAPER_HTML_DIRETO = os.environ.get("SCRAPER_HTML_DIRETO", "1") != "0"
+# Página do produto a partir do código, quando a entrada não é uma URL
+SCRAPER_URL_PRODUTO = os.environ.get("SCRAPER_URL_PRODUTO", "https://www.magazineluiza.com.br/p/{code}/")
+SCRAPER_HTML_TIMEOUT_S = float(os.environ.get("SCRAPER_HTML_TIMEOUT_S", "8"))
+
 EXTRACTION_PROMPT = """
 Você é um pesquisador especialista em produtos do Magazine Luiza.
 
@@ -43,114 +66,311 @@ FEATURES PRÁTICAS: [Liste recursos "escondidos" que costumam ficar no final da
 - Se não encontrar absolutamente nada sobre esse código, responda rigorosamente: "ERRO: Produto não encontrado ou dados indisponíveis."
 """
 
-def scrape_with_gemini(code_or_url: str, api_key: str | None = None) -> dict:
-    """Extrai dados usando Grounding do Google Search via SDK v2 (google.genai)."""
+def normalizar_codigo(code_or_url: str) -> str:
+    """Extrai o código Magalu de uma URL (/p/<código>) ou limpa o código digitado."""
+    input_val = code_or_url.strip()
+    if input_val.startswith("http"):
+        match = re.search(r'/p/(\w+)', input_val)
+        return match.group(1) if match else input_val
+    return re.sub(r'[^0-9a-zA-Z]', '', input_val)
+
+
+def _is_resultado_negativo(text: str) -> bool:
+    """Extração que terminou sem dados do produto (vale cache curto para não repetir a busca)."""
+    return text.startswith("⚠️ EXTRAÇÃO AUTOMÁTICA FALHOU") or "ERRO: Produto não encontrado" in text
+
+
+def _config_com_timeout(config, tarefa: str, modelo: str):
+    """Config da chamada com o timeout adaptativo do modelo para a tarefa (p95 observado)."""
+    opcoes = HttpOptions(timeout=latencias.timeout_ms(tarefa, f"gemini/{modelo}", SCRAPER_TIMEOUT_MS))
+    if config is None:
+        return GenerateContentConfig(http_options=opcoes)
+    return config.model_copy(update={"http_options": opcoes})
+
+
+def _rotas_scraper(tarefa, contents, config, gerar):
+    return [
+        Rota(f"gemini/{modelo}", lambda modelo=modelo: gerar(
+            model=modelo,
+            contents=contents,
+            config=_config_com_timeout(config, tarefa, modelo)
+        ))
+        for modelo in SCRAPER_MODELOS
+    ]
+
+
+def _gerar_com_fallback(client, tarefa: str, contents, config=None):
+    """
+    generate_content roteado entre os modelos do scraper (pula modelo com circuito aberto).
+    Com hedge: se o modelo passar do seu p95, o seguinte recebe a mesma chamada e vale a primeira resposta.
+    """
+    response, _ = router.executar(tarefa, _rotas_scraper(tarefa, contents, config, client.models.generate_content), hedge=True)
+    return response
+
+
+async def _gerar_com_fallback_async(client, tarefa: str, contents, config=None):
+    """Versão assíncrona de _gerar_com_fallback (client.aio), com os mesmos circuitos e latências."""
+    response, _ = await router.executar_async(tarefa, _rotas_scraper(tarefa, contents, config, client.aio.models.generate_content), hedge=True)
+    return response
+
+
+def _texto_seguro(resp):
+    try:
+        if resp and hasattr(resp, 'text'):
+            return resp.text
+        return None
+    except:
+        return None
+
+
+def _ficha_em_cache(code: str, force_refresh: bool):
+    if force_refresh:
+        return None
+    cached = scrape_cache.get(code.lower())
+    if cached is not None:
+        print(f"[SCRAPER] Cache hit para {code}")
+        sheet = ProductSheet.from_dict(cached["sheet"]) if cached.get("sheet") else parse_ficha(cached["text"], code, "grounding")
+        return {
+            "text": cached["text"],
+            "images": (imagens_em_cache(code) or []) if IMAGENS_ATIVO else [],
+            "sheet": sheet,
+        }
+    return None
+
+
+def ficha_cacheada(code_or_url: str) -> ProductSheet | None:
+    """ProductSheet já extraída do SKU (só cache local, sem rede), ou None."""
+    code = normalizar_codigo(str(code_or_url or ""))
+    cached = scrape_cache.get(code.lower()) if code else None
+    if not cached or _is_resultado_negativo(cached.get("text", "")):
+        return None
+    return ProductSheet.from_dict(cached["sheet"]) if cached.get("sheet") else parse_ficha(cached["text"], code, "grounding")
+
+
+def _chave_api(api_key):
     api_key = api_key or os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
-    if not api_key:
-        return {"text": "❌ API Key não configurada no painel lateral.", "images": []}
+    if api_key:
+        os.environ.setdefault("GOOGLE_API_KEY", api_key)
+    return api_key
+
+
+def _config_grounding():
+    # O novo SDK v2 exige o uso de GoogleSearch em vez de GoogleSearchRetrieval
+    return GenerateContentConfig(
+        tools=[Tool(google_search=GoogleSearch())],
+        temperature=0.0
+    )
+
+
+def _grounding_insuficiente(result_text) -> bool:
+    return not result_text or len(result_text.strip()) < 50 or "ERRO:" in result_text
+
+
+def _prompt_direto(code: str) -> str:
+    return f"Extraia a ficha técnica do produto Magalu código {code}. Se não souber, retorne apenas 'FALHA_TOTAL'."
+
+
+def _html_pagina(url: str, timeout: float = 10):
+    """(HTML, URL final após redirecionamentos) da página, ou None."""
+    resp = sessao_http().get(url, timeout=timeout)
+    if resp.status_code == 200:
+        return resp.text, resp.url
+    return None
+
+
+def _baixar_pagina(url: str, pagina: PaginaProduto | None = None):
+    """Texto bruto da página do produto (fallback por URL), ou None. Reaproveita a página já baixada."""
+    if pagina is None:
+        html = _html_pagina(url)
+        pagina = PaginaProduto(*html) if html else None
+    return pagina.texto() if pagina else None
+
+
+def _extracao_direta(input_val: str, code: str, force_refresh: bool):
+    """
+    Ficha lida da página do produto, sem LLM. Retorna (resultado ou None, página parseada ou None);
+    a página volta mesmo sem dados suficientes para ser reaproveitada pelos fallbacks.
+    """
+    if not SCRAPER_HTML_DIRETO:
+        return None, None
+    url = input_val if input_val.startswith("http") else SCRAPER_URL_PRODUTO.format(code=code)
+    try:
+        html = _html_pagina(url, timeout=SCRAPER_HTML_TIMEOUT_S)
+    except Exception as e:
+        print(f"[SCRAPER] Página direta indisponível para {code}: {e}")
+        return None, None
+    if not html:
+        return None, None
+    pagina = PaginaProduto(*html)
+    campos = pagina.campos()
+    texto = pagina.ficha_texto(campos)
+    if not texto:
+        print(f"[SCRAPER] Página de {code} sem dados estruturados suficientes. Seguindo para o grounding.")
+        return None, pagina
+    print(f"[SCRAPER] Ficha de {code} extraída direto da página (sem LLM)")
+    imagens = _coletar_imagens(code, [pagina], force_refresh)
+    return _concluir_extracao(code, texto, imagens, sheet_de_campos(campos, texto, code)), pagina
+
+
+def _paginas_produto(input_val: str, response, pagina: PaginaProduto | None = None) -> list:
+    """Páginas do produto de onde tirar imagens: a URL informada ou as páginas Magalu citadas pelo grounding."""
+    if input_val.startswith("http"):
+        return [pagina or input_val]
+    paginas = []
+    try:
+        metadata = response.candidates[0].grounding_metadata if response and response.candidates else None
+        for chunk in (getattr(metadata, "grounding_chunks", None) or []):
+            web = getattr(chunk, "web", None)
+            if web and web.uri and "magazineluiza" in f"{web.title or ''} {web.uri}".lower():
+                paginas.append(web.uri)
+    except (AttributeError, IndexError):
+        pass
+    return paginas[:2]
+
+
+def _coletar_imagens(code: str, paginas: list, force_refresh: bool) -> list:
+    """Imagens do produto (comprimidas, sem duplicatas, em cache por SKU) a partir das páginas."""
+    if not IMAGENS_ATIVO:
+        return []
+    if not force_refresh:
+        cached = imagens_em_cache(code)
+        if cached is not None:
+            return cached
+    origens = []
+    for pagina in paginas:
+        try:
+            if not isinstance(pagina, PaginaProduto):
+                html = _html_pagina(pagina)
+                if not html:
+                    continue
+                pagina = PaginaProduto(*html)
+            origens.extend(pagina.urls_imagens())
+        except Exception as e:
+            print(f"[SCRAPER] Erro lendo imagens de {pagina}: {e}")
+    return obter_imagens(code, origens, force_refresh=True) if origens else []
+
 
+def _prompt_url(text_content: str) -> str:
+    return f"Resuma os dados técnicos deste produto Magalu a partir do conteúdo bruto abaixo:\n\n{text_content[:15000]}"
+
+
+def _concluir_extracao(code: str, result_text, imagens=None, sheet: ProductSheet | None = None) -> dict:
+    if not result_text or len(result_text.strip()) < 50:
+         result_text = f"⚠️ EXTRAÇÃO AUTOMÁTICA FALHOU: Não conseguimos resgatar dados para o SKU {code}. Por favor, cole a ficha técnica manualmente no campo de entrada."
+
+    # Cache negativo com TTL curto: o produto pode ser publicado/indexado em seguida
+    ttl = SCRAPE_CACHE_NEGATIVE_TTL_S if _is_resultado_negativo(result_text) else None
+    sheet = sheet or parse_ficha(result_text, code, "grounding")
+    scrape_cache.set(code.lower(), {"text": result_text, "sheet": sheet.to_dict()}, ttl_s=ttl)
+
+    return {"text": result_text, "images": [] if ttl else (imagens or []), "sheet": sheet}
+
+
+def _etapas_scrape(code_or_url: str, api_key: str | None, force_refresh: bool):
+    """
+    Etapas do scraper sem I/O próprio, compartilhadas pelas versões síncrona e assíncrona.
+    É um gerador: cada chamada de rede é pedida ao executor com `yield` e o resultado volta pelo send
+    (ou a exceção, pelo throw). Pedidos: ("modelo", client, tarefa, contents, config) para o
+    generate_content roteado e ("io", fn, *args) para funções bloqueantes. O retorno é a ficha.
+    """
     # Limpeza do código
     input_val = code_or_url.strip()
-    if input_val.startswith("http"):
-        match = re.search(r'/p/(\w+)', input_val)
-        code = match.group(1) if match else input_val
-    else:
-        code = re.sub(r'[^0-9a-zA-Z]', '', input_val)
+    code = normalizar_codigo(input_val)
+
+    cached = _ficha_em_cache(code, force_refresh)
+    if cached is not None:
+        return cached
+
+    # Primeiro nível: dados estruturados da página, sem chamada ao LLM
+    direto, pagina = yield ("io", _extracao_direta, input_val, code, force_refresh)
+    if direto is not None:
+        return direto
+
+    api_key = _chave_api(api_key)
+    if not api_key:
+        return {"text": "❌ API Key não configurada no painel lateral.", "images": []}
 
     prompt = EXTRACTION_PROMPT.replace("{code}", code)
 
     try:
-        os.environ.setdefault("GOOGLE_API_KEY", api_key)
-        client = genai.Client(api_key=api_key, http_options={'timeout': 150000})
-        result_text = None
-        
-        # O novo SDK v2 exige o uso de GoogleSearch em vez de GoogleSearchRetrieval
-        config = GenerateContentConfig(
-            tools=[Tool(google_search=GoogleSearch())],
-            temperature=0.0
-        )
-        
-        # Tenta primeiro com o Gemini 2.5 Flash (Estável com Google Search Grounding)
-        # Se falhar, faz fallback automático para o 3.1 Pro (Menos rápido mas bem equipado)
+        client = get_gemini_client(api_key, timeout_ms=SCRAPER_TIMEOUT_MS)
+
+        # Gemini 2.5 Flash (Estável com Google Search Grounding) e 3.1 Pro (Menos rápido mas bem equipado),
+        # escolhidos pelo roteador conforme saúde e latência
         response = None
         try:
-            print(f"[SCRAPER] Tentando Grounding via Gemini 2.5 Flash...")
-            response = client.models.generate_content(
-                model='gemini-2.5-flash', 
-                contents=prompt,
-                config=config
-            )
-        except Exception as e_1:
-            print(f"[SCRAPER] Gemini 2.5 instável ({e_1}). Acionando FALLBACK 3.1 Pro...")
-            try:
-                response = client.models.generate_content(
-                    model='gemini-3.1-pro-preview', 
-                    contents=prompt,
-                    config=config
-                )
-            except Exception as e_2:
-                print(f"[SCRAPER] Gemini 3.1 também falhou no Grounding ({e_2}).")
-                response = None
-        
-        def get_text_safe(resp):
-            try:
-                if resp and hasattr(resp, 'text'):
-                    return resp.text
-                return None
-            except:
-                return None
-
-        result_text = get_text_safe(response)
-        
-        if not result_text or len(result_text.strip()) < 50 or "ERRO:" in result_text:
+            print("[SCRAPER] Tentando Grounding via Gemini...")
+            response = yield ("modelo", client, "scrape_grounding", prompt, _config_grounding())
+        except TodasRotasFalharam as e:
+            print(f"[SCRAPER] Grounding falhou em todos os modelos ({e}).")
+
+        result_text = _texto_seguro(response)
+
+        if _grounding_insuficiente(result_text):
             print(f"[SCRAPER] Grounding falhou para {code}. Tentando Prompt Direto...")
             # Fallback 1: Prompt Direto sem Tools
-            try:
-                response_fallback = client.models.generate_content(
-                    model='gemini-2.5-flash',
-                    contents=f"Extraia a ficha técnica do produto Magalu código {code}. Se não souber, retorne apenas 'FALHA_TOTAL'.",
-                )
-            except:
-                response_fallback = client.models.generate_content(
-                    model='gemini-3.1-pro-preview',
-                    contents=f"Extraia a ficha técnica do produto Magalu código {code}. Se não souber, retorne apenas 'FALHA_TOTAL'.",
-                )
-            result_text = get_text_safe(response_fallback)
+            response_fallback = yield ("modelo", client, "scrape_direto", _prompt_direto(code), None)
+            result_text = _texto_seguro(response_fallback)
 
         if (not result_text or "FALHA_TOTAL" in result_text) and input_val.startswith("http"):
-            print(f"[SCRAPER] Prompt Direto falhou. Tentando extração via URL Context...")
+            print("[SCRAPER] Prompt Direto falhou. Tentando extração via URL Context...")
             # Fallback 2: URL Context
             try:
-                import requests
-                from bs4 import BeautifulSoup
-                headers = {"User-Agent": "Mozilla/5.0"}
-                resp = requests.get(input_val, headers=headers, timeout=10)
-                if resp.status_code == 200:
-                    soup = BeautifulSoup(resp.text, 'html.parser')
-                    text_content = soup.get_text(separator='\n')
-                    
-                    try:
-                        res_url = client.models.generate_content(
-                            model='gemini-2.5-flash',
-                            contents=f"Resuma os dados técnicos deste produto Magalu a partir do conteúdo bruto abaixo:\n\n{text_content[:15000]}"
-                        )
-                    except:
-                        res_url = client.models.generate_content(
-                            model='gemini-3.1-pro-preview',
-                            contents=f"Resuma os dados técnicos deste produto Magalu a partir do conteúdo bruto abaixo:\n\n{text_content[:15000]}"
-                        )
-                    result_text = get_text_safe(res_url)
+                text_content = yield ("io", _baixar_pagina, input_val, pagina)
+                if text_content:
+                    res_url = yield ("modelo", client, "scrape_url", _prompt_url(text_content), None)
+                    result_text = _texto_seguro(res_url)
             except Exception as e:
                 print(f"[SCRAPER] Erro no Fallback URL: {e}")
 
-
-        if not result_text or len(result_text.strip()) < 50:
-             result_text = f"⚠️ EXTRAÇÃO AUTOMÁTICA FALHOU: Não conseguimos resgatar dados para o SKU {code}. Por favor, cole a ficha técnica manualmente no campo de entrada."
-
-        return {"text": result_text, "images": []}
+        imagens = []
+        if not _is_resultado_negativo(result_text or ""):
+            imagens = yield ("io", _coletar_imagens, code, _paginas_produto(input_val, response, pagina), force_refresh)
+        return _concluir_extracao(code, result_text, imagens)
     except Exception as e:
         return {"text": f"❌ Erro Crítico no Scraper: {str(e)}", "images": []}
 
+
+def scrape_with_gemini(code_or_url: str, api_key: str | None = None, force_refresh: bool = False) -> dict:
+    """
+    Extrai dados usando Grounding do Google Search via SDK v2 (google.genai).
+    O resultado fica em cache local por código normalizado; `force_refresh` ignora o cache.
+    """
+    etapas = _etapas_scrape(code_or_url, api_key, force_refresh)
+    resultado, erro = None, None
+    while True:
+        try:
+            pedido = etapas.throw(erro) if erro else etapas.send(resultado)
+        except StopIteration as fim:
+            return fim.value
+        resultado, erro = None, None
+        try:
+            if pedido[0] == "modelo":
+                resultado = _gerar_com_fallback(*pedido[1:])
+            else:
+                resultado = pedido[1](*pedido[2:])
+        except Exception as e:
+            erro = e
+
+
+async def scrape_with_gemini_async(code_or_url: str, api_key: str | None = None, force_refresh: bool = False) -> dict:
+    """Versão assíncrona de scrape_with_gemini (mesmas etapas, cache e resultado), via client.aio."""
+    etapas = _etapas_scrape(code_or_url, api_key, force_refresh)
+    resultado, erro = None, None
+    while True:
+        try:
+            pedido = etapas.throw(erro) if erro else etapas.send(resultado)
+        except StopIteration as fim:
+            return fim.value
+        resultado, erro = None, None
+        try:
+            if pedido[0] == "modelo":
+                resultado = await _gerar_com_fallback_async(*pedido[1:])
+            else:
+                resultado = await asyncio.to_thread(pedido[1], *pedido[2:])
+        except Exception as e:
+            erro = e
+
 def parse_codes(raw_input: str) -> list[str]:
     """Parseia códigos separados por vírgula, espaço ou nova linha."""
     return [c.strip() for c in re.split(r'[,\s\n]+', raw_input.strip()) if c.strip()]
@@ -0,0 +1,49 @@
+"""
+Geração em streaming: itera pedaços de texto conforme o modelo responde e, ao final,
+expõe o resultado consolidado (mesmo dicionário das chamadas bloqueantes).
+"""
+from dataclasses import dataclass
+
+
+@dataclass
+class UsoTokens:
+    """Registro final de uso emitido pelo provedor ao fim do stream."""
+    tokens_in: int = 0
+    tokens_out: int = 0
+    tokens_cached: int = 0
+
+
+class GeracaoStream:
+    """
+    Iterável de pedaços (str) da resposta. `origem` é um gerador que produz str e,
+    opcionalmente, um UsoTokens. Terminado o consumo, `finalizar(texto, uso)` monta
+    o resultado (cabeçalho, custo etc.), disponível em `.resultado`.
+
+    Uso típico no Streamlit:
+        stream = agent.gerar_roteiro_stream(...)
+        st.write_stream(stream)
+        res = stream.resultado
+    """
+
+    def __init__(self, origem, finalizar):
+        self._origem = origem
+        self._finalizar = finalizar
+        self._partes = []
+        self._uso = None
+        self.resultado = None
+
+    def __iter__(self):
+        for item in self._origem:
+            if isinstance(item, UsoTokens):
+                self._uso = item
+                continue
+            if item:
+                self._partes.append(item)
+                yield item
+        self.resultado = self._finalizar("".join(self._partes), self._uso)
+
+    def consumir(self) -> dict:
+        """Consome o stream sem exibir e retorna o resultado final."""
+        for _ in self:
+            pass
+        return self.resultado
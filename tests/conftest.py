@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# Caches, spool do histórico e lotes dos testes ficam fora do .cache do projeto
+os.environ.setdefault("MAGALU_CACHE_DIR", tempfile.mkdtemp(prefix="magalu-testes-"))
+os.environ.setdefault("GEMINI_API_KEY", "chave-de-teste")
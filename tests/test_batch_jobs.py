@@ -0,0 +1,83 @@
+import json
+import os
+
+import pytest
+
+from src import batch_jobs
+from src.agent import RoteiristaAgent
+from src.batch import ItemLote
+from src.batch_jobs import LocalBatchProvider, TrabalhoLote, coletar_trabalho, hidratar_trabalho, submeter_trabalho, sucessos
+from src.history_logger import HistoryLogger
+
+
+class _Consulta:
+    def __init__(self, cliente, tabela):
+        self.cliente, self.tabela, self.linhas = cliente, tabela, []
+
+    def insert(self, linhas):
+        self.linhas = linhas
+        return self
+
+    def execute(self):
+        self.cliente.inseridas.setdefault(self.tabela, []).extend(self.linhas)
+        return type("Resposta", (), {"data": self.linhas})()
+
+
+class SupabaseFalso:
+    """Só o necessário para o histórico: table(...).insert(...).execute()."""
+
+    def __init__(self):
+        self.inseridas = {}
+
+    def table(self, tabela):
+        return _Consulta(self, tabela)
+
+
+@pytest.fixture
+def lotes_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_jobs, "LOTES_DIR", str(tmp_path))
+    return str(tmp_path)
+
+
+@pytest.fixture
+def historico(tmp_path, monkeypatch):
+    logger = HistoryLogger(path=str(tmp_path / "spool.sqlite"))
+    monkeypatch.setattr(batch_jobs, "registrar_historico", logger.registrar)
+    return logger
+
+
+def test_submeter_coletar_hidratar_offline(lotes_dir, historico):
+    agent = RoteiristaAgent(None, model_id="gemini-2.0-flash", table_prefix="nw3d_")
+    provedor = LocalBatchProvider(lotes_dir, responder=None)
+    itens = [ItemLote("240304700"), ItemLote("240305700", sub_skus="240305701"), ItemLote("240306800")]
+    fichas = [{"text": f"Ficha do produto {i.codigo}", "images": []} for i in itens]
+
+    trabalho = submeter_trabalho(agent, itens, fichas, provedor=provedor, modo_trabalho="NW (NewWeb)", mes="ABR", com_lu=True)
+    assert trabalho.parametros["table_prefix"] == "nw3d_"
+    assert TrabalhoLote.carregar(trabalho.id).itens == trabalho.itens
+    with open(os.path.join(trabalho.job_ref, "requests.jsonl"), encoding="utf-8") as f:
+        assert len(f.readlines()) == 3
+
+    # Sem results.jsonl o job segue em processamento
+    assert coletar_trabalho(agent, trabalho, provedor=provedor) is None
+
+    ids = [m["custom_id"] for m in trabalho.itens]
+    with open(os.path.join(trabalho.job_ref, "results.jsonl"), "w", encoding="utf-8") as f:
+        f.write(json.dumps({"custom_id": ids[0], "texto": "Cliente: Magalu\nRoteirista: X\nProduto: Echo\n\n- Fala.", "tokens_in": 100, "tokens_out": 50}) + "\n")
+        f.write(json.dumps({"custom_id": ids[1], "erro": "bloqueado"}) + "\n")
+        f.write(json.dumps({"custom_id": ids[2], "texto": "Cliente: Magalu\nRoteirista: X\nProduto: Fone\n\n- Fala.", "tokens_in": 80, "tokens_out": 40}) + "\n")
+
+    resultados = coletar_trabalho(agent, trabalho, provedor=provedor)
+    assert [bool(r.get("erro")) for r in resultados] == [False, True, False]
+    assert "Produto: NW LU ABR 240304700 Echo" in resultados[0]["roteiro"]
+    assert sucessos(resultados) == 2
+
+    sp = SupabaseFalso()
+    cards = hidratar_trabalho(trabalho, resultados, sp, global_inicial=41)
+    assert [c["global_num"] for c in cards] == [41, 42]
+    assert [c["codigo"] for c in cards] == ["240304700", "240306800"]
+    assert TrabalhoLote.carregar(trabalho.id).hidratado
+
+    # Histórico vai para a tabela do prefixo salvo no envio
+    assert historico.descarregar(timeout_s=5)
+    assert [l["codigo_produto"] for l in sp.inseridas["nw3d_historico_roteiros"]] == ["240304700", "240306800"]
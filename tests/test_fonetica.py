@@ -0,0 +1,50 @@
+from src.fonetica import DicionarioFonetico, aplicar_fonetica
+
+REGRAS = [
+    {"termo_errado": "Echo Dot", "termo_corrigido": "Echo Dot (écou dót)"},
+    {"termo_errado": "LED", "termo_corrigido": "(léd)"},
+    {"termo_errado": "85W", "termo_corrigido": "3 velocidades"},
+]
+ROTEIRO = (
+    "Cliente: Magalu\n"
+    "Roteirista: Tiago Fernandes - Data: 01/02/26\n"
+    "Produto: NW LU MAR 123456789 Echo Dot\n"
+    "\n"
+    "- O echo dot tem luz de LED e 85W de potência.\n"
+    "- Outro LED aqui e o Echo Dot de novo."
+)
+
+
+def _aplicar(texto):
+    return aplicar_fonetica(texto, DicionarioFonetico(REGRAS))
+
+
+def test_substitui_termo_que_contem_a_correcao():
+    texto, aplicados = _aplicar(ROTEIRO)
+    assert "- O echo dot (écou dót) tem" in texto
+    assert "Echo Dot" in aplicados
+
+
+def test_dica_entre_parenteses_e_anotada_sem_apagar_o_termo():
+    texto, aplicados = _aplicar(ROTEIRO)
+    assert "luz de LED (léd) e" in texto
+    assert "- Outro LED aqui" in texto
+    assert "LED" in aplicados
+
+
+def test_valor_que_nao_e_dica_fica_de_fora():
+    texto, aplicados = _aplicar(ROTEIRO)
+    assert "e 85W de potência" in texto
+    assert "85W" not in aplicados
+
+
+def test_cabecalho_nao_e_alterado():
+    texto, _ = _aplicar(ROTEIRO)
+    assert texto.splitlines()[:3] == ROTEIRO.splitlines()[:3]
+
+
+def test_segunda_aplicacao_nao_muda_o_texto():
+    uma_vez, _ = _aplicar(ROTEIRO)
+    duas_vezes, aplicados = _aplicar(uma_vez)
+    assert duas_vezes == uma_vez
+    assert aplicados == []
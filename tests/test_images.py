@@ -0,0 +1,96 @@
+import io
+import os
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from src import images
+from src.cache import PersistentCache
+from src.images import comprimir, obter_imagens, processar_imagem
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "imagens")
+FRENTE = os.path.join(FIXTURES, "geladeira_frente.jpg")
+# Mesma foto reduzida para 400x300 e recomprimida: quase-duplicata da frente
+FRENTE_REDUZIDA = Path(FIXTURES, "geladeira_frente_400.jpg").as_uri()
+LATERAL = os.path.join(FIXTURES, "geladeira_lateral.png")
+CORROMPIDA = os.path.join(FIXTURES, "corrompida.jpg")
+
+
+@pytest.fixture
+def cache_imagens(tmp_path, monkeypatch):
+    cache = PersistentCache("imagens", 3600, path=str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(images, "imagens_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def leituras(monkeypatch):
+    lidas = []
+    ler_origem = images.ler_origem
+
+    def _contar(origem):
+        lidas.append(origem)
+        return ler_origem(origem)
+
+    monkeypatch.setattr(images, "ler_origem", _contar)
+    return lidas
+
+
+@pytest.mark.parametrize("max_bytes", [60_000, 20_000, 8_000])
+def test_comprimir_cabe_no_orcamento(max_bytes):
+    assert os.path.getsize(FRENTE) > max_bytes
+    with Image.open(FRENTE) as img:
+        dados = comprimir(img, max_lado=768, max_bytes=max_bytes)
+    assert len(dados) <= max_bytes
+    with Image.open(io.BytesIO(dados)) as saida:
+        assert saida.format == "JPEG"
+        assert max(saida.size) <= 768
+
+
+def test_png_transparente_vira_jpeg_com_fundo_branco():
+    with open(LATERAL, "rb") as f:
+        dados, _ = processar_imagem(f.read())
+    with Image.open(io.BytesIO(dados)) as saida:
+        assert saida.mode == "RGB"
+        r, g, b = saida.getpixel((5, 5))
+        assert min(r, g, b) > 240
+
+
+def test_imagem_corrompida_e_ignorada():
+    with open(CORROMPIDA, "rb") as f:
+        assert processar_imagem(f.read()) is None
+
+
+def test_obter_imagens_descarta_quase_duplicata_pelo_dhash(cache_imagens):
+    resultado = obter_imagens("240304700", [FRENTE, FRENTE_REDUZIDA, CORROMPIDA, LATERAL, FRENTE])
+
+    assert [i["url"] for i in resultado] == [FRENTE, LATERAL]
+    assert all(i["mime"] == "image/jpeg" and len(i["bytes"]) <= images.IMAGENS_MAX_BYTES for i in resultado)
+
+
+def test_obter_imagens_respeita_o_limite(cache_imagens):
+    assert [i["url"] for i in obter_imagens("240304700", [LATERAL, FRENTE], limite=1)] == [LATERAL]
+
+
+def test_cache_por_sku(cache_imagens, leituras):
+    primeira = obter_imagens("240304700", [FRENTE, LATERAL])
+    assert len(leituras) == 2
+
+    # Cache hit: nada é relido, mesmo sem origens, e os bytes voltam iguais
+    segunda = obter_imagens("240304700", [])
+    assert len(leituras) == 2
+    assert [(i["url"], i["bytes"]) for i in segunda] == [(i["url"], i["bytes"]) for i in primeira]
+
+    # Outro SKU não aproveita o cache deste
+    obter_imagens("240305700", [LATERAL])
+    assert len(leituras) == 3
+
+    # force_refresh ignora o cache e regrava
+    assert [i["url"] for i in obter_imagens("240304700", [LATERAL], force_refresh=True)] == [LATERAL]
+    assert [i["url"] for i in obter_imagens("240304700", [FRENTE])] == [LATERAL]
+
+
+def test_sku_sem_imagens_validas_nao_e_cacheado(cache_imagens):
+    assert obter_imagens("240304700", [CORROMPIDA]) == []
+    assert images.imagens_em_cache("240304700") is None
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from src.pagina_produto import PaginaProduto
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "paginas")
+URL = "https://www.magazineluiza.com.br/produto/p/240304700/"
+
+
+def _pagina(nome: str) -> PaginaProduto:
+    with open(os.path.join(FIXTURES, nome), encoding="utf-8") as f:
+        return PaginaProduto(f.read(), url=URL)
+
+
+FICHA_JSON_LD = """\
+TÍTULO: Smart Speaker Amazon Echo Dot 5ª Geração com Alexa
+MARCA: Amazon
+LINHA/NOME COMERCIAL: N/A
+DESCRIÇÃO: O Echo Dot com o melhor som já lançado. Controle sua casa inteligente com a voz.
+FICHA TÉCNICA:
+- Conectividade: Wi-Fi, Bluetooth
+- Assistente virtual: Alexa
+- Voltagem: Bivolt
+- Potência: 15
+
+VOLTAGEM: Bivolt
+CORES DISPONÍVEIS: Preto, Azul, Branco
+FEATURES PRÁTICAS: Ver ficha técnica e descrição"""
+
+FICHA_NEXT_DATA = """\
+TÍTULO: Geladeira/Refrigerador Brastemp Frost Free Duplex 375L Inox BRM44HK
+MARCA: Brastemp
+LINHA/NOME COMERCIAL: Brastemp Inverse
+DESCRIÇÃO: Refrigerador com Turbo Ice e Freeze Control Pro & gavetão de legumes.
+FICHA TÉCNICA:
+- Capacidade total: 375 litros
+- Capacidade do freezer: 88 litros
+- Degelo: Frost Free
+- Linha: Brastemp Inverse
+- Eficiência energética: A
+
+VOLTAGEM: 110V / 220V
+CORES DISPONÍVEIS: Inox, Branco
+FEATURES PRÁTICAS: Ver ficha técnica e descrição"""
+
+FICHA_TABELA = """\
+TÍTULO: Fone de Ouvido Bluetooth JBL Tune 520BT Preto
+MARCA: JBL
+LINHA/NOME COMERCIAL: N/A
+DESCRIÇÃO: Não informado
+FICHA TÉCNICA:
+- Marca: JBL
+- Modelo: Tune 520BT
+- Cor: Preto
+- Autonomia: Até 57 horas
+- Conexão: Bluetooth 5.3
+- Tensão: 5 v
+
+VOLTAGEM: 5V
+CORES DISPONÍVEIS: Apenas Preto
+FEATURES PRÁTICAS: Ver ficha técnica e descrição"""
+
+
+@pytest.mark.parametrize("arquivo, esperada", [
+    # schema.org Product dentro de @graph: additionalProperty repetida, descrição em HTML, variantes de cor
+    ("json_ld.html", FICHA_JSON_LD),
+    # factsheet em árvore do Next.js e seletores de cor/voltagem em "attributes"
+    ("next_data.html", FICHA_NEXT_DATA),
+    # Só tabela de especificação (tr com th/td e dl/dt/dd); título vem do og:title
+    ("tabela.html", FICHA_TABELA),
+])
+def test_ficha_texto(arquivo, esperada):
+    assert _pagina(arquivo).ficha_texto() == esperada
+
+
+def test_pagina_sem_ficha_pede_grounding():
+    pagina = _pagina("sem_ficha.html")
+    assert pagina.ficha_texto() is None
+    assert pagina.urls_imagens() == []
+
+
+def test_urls_imagens():
+    assert _pagina("json_ld.html").urls_imagens() == [
+        "https://a-static.mlcdn.com.br/800x560/echo-dot-5/1.jpg",
+        "https://www.magazineluiza.com.br/800x560/echo-dot-5/2.jpg",
+        "https://a-static.mlcdn.com.br/800x560/echo-dot-5/og.jpg",
+    ]
+    # Modelos de URL com placeholder ({w}x{h}) ficam de fora
+    assert _pagina("next_data.html").urls_imagens() == ["https://a-static.mlcdn.com.br/800x560/geladeira-brastemp/2.jpg"]
+    assert _pagina("tabela.html").urls_imagens() == ["https://a-static.mlcdn.com.br/800x560/fone-jbl/1.jpg"]
+
+
+def test_ficha_texto_reaproveita_campos():
+    pagina = _pagina("tabela.html")
+    campos = pagina.campos()
+    campos["cores"] = []
+    assert pagina.ficha_texto(campos).endswith("CORES DISPONÍVEIS: Não informado\nFEATURES PRÁTICAS: Ver ficha técnica e descrição")
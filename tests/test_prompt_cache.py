@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from src.agent import RoteiristaAgent
+from src.batch import ItemLote, MotorLote
+from src.prompt_cache import PrefixCacheOffline
+
+ROTEIRO = "Cliente: Magalu\nRoteirista: X\nProduto: Echo\n\n- Fala."
+
+
+class _Resposta:
+    def __init__(self, texto):
+        self.text = texto
+
+
+class ModelosFalsos:
+    """generate_content que registra cada chamada; falha enquanto `recusar_cache` e a chamada usa cached_content."""
+
+    def __init__(self, recusar_cache=False):
+        self.recusar_cache = recusar_cache
+        self.chamadas = []
+        self._lock = threading.Lock()
+
+    def generate_content(self, model, contents, config=None):
+        nome_cache = getattr(config, "cached_content", None)
+        with self._lock:
+            self.chamadas.append((nome_cache, contents[0]))
+        if nome_cache and self.recusar_cache:
+            raise RuntimeError("404 CachedContent not found")
+        return _Resposta(ROTEIRO)
+
+
+class ClienteGeminiFalso:
+    def __init__(self, modelos):
+        self.models = modelos
+
+
+def _ficha(codigo, *, api_key=None, force_refresh=False):
+    return {"text": f"Ficha técnica do produto {codigo}", "images": []}
+
+
+@pytest.fixture
+def agente():
+    agent = RoteiristaAgent(None, model_id="gemini-2.0-flash")
+    agent.prefix_cache = PrefixCacheOffline()
+    return agent
+
+
+def _executar_lote(agent, codigos):
+    motor = MotorLote(agent, max_workers=2, scraper=_ficha)
+    eventos = list(motor.executar([ItemLote(c) for c in codigos], modo_trabalho="NW (NewWeb)", mes="ABR"))
+    return [e for e in eventos if e.tipo == "concluido"]
+
+
+def test_dois_skus_no_lote_criam_uma_entrada_de_cache(agente):
+    modelos = ModelosFalsos()
+    agente.client_gemini = ClienteGeminiFalso(modelos)
+
+    concluidos = _executar_lote(agente, ["240304700", "240305700"])
+
+    assert [e.erro for e in concluidos] == [None, None]
+    assert len(agente.prefix_cache.criados) == 1
+    nomes = {nome for nome, _ in modelos.chamadas}
+    assert len(modelos.chamadas) == 2 and len(nomes) == 1 and None not in nomes
+    # Com o prefixo cacheado, cada SKU envia só a sua parte do prompt
+    sufixos = {
+        agente._montar_prompt(_ficha(c), "NW (NewWeb)", "ABR", None, c, None, None, True)[1] for c in ["240304700", "240305700"]
+    }
+    assert {conteudo for _, conteudo in modelos.chamadas} == sufixos
+
+
+def test_falha_no_cache_reenvia_prompt_inline(agente):
+    modelos = ModelosFalsos(recusar_cache=True)
+    agente.client_gemini = ClienteGeminiFalso(modelos)
+    prefixo, sufixo, _ = agente._montar_prompt(_ficha("240304700"), "NW (NewWeb)", "ABR", None, "240304700", None, None, True)
+
+    resultado = agente.gerar_roteiro(_ficha("240304700"), modo_trabalho="NW (NewWeb)", mes="ABR", codigo="240304700")
+
+    assert "Echo" in resultado["roteiro"]
+    (cache_usado, so_sufixo), (sem_cache, inline) = modelos.chamadas
+    assert cache_usado and so_sufixo == sufixo
+    assert sem_cache is None and inline == prefixo + sufixo
+    # O cache recusado é esquecido: a próxima chamada recria em vez de reusar o nome inválido
+    assert len(agente.prefix_cache.criados) == 1
+    agente.gerar_roteiro(_ficha("240304700"), modo_trabalho="NW (NewWeb)", mes="ABR", codigo="240304700")
+    assert len(agente.prefix_cache.criados) == 2
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from src import scraper
+from src.cache import PersistentCache
+from src.router import TodasRotasFalharam
+
+FICHA = "TÍTULO: Echo Dot\nMARCA: Amazon\nFICHA TÉCNICA:\n- Conectividade: Wi-Fi\n- Assistente: Alexa\n"
+
+
+class _Resposta:
+    candidates = None
+
+    def __init__(self, texto):
+        self.text = texto
+
+
+def _sync(codigo, **kwargs):
+    return scraper.scrape_with_gemini(codigo, **kwargs)
+
+
+def _async(codigo, **kwargs):
+    return asyncio.run(scraper.scrape_with_gemini_async(codigo, **kwargs))
+
+
+@pytest.fixture(params=[_sync, _async], ids=["sync", "async"])
+def scrape(request):
+    return request.param
+
+
+@pytest.fixture
+def ambiente(tmp_path, monkeypatch):
+    """Cache isolado, sem imagens e sem rede: a página direta não responde e o cliente é falso."""
+    monkeypatch.setattr(scraper, "scrape_cache", PersistentCache("scrape", 3600, path=str(tmp_path / "cache.sqlite")))
+    monkeypatch.setattr(scraper, "IMAGENS_ATIVO", False)
+    monkeypatch.setattr(scraper, "_html_pagina", lambda url, timeout=10: None)
+    monkeypatch.setattr(scraper, "get_gemini_client", lambda api_key, timeout_ms=None: object())
+    chamadas = []
+
+    def _responder(respostas):
+        def _gerar(client, tarefa, contents, config=None):
+            chamadas.append(tarefa)
+            resposta = respostas[tarefa]
+            if isinstance(resposta, Exception):
+                raise resposta
+            return _Resposta(resposta)
+
+        async def _gerar_async(client, tarefa, contents, config=None):
+            return _gerar(client, tarefa, contents, config)
+
+        monkeypatch.setattr(scraper, "_gerar_com_fallback", _gerar)
+        monkeypatch.setattr(scraper, "_gerar_com_fallback_async", _gerar_async)
+        return chamadas
+
+    return _responder
+
+
+def test_grounding_e_cache(scrape, ambiente):
+    chamadas = ambiente({"scrape_grounding": FICHA})
+
+    resultado = scrape("240304700", api_key="chave")
+    assert resultado["text"] == FICHA
+    assert resultado["sheet"].codigo == "240304700"
+    assert chamadas == ["scrape_grounding"]
+
+    # Segunda vez vem do cache, sem chamar o modelo
+    assert scrape("240304700", api_key="chave")["text"] == FICHA
+    assert chamadas == ["scrape_grounding"]
+
+
+def test_grounding_sem_rotas_cai_no_prompt_direto(scrape, ambiente):
+    chamadas = ambiente({
+        "scrape_grounding": TodasRotasFalharam("scrape_grounding", [("gemini/gemini-2.5-flash", RuntimeError("503"))]),
+        "scrape_direto": FICHA,
+    })
+
+    assert scrape("240304700", api_key="chave")["text"] == FICHA
+    assert chamadas == ["scrape_grounding", "scrape_direto"]
+
+
+def test_erro_inesperado_vira_ficha_de_erro(scrape, ambiente):
+    ambiente({"scrape_grounding": "curto", "scrape_direto": RuntimeError("quota")})
+
+    resultado = scrape("240304700", api_key="chave")
+    assert resultado == {"text": "❌ Erro Crítico no Scraper: quota", "images": []}
+
+
+def test_produto_nao_encontrado_tem_cache_negativo(scrape, ambiente):
+    chamadas = ambiente({"scrape_grounding": "ERRO: Produto não encontrado ou dados indisponíveis.", "scrape_direto": "FALHA_TOTAL"})
+
+    resultado = scrape("240304700", api_key="chave")
+    assert resultado["text"].startswith("⚠️ EXTRAÇÃO AUTOMÁTICA FALHOU")
+    assert scraper.ficha_cacheada("240304700") is None
+    assert scrape("240304700", api_key="chave")["text"] == resultado["text"]
+    assert chamadas == ["scrape_grounding", "scrape_direto"]